@@ -0,0 +1,106 @@
+import math
+import random
+import torch
+from torch import nn
+import torch.nn.functional as F
+
+
+def hard_schedule(image_iteration):
+	"""
+	Augmentation strengths of the TCP.augment.hard schedule after image_iteration training images.
+	"""
+	iteration = image_iteration/32
+	return {
+		'frequency': min(0.05 + float(iteration)/200000.0, 1.0),
+		'color': min(float(iteration)/1000000.0, 1.0),
+		'dropout': 0.198667 + (0.03856658 - 0.198667) / (1 + (iteration / 196416.6) ** 1.863486),
+		'blur': min(0.5 + (0.5*iteration/100000.0), 1.0),
+		'add': 10 + 10*iteration/100000.0,
+		'multiply_pos': 1 + (2.5*iteration/200000.0),
+		'multiply_neg': 1 - (0.91 * iteration / 500000.0),
+		'contrast_pos': 1 + (0.5*iteration/500000.0),
+		'contrast_neg': 1 - (0.5 * iteration / 500000.0),
+	}
+
+
+class BatchAugmenter(nn.Module):
+	"""
+	Batched tensor version of the TCP.augment.hard imgaug pipeline, so it can run on the training device.
+	Takes float images in [0, 255] of shape [B, 3, H, W]. Every augmenter is applied to each sample with the
+	scheduled frequency, and per channel with the scheduled color probability. The augmenter order is
+	shuffled once per batch instead of once per image.
+	"""
+
+	def forward(self, images, image_iteration):
+		factors = hard_schedule(image_iteration)
+		augmenters = [self._blur, self._additive_noise, self._coarse_dropout, self._dropout,
+					  self._add, self._multiply, self._contrast, self._grayscale]
+		for i in torch.randperm(len(augmenters)).tolist():
+			# computed for the whole batch and selected per sample, which avoids a host sync per augmenter
+			apply = self._rand(images, images.shape[0], 1, 1, 1) < factors['frequency']
+			images = torch.where(apply, augmenters[i](images, factors).clamp(0, 255).to(images.dtype), images)
+		return images
+
+	def _rand(self, images, *shape):
+		return torch.rand(shape, device=images.device, dtype=images.dtype)
+
+	def _uniform(self, images, low, high, *shape):
+		return low + (high - low) * self._rand(images, *shape)
+
+	def _per_channel(self, images, values, factors):
+		""" values is [B, C, ...], keep the first channel for samples that do not augment per channel """
+		shared = self._rand(images, images.shape[0], 1, 1, 1) >= factors['color']
+		return torch.where(shared, values[:, :1].expand_as(values), values)
+
+	def _blur(self, images, factors):
+		B, C, H, W = images.shape
+		radius = max(1, math.ceil(3 * factors['blur']))
+		sigma = self._uniform(images, 0, factors['blur'], B, 1).clamp(min=1e-2)
+		x = torch.arange(-radius, radius + 1, device=images.device, dtype=images.dtype)
+		kernel = torch.exp(-x.view(1, -1) ** 2 / (2 * sigma ** 2))
+		kernel = (kernel / kernel.sum(1, keepdim=True)).repeat_interleave(C, 0)
+
+		# separable gaussian with one kernel per sample, as a grouped convolution over B*C channels
+		out = F.pad(images.reshape(1, B * C, H, W), (radius, radius, radius, radius), mode='reflect')
+		out = F.conv2d(out, kernel.view(B * C, 1, 1, -1), groups=B * C)
+		out = F.conv2d(out, kernel.view(B * C, 1, -1, 1), groups=B * C)
+		return out.view(B, C, H, W)
+
+	def _additive_noise(self, images, factors):
+		scale = self._uniform(images, 0, factors['dropout'], images.shape[0], 1, 1, 1)
+		noise = self._per_channel(images, torch.randn_like(images), factors)
+		return images + noise * scale
+
+	def _coarse_dropout(self, images, factors):
+		B, C, H, W = images.shape
+		p = self._uniform(images, 0, factors['dropout'], B, 1, 1, 1)
+		size_percent = random.uniform(0.08, 0.2)
+		size = (max(1, round(H * size_percent)), max(1, round(W * size_percent)))
+		keep = self._per_channel(images, (self._rand(images, B, C, *size) >= p).to(images.dtype), factors)
+		return images * F.interpolate(keep, size=(H, W), mode='nearest')
+
+	def _dropout(self, images, factors):
+		p = self._uniform(images, 0, factors['dropout'], images.shape[0], 1, 1, 1)
+		keep = self._per_channel(images, (torch.rand_like(images) >= p).to(images.dtype), factors)
+		return images * keep
+
+	def _add(self, images, factors):
+		B, C = images.shape[:2]
+		value = self._per_channel(images, self._uniform(images, -factors['add'], factors['add'], B, C, 1, 1), factors)
+		return images + value
+
+	def _multiply(self, images, factors):
+		B, C = images.shape[:2]
+		value = self._per_channel(images, self._uniform(images, factors['multiply_neg'], factors['multiply_pos'], B, C, 1, 1), factors)
+		return images * value
+
+	def _contrast(self, images, factors):
+		B, C = images.shape[:2]
+		alpha = self._per_channel(images, self._uniform(images, factors['contrast_neg'], factors['contrast_pos'], B, C, 1, 1), factors)
+		return 128 + alpha * (images - 128)
+
+	def _grayscale(self, images, factors):
+		alpha = self._rand(images, images.shape[0], 1, 1, 1)
+		weights = torch.tensor([0.299, 0.587, 0.114], device=images.device, dtype=images.dtype).view(1, 3, 1, 1)
+		gray = (images * weights).sum(1, keepdim=True)
+		return images + alpha * (gray - images)
@@ -57,6 +57,14 @@ class GlobalConfig:
 	rl_ckpt = "roach/log/ckpt_11833344.pth"
 
 	img_aug = True
+	gpu_aug = True # run img_aug as batched tensor ops in TCP_planner instead of imgaug in the data workers
+	img_shards = True # read front images from tools/bake_images.py shards when available
+
+	# stream the training set route by route (TCP.data.CARLA_Stream) instead of random frame access
+	stream_data = False
+	stream_chunk_len = 32 # consecutive frames read per route chunk
+	stream_shuffle_buffer = 512 # samples held per worker, raise with care when images are normalized on the CPU
+	stream_prefetch = 64 # samples read ahead per worker
 
 
 	def __init__(self, **kwargs):
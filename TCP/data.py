@@ -1,179 +1,184 @@
 import os
+import queue
+import random
+import itertools
+import threading
 from PIL import Image
 import numpy as np
 import torch 
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, IterableDataset, get_worker_info
 from torchvision import transforms as T
 
 from TCP.augment import hard as augmenter
+from TCP.packed import load_packed, load_image_shards
 
 class CARLA_Data(Dataset):
 
-	def __init__(self, root, data_folders, img_aug = False):
+	def __init__(self, root, data_folders, img_aug = False, img_shards = False, normalize_img = True):
 		self.root = root
 		self.img_aug = img_aug
+		# without normalization front_img stays a uint8 [3, H, W] tensor, augmented and normalized on the training device
+		self.normalize_img = normalize_img
 		self._batch_read_number = 0
 
-		self.front_img = []
-		self.x = []
-		self.y = []
-		self.command = []
-		self.target_command = []
-		self.target_gps = []
-		self.theta = []
-		self.speed = []
-
-
-		self.value = []
-		self.feature = []
-		self.action = []
-		self.action_mu = []
-		self.action_sigma = []
-
-		self.future_x = []
-		self.future_y = []
-		self.future_theta = []
-
-		self.future_feature = []
-		self.future_action = []
-		self.future_action_mu = []
-		self.future_action_sigma = []
-		self.future_only_ap_brake = []
-
-		self.x_command = []
-		self.y_command = []
-		self.command = []
-		self.only_ap_brake = []
-
+		# columns of every town stay memory-mapped, a global index is resolved through the offsets
+		self._columns = []
+		self._shards = []
+		lengths = []
 		for sub_root in data_folders:
-			data = np.load(os.path.join(sub_root, "packed_data.npy"), allow_pickle=True).item()
-
-			self.x_command += data['x_target']
-			self.y_command += data['y_target']
-			self.command += data['target_command']
-
-			self.front_img += data['front_img']
-			self.x += data['input_x']
-			self.y += data['input_y']
-			self.theta += data['input_theta']
-			self.speed += data['speed']
-
-			self.future_x += data['future_x']
-			self.future_y += data['future_y']
-			self.future_theta += data['future_theta']
-
-			self.future_feature += data['future_feature']
-			self.future_action += data['future_action']
-			self.future_action_mu += data['future_action_mu']
-			self.future_action_sigma += data['future_action_sigma']
-			self.future_only_ap_brake += data['future_only_ap_brake']
-
-			self.value += data['value']
-			self.feature += data['feature']
-			self.action += data['action']
-			self.action_mu += data['action_mu']
-			self.action_sigma += data['action_sigma']
-			self.only_ap_brake += data['only_ap_brake']
+			columns = load_packed(sub_root)
+			if len(columns['front_img']) == 0:
+				continue
+			self._columns.append(columns)
+			# pre-decoded frames from tools/bake_images.py, towns without valid shards decode the PNGs
+			self._shards.append(load_image_shards(sub_root, columns['front_img']) if img_shards else None)
+			lengths.append(len(columns['front_img']))
+		self._offsets = np.cumsum([0] + lengths)
+
 		self._im_transform = T.Compose([T.ToTensor(), T.Normalize(mean=[0.485,0.456,0.406], std=[0.229,0.224,0.225])])
 
 	def __len__(self):
 		"""Returns the length of the dataset. """
-		return len(self.front_img)
+		return int(self._offsets[-1])
+
+	def _locate(self, index):
+		part = np.searchsorted(self._offsets, index, side='right') - 1
+		return part, index - self._offsets[part]
+
+	def _read_front_img(self, part, index):
+		if self._shards[part] is not None:
+			shards, shard_size = self._shards[part]
+			return np.array(shards[index // shard_size][index % shard_size])
+		return np.array(Image.open(self.root+self._columns[part]['front_img'][index][0].decode()))
 
 	def __getitem__(self, index):
 		"""Returns the item at index idx. """
 		data = dict()
-		data['front_img'] = self.front_img[index]
+		part, index = self._locate(index)
+		col = self._columns[part]
+		front_img = self._read_front_img(part, index)
 
 		if self.img_aug:
-			data['front_img'] = self._im_transform(augmenter(self._batch_read_number).augment_image(np.array(
-					Image.open(self.root+self.front_img[index][0]))))
+			front_img = augmenter(self._batch_read_number).augment_image(front_img)
+		if self.normalize_img:
+			data['front_img'] = self._im_transform(front_img)
 		else:
-			data['front_img'] = self._im_transform(np.array(
-					Image.open(self.root+self.front_img[index][0])))
-
-		# fix for theta=nan in some measurements
-		if np.isnan(self.theta[index][0]):
-			self.theta[index][0] = 0.
-
-		ego_x = self.x[index][0]
-		ego_y = self.y[index][0]
-		ego_theta = self.theta[index][0]
-
-		waypoints = []
-		for i in range(4):
-			R = np.array([
-			[np.cos(np.pi/2+ego_theta), -np.sin(np.pi/2+ego_theta)],
-			[np.sin(np.pi/2+ego_theta),  np.cos(np.pi/2+ego_theta)]
-			])
-			local_command_point = np.array([self.future_y[index][i]-ego_y, self.future_x[index][i]-ego_x] )
-			local_command_point = R.T.dot(local_command_point)
-			waypoints.append(local_command_point)
-
-		data['waypoints'] = np.array(waypoints)
-
-		data['action'] = self.action[index]
-		data['action_mu'] = self.action_mu[index]
-		data['action_sigma'] = self.action_sigma[index]
-
-
-		future_only_ap_brake = self.future_only_ap_brake[index]
-		future_action_mu = self.future_action_mu[index]
-		future_action_sigma = self.future_action_sigma[index]
-
-		# use the average value of roach braking action when the brake is only performed by the rule-based detector
-		for i in range(len(future_only_ap_brake)):
-			if future_only_ap_brake[i]:
-				future_action_mu[i][0] = 0.8
-				future_action_sigma[i][0] = 5.5
-		data['future_action_mu'] = future_action_mu
-		data['future_action_sigma'] = future_action_sigma
-		data['future_feature'] = self.future_feature[index]
-
-		only_ap_brake = self.only_ap_brake[index]
-		if only_ap_brake:
-			data['action_mu'][0] = 0.8
-			data['action_sigma'][0] = 5.5
-
-		R = np.array([
-			[np.cos(np.pi/2+ego_theta), -np.sin(np.pi/2+ego_theta)],
-			[np.sin(np.pi/2+ego_theta),  np.cos(np.pi/2+ego_theta)]
-			])
-		local_command_point = np.array([-1*(self.x_command[index]-ego_x), self.y_command[index]-ego_y] )
-		local_command_point = R.T.dot(local_command_point)
-		data['target_point'] = local_command_point[:2]
-
-
-		local_command_point_aim = np.array([(self.y_command[index]-ego_y), self.x_command[index]-ego_x] )
-		local_command_point_aim = R.T.dot(local_command_point_aim)
-		data['target_point_aim'] = local_command_point_aim[:2]
-
-		data['target_point'] = local_command_point_aim[:2]
-
-		data['speed'] = self.speed[index]
-		data['feature'] = self.feature[index]
-		data['value'] = self.value[index]
-		command = self.command[index]
-
-		# VOID = -1
-		# LEFT = 1
-		# RIGHT = 2
-		# STRAIGHT = 3
-		# LANEFOLLOW = 4
-		# CHANGELANELEFT = 5
-		# CHANGELANERIGHT = 6
-		if command < 0:
-			command = 4
-		command -= 1
-		assert command in [0, 1, 2, 3, 4, 5]
-		cmd_one_hot = [0] * 6
-		cmd_one_hot[command] = 1
-		data['target_command'] = torch.tensor(cmd_one_hot)		
+			data['front_img'] = torch.from_numpy(np.ascontiguousarray(front_img.transpose(2, 0, 1)))
+
+		# ego-frame targets and brake overrides are precomputed by TCP.packed.derive_columns
+		data['waypoints'] = np.array(col['waypoints'][index])
+		data['target_point'] = np.array(col['target_point'][index])
+		data['target_point_aim'] = data['target_point']
+		data['target_command'] = torch.from_numpy(np.array(col['command_one_hot'][index]))
+
+		data['action'] = np.array(col['action'][index])
+		data['action_mu'] = np.array(col['supervised_action_mu'][index])
+		data['action_sigma'] = np.array(col['supervised_action_sigma'][index])
+		data['future_action_mu'] = np.array(col['supervised_future_action_mu'][index])
+		data['future_action_sigma'] = np.array(col['supervised_future_action_sigma'][index])
+		data['future_feature'] = np.array(col['future_feature'][index])
+
+		data['speed'] = np.array(col['speed'][index])
+		data['feature'] = np.array(col['feature'][index])
+		data['value'] = np.array(col['value'][index])
 
 		self._batch_read_number += 1
 		return data
 
 
+class CARLA_Stream(IterableDataset):
+	"""
+	Route-level streaming view of a CARLA_Data for network storage.
+	Routes are cut into chunks of consecutive frames. Every epoch the chunks are shuffled with the same
+	seed on all ranks and the shuffled frame sequence is split into equal pieces, one per DDP rank and
+	DataLoader worker. Each worker reads its piece sequentially with a read-ahead thread and yields
+	samples through a shuffle buffer.
+	"""
+
+	def __init__(self, dataset, num_workers, chunk_len=32, shuffle_buffer=512, prefetch=64, seed=0):
+		self.dataset = dataset
+		self.num_workers = max(1, num_workers)
+		self.shuffle_buffer = max(1, shuffle_buffer)
+		self.prefetch = prefetch
+		self.seed = seed
+		self.epoch = 0
+
+		chunks = []
+		for part, columns in enumerate(dataset._columns):
+			route_id = np.asarray(columns['route_id'])
+			starts = np.flatnonzero(np.r_[True, route_id[1:] != route_id[:-1]])
+			ends = np.r_[starts[1:], len(route_id)]
+			for start, end in zip(starts + dataset._offsets[part], ends + dataset._offsets[part]):
+				for chunk_start in range(start, end, chunk_len):
+					chunks.append((chunk_start, min(chunk_start + chunk_len, end)))
+		self._chunks = np.array(chunks, dtype=np.int64).reshape(-1, 2)
+
+	def set_epoch(self, epoch):
+		self.epoch = epoch
+
+	def _world(self):
+		if torch.distributed.is_available() and torch.distributed.is_initialized():
+			return torch.distributed.get_world_size(), torch.distributed.get_rank()
+		return 1, 0
+
+	def __len__(self):
+		"""Returns the number of samples of this rank. """
+		world_size, _ = self._world()
+		return len(self.dataset) // (world_size * self.num_workers) * self.num_workers
+
+	def _slot_indices(self, slot, num_slots):
+		chunks = self._chunks[np.random.RandomState(self.seed + self.epoch).permutation(len(self._chunks))]
+		chunk_ends = np.cumsum(chunks[:, 1] - chunks[:, 0])
+		piece = int(chunk_ends[-1]) // num_slots if len(chunks) else 0
+		first, last = slot * piece, (slot + 1) * piece
+
+		# pieces are cut out of the shuffled chunk sequence, so at most two chunks per piece are partial
+		for c in range(np.searchsorted(chunk_ends, first, side='right'), len(chunks)):
+			start, end = chunks[c]
+			chunk_begin = chunk_ends[c] - (end - start)
+			if chunk_begin >= last:
+				break
+			for index in range(start + max(0, first - chunk_begin), start + min(end - start, last - chunk_begin)):
+				yield int(index)
+
+	def _read_ahead(self, indices, samples):
+		try:
+			for index in indices:
+				samples.put(self.dataset[index])
+		except Exception as e:
+			samples.put(e)
+		samples.put(None)
+
+	def __iter__(self):
+		world_size, rank = self._world()
+		worker_info = get_worker_info()
+		worker_id, num_workers = (0, 1) if worker_info is None else (worker_info.id, worker_info.num_workers)
+		# with fewer processes than configured workers one process reads several slots
+		slots = [rank * self.num_workers + w for w in range(worker_id, self.num_workers, num_workers)]
+		indices = itertools.chain.from_iterable(self._slot_indices(slot, world_size * self.num_workers) for slot in slots)
+
+		samples = queue.Queue(maxsize=self.prefetch)
+		threading.Thread(target=self._read_ahead, args=(indices, samples), daemon=True).start()
+
+		rng = random.Random(self.seed + self.epoch * 100003 + slots[0])
+		buffer = []
+		while True:
+			sample = samples.get()
+			if sample is None:
+				break
+			if isinstance(sample, Exception):
+				raise sample
+			if len(buffer) < self.shuffle_buffer:
+				buffer.append(sample)
+				continue
+			i = rng.randrange(len(buffer))
+			yield buffer[i]
+			buffer[i] = sample
+		rng.shuffle(buffer)
+		for sample in buffer:
+			yield sample
+
+
 def scale_and_crop_image(image, scale=1, crop_w=256, crop_h=256):
 	"""
 	Scale and crop a PIL image
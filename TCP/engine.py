@@ -0,0 +1,73 @@
+import numpy as np
+import torch
+
+from TCP.model import TCPExport
+
+
+class TCPEngine(object):
+	"""
+	Per-tick inference for the closed-loop agents. Runs a traced and frozen TCPExport graph on
+	device buffers that are allocated once, the camera frame is uploaded as uint8 through a pinned
+	staging buffer and normalized on the device.
+	"""
+	def __init__(self, net, image_shape=(256, 900, 3), device='cuda', script=True):
+		self.device = torch.device(device)
+		self.net = TCPExport(net).to(self.device).eval()
+		pin = self.device.type == 'cuda'
+
+		# host staging buffers, written in place every tick
+		self._host_img = torch.empty(image_shape, dtype=torch.uint8)
+		self._host_state = torch.zeros((1, 1+2+6), dtype=torch.float32)
+		if pin:
+			self._host_img = self._host_img.pin_memory()
+			self._host_state = self._host_state.pin_memory()
+		self._host_img_np = self._host_img.numpy()
+		self._host_state_np = self._host_state.numpy()
+
+		self._img = torch.empty(image_shape, dtype=torch.uint8, device=self.device)
+		self._state = torch.zeros((1, 1+2+6), dtype=torch.float32, device=self.device)
+		self._mean = torch.tensor([0.485,0.456,0.406], device=self.device).view(1,3,1,1)
+		self._std = torch.tensor([0.229,0.224,0.225], device=self.device).view(1,3,1,1)
+
+		self.graph = self.net
+		if script:
+			with torch.no_grad():
+				self.graph = torch.jit.freeze(torch.jit.trace(self.net, self._inputs()))
+
+	def _inputs(self):
+		# HWC uint8 -> normalized NCHW float, same as ToTensor + Normalize
+		img = self._img.permute(2, 0, 1).unsqueeze(0).float()
+		img = (img / 255. - self._mean) / self._std
+		return img, self._state, self._state[:, 1:3]
+
+	@torch.no_grad()
+	def warmup(self, iterations=3):
+		""" the profiling executor specializes the graph during the first runs, keep them out of the episode """
+		for _ in range(iterations):
+			self.graph(*self._inputs())
+		if self.device.type == 'cuda':
+			torch.cuda.synchronize(self.device)
+
+	@torch.no_grad()
+	def __call__(self, rgb, speed, target_point, command):
+		"""
+		rgb is the HxWx3 uint8 RGB frame, speed in m/s, target_point the ego-frame (x, y) and
+		command the 0-based command index. Returns the pred dict used by TCP.process_action and TCP.control_pid.
+		"""
+		np.copyto(self._host_img_np, rgb)
+		state = self._host_state_np[0]
+		state[:] = 0.
+		state[0] = speed / 12.
+		state[1:3] = target_point
+		state[3 + command] = 1.
+		# the caller reads the outputs back before the next tick, so the staging buffers are free again
+		self._img.copy_(self._host_img, non_blocking=True)
+		self._state.copy_(self._host_state, non_blocking=True)
+
+		pred_wp, mu, sigma, pred_speed = self.graph(*self._inputs())
+		return {'pred_wp': pred_wp, 'mu_branches': mu, 'sigma_branches': sigma, 'pred_speed': pred_speed}
+
+	def export_onnx(self, path, opset_version=11):
+		torch.onnx.export(self.net, self._inputs(), path, opset_version=opset_version,
+						  input_names=['img', 'state', 'target_point'],
+						  output_names=['pred_wp', 'mu_branches', 'sigma_branches', 'pred_speed'])
@@ -136,7 +136,23 @@ class TCP(nn.Module):
 		
 
 	def forward(self, img, state, target_point):
+		outputs, traj_hidden_state, cnn_feature = self._forward_heads(img, state, target_point)
+		outputs['future_feature'], outputs['future_mu'], outputs['future_sigma'] = self._decode_future_ctrl(
+			outputs['pred_features_ctrl'], outputs['mu_branches'], outputs['sigma_branches'], traj_hidden_state, cnn_feature)
+		return outputs
+
+	def _attend(self, cnn_feature, att):
+		""" attention-weighted sum of the flattened [B, 512, 8*29] feature map with att [B, 8*29] """
+		return torch.einsum('bcn,bn->bc', cnn_feature, att)
+
+	def _forward_heads(self, img, state, target_point):
+		"""
+		Perception, waypoint decoder and the control heads of the current step,
+		everything the agent needs at inference.
+		"""
 		feature_emb, cnn_feature = self.perception(img)
+		# flattened once, the attention sums below are batched matmuls over it
+		cnn_feature = cnn_feature.flatten(2)
 		outputs = {}
 		outputs['pred_speed'] = self.speed_branch(feature_emb)
 		measurement_feature = self.measurements(state)
@@ -149,7 +165,7 @@ class TCP(nn.Module):
 		traj_hidden_state = list()
 
 		# initial input variable to GRU
-		x = torch.zeros(size=(z.shape[0], 2), dtype=z.dtype).type_as(z)
+		x = z.new_zeros((z.shape[0], 2))
 
 		# autoregressive generation of output waypoints
 		for _ in range(self.config.pred_len):
@@ -163,45 +179,47 @@ class TCP(nn.Module):
 		pred_wp = torch.stack(output_wp, dim=1)
 		outputs['pred_wp'] = pred_wp
 
-		traj_hidden_state = torch.stack(traj_hidden_state, dim=1)
-		init_att = self.init_att(measurement_feature).view(-1, 1, 8, 29)
-		feature_emb = torch.sum(cnn_feature*init_att, dim=(2, 3))
+		init_att = self.init_att(measurement_feature)
+		feature_emb = self._attend(cnn_feature, init_att)
 		j_ctrl = self.join_ctrl(torch.cat([feature_emb, measurement_feature], 1))
 		outputs['pred_value_ctrl'] = self.value_branch_ctrl(j_ctrl)
 		outputs['pred_features_ctrl'] = j_ctrl
 		policy = self.policy_head(j_ctrl)
-		outputs['mu_branches'] = self.dist_mu(policy)
-		outputs['sigma_branches'] = self.dist_sigma(policy)
-
-		x = j_ctrl
-		mu = outputs['mu_branches']
-		sigma = outputs['sigma_branches']
+		outputs['mu_branches'], outputs['sigma_branches'] = self._dist_heads(policy)
+		return outputs, traj_hidden_state, cnn_feature
+
+	def _decode_future_ctrl(self, x, mu, sigma, traj_hidden_state, cnn_feature):
+		"""
+		Autoregressive control decoder, each step feeds its feature and action distribution
+		into the next one. Only used as auxiliary supervision during training.
+		"""
 		future_feature, future_mu, future_sigma = [], [], []
 
 		# initial hidden variable to GRU
-		h = torch.zeros(size=(x.shape[0], 256), dtype=x.dtype).type_as(x)
+		h = x.new_zeros((x.shape[0], 256))
 
-		for _ in range(self.config.pred_len):
+		for i in range(self.config.pred_len):
 			x_in = torch.cat([x, mu, sigma], dim=1)
 			h = self.decoder_ctrl(x_in, h)
-			wp_att = self.wp_att(torch.cat([h, traj_hidden_state[:, _]], 1)).view(-1, 1, 8, 29)
-			new_feature_emb = torch.sum(cnn_feature*wp_att, dim=(2, 3))
+			wp_att = self.wp_att(torch.cat([h, traj_hidden_state[i]], 1))
+			new_feature_emb = self._attend(cnn_feature, wp_att)
 			merged_feature = self.merge(torch.cat([h, new_feature_emb], 1))
 			dx = self.output_ctrl(merged_feature)
 			x = dx + x
 
 			policy = self.policy_head(x)
-			mu = self.dist_mu(policy)
-			sigma = self.dist_sigma(policy)
+			mu, sigma = self._dist_heads(policy)
 			future_feature.append(x)
 			future_mu.append(mu)
 			future_sigma.append(sigma)
 
+		return future_feature, future_mu, future_sigma
 
-		outputs['future_feature'] = future_feature
-		outputs['future_mu'] = future_mu
-		outputs['future_sigma'] = future_sigma
-		return outputs
+	def _dist_heads(self, policy):
+		# the softplus heads parameterize the beta distributions, keep them in fp32 under autocast
+		with torch.cuda.amp.autocast(enabled=False):
+			policy = policy.float()
+			return self.dist_mu(policy), self.dist_sigma(policy)
 
 	def process_action(self, pred, command, speed, target_point):
 		action = self._get_action_beta(pred['mu_branches'].view(1,2), pred['sigma_branches'].view(1,2))
@@ -228,20 +246,13 @@ class TCP(nn.Module):
 		return steer, throttle, brake, metadata
 
 	def _get_action_beta(self, alpha, beta):
-		x = torch.zeros_like(alpha)
-		x[:, 1] += 0.5
-		mask1 = (alpha > 1) & (beta > 1)
-		x[mask1] = (alpha[mask1]-1)/(alpha[mask1]+beta[mask1]-2)
-
-		mask2 = (alpha <= 1) & (beta > 1)
-		x[mask2] = 0.0
-
-		mask3 = (alpha > 1) & (beta <= 1)
-		x[mask3] = 1.0
-
-		# mean
-		mask4 = (alpha <= 1) & (beta <= 1)
-		x[mask4] = alpha[mask4]/torch.clamp((alpha[mask4]+beta[mask4]), min=1e-5)
+		# mode of the beta distribution, its mean when both parameters are <= 1
+		# selected with torch.where so batches do not sync on data-dependent masks
+		mode = (alpha-1)/(alpha+beta-2)
+		mean = alpha/torch.clamp((alpha+beta), min=1e-5)
+		x = torch.where(alpha > 1,
+						torch.where(beta > 1, mode, torch.ones_like(alpha)),
+						torch.where(beta > 1, torch.zeros_like(alpha), mean))
 
 		x = x * 2 - 1
 
@@ -254,8 +265,9 @@ class TCP(nn.Module):
 			velocity (tensor): speedometer input
 		'''
 		assert(waypoints.size(0)==1)
-		waypoints = waypoints[0].data.cpu().numpy()
-		target = target.squeeze().data.cpu().numpy()
+		# .numpy() of a CPU tensor is a view, copy before the in-place flips below
+		waypoints = waypoints[0].data.cpu().numpy().copy()
+		target = target.squeeze().data.cpu().numpy().copy()
 
 		# flip y (forward is negative in our waypoints)
 		waypoints[:,1] *= -1
@@ -328,17 +340,26 @@ class TCP(nn.Module):
 
 
 	def get_action(self, mu, sigma):
-		action = self._get_action_beta(mu.view(1,2), sigma.view(1,2))
+		""" mu and sigma are [2] for a single sample or [B, 2], the controls are [1] or [B] """
+		action = self._get_action_beta(mu.view(-1,2), sigma.view(-1,2))
 		acc, steer = action[:, 0], action[:, 1]
-		if acc >= 0.0:
-			throttle = acc
-			brake = torch.zeros_like(acc)
-		else:
-			throttle = torch.zeros_like(acc)
-			brake = torch.abs(acc)
-
-		throttle = torch.clamp(throttle, 0, 1)
+		# positive acceleration is throttle, negative is brake
+		throttle = torch.clamp(acc, 0, 1)
 		steer = torch.clamp(steer, -1, 1)
-		brake = torch.clamp(brake, 0, 1)
+		brake = torch.clamp(-acc, 0, 1)
+
+		return throttle, steer, brake
 
-		return throttle, steer, brake
\ No newline at end of file
+
+class TCPExport(nn.Module):
+	"""
+	Inference view of TCP for torch.jit.trace and ONNX export. Returns the tuple
+	(pred_wp, mu_branches, sigma_branches, pred_speed) and skips the future control decoder.
+	"""
+	def __init__(self, model):
+		super().__init__()
+		self.model = model
+
+	def forward(self, img, state, target_point):
+		outputs, _, _ = self.model._forward_heads(img, state, target_point)
+		return outputs['pred_wp'], outputs['mu_branches'], outputs['sigma_branches'], outputs['pred_speed']
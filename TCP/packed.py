@@ -0,0 +1,235 @@
+import os
+import json
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+
+PACKED_DIR = "packed_data"
+LEGACY_FILE = "packed_data.npy"
+META_FILE = "meta.json"
+FORMAT_VERSION = 3
+
+# one contiguous column per field, first axis is the sample index
+FIELD_DTYPES = OrderedDict([
+	('front_img', np.bytes_), # string table of relative image paths, [N, INPUT_FRAMES]
+	('input_x', np.float32),
+	('input_y', np.float32),
+	('input_theta', np.float32),
+	('speed', np.float32),
+	('x_target', np.float32),
+	('y_target', np.float32),
+	('target_command', np.int8),
+	('future_x', np.float32),
+	('future_y', np.float32),
+	('future_theta', np.float32),
+	('future_feature', np.float32),
+	('future_action', np.float32),
+	('future_action_mu', np.float32),
+	('future_action_sigma', np.float32),
+	('future_only_ap_brake', np.bool_),
+	('feature', np.float32),
+	('value', np.float32),
+	('action', np.float32),
+	('action_mu', np.float32),
+	('action_sigma', np.float32),
+	('only_ap_brake', np.bool_),
+])
+
+# training targets computed once at pack time, see derive_columns
+DERIVED_DTYPES = OrderedDict([
+	('waypoints', np.float32), # future positions in the ego frame, [N, FUTURE_FRAMES, 2]
+	('target_point', np.float32), # [N, 2]
+	('command_one_hot', np.float32), # [N, 6]
+	('supervised_action_mu', np.float32),
+	('supervised_action_sigma', np.float32),
+	('supervised_future_action_mu', np.float32),
+	('supervised_future_action_sigma', np.float32),
+	('route_id', np.int32), # consecutive frames of one route share an id
+])
+
+
+def _to_column(name, values):
+	dtype = FIELD_DTYPES[name] if name in FIELD_DTYPES else DERIVED_DTYPES[name]
+	return np.ascontiguousarray(np.asarray(values, dtype=dtype))
+
+
+def to_columns(data_dict):
+	"""
+	Converts the lists of one packed town or route to the FIELD_DTYPES columns.
+	"""
+	return OrderedDict((name, _to_column(name, data_dict[name])) for name in FIELD_DTYPES)
+
+
+def derive_columns(columns):
+	"""
+	Computes the DERIVED_DTYPES columns for all samples at once.
+	"""
+	if len(columns['front_img']) == 0:
+		return OrderedDict((name, np.zeros((0,), dtype=dtype)) for name, dtype in DERIVED_DTYPES.items())
+
+	ego_x = columns['input_x'][:, 0].astype(np.float64)
+	ego_y = columns['input_y'][:, 0].astype(np.float64)
+	ego_theta = columns['input_theta'][:, 0].astype(np.float64)
+	# fix for theta=nan in some measurements
+	ego_theta[np.isnan(ego_theta)] = 0.
+
+	# R.T.dot([dy, dx]) with R the rotation by pi/2+theta
+	cos, sin = np.cos(np.pi/2+ego_theta), np.sin(np.pi/2+ego_theta)
+	def to_ego(dy, dx, cos, sin):
+		return np.stack([cos*dy + sin*dx, -sin*dy + cos*dx], axis=-1)
+
+	derived = OrderedDict()
+	derived['waypoints'] = to_ego(columns['future_y'] - ego_y[:, None], columns['future_x'] - ego_x[:, None],
+								  cos[:, None], sin[:, None])
+	derived['target_point'] = to_ego(columns['y_target'] - ego_y, columns['x_target'] - ego_x, cos, sin)
+
+	# VOID = -1
+	# LEFT = 1
+	# RIGHT = 2
+	# STRAIGHT = 3
+	# LANEFOLLOW = 4
+	# CHANGELANELEFT = 5
+	# CHANGELANERIGHT = 6
+	command = columns['target_command'].astype(np.int64)
+	command[command < 0] = 4
+	command -= 1
+	assert np.all((command >= 0) & (command <= 5)), 'unknown target_command'
+	derived['command_one_hot'] = np.eye(6)[command]
+
+	# use the average value of roach braking action when the brake is only performed by the rule-based detector
+	action_mu, action_sigma = np.array(columns['action_mu']), np.array(columns['action_sigma'])
+	only_ap_brake = columns['only_ap_brake'].astype(bool)
+	action_mu[only_ap_brake, 0] = 0.8
+	action_sigma[only_ap_brake, 0] = 5.5
+	future_action_mu, future_action_sigma = np.array(columns['future_action_mu']), np.array(columns['future_action_sigma'])
+	future_only_ap_brake = columns['future_only_ap_brake'].astype(bool)
+	future_action_mu[future_only_ap_brake, 0] = 0.8
+	future_action_sigma[future_only_ap_brake, 0] = 5.5
+	derived['supervised_action_mu'] = action_mu
+	derived['supervised_action_sigma'] = action_sigma
+	derived['supervised_future_action_mu'] = future_action_mu
+	derived['supervised_future_action_sigma'] = future_action_sigma
+
+	# frames of a route are contiguous and their image paths look like <route>/rgb/0000.png
+	route = np.char.rpartition(np.asarray(columns['front_img'])[:, 0], b'/rgb/')[:, 0]
+	derived['route_id'] = np.cumsum(np.r_[False, route[1:] != route[:-1]])
+
+	return OrderedDict((name, _to_column(name, values)) for name, values in derived.items())
+
+
+def save_packed(folder_path, data_dict):
+	"""
+	Write a packed town as one .npy file per field so it can be memory-mapped, together with the
+	derived training targets. meta.json is written last and marks the folder as complete.
+	"""
+	packed_dir = os.path.join(folder_path, PACKED_DIR)
+	os.makedirs(packed_dir, exist_ok=True)
+
+	columns = to_columns(data_dict)
+	columns.update(derive_columns(columns))
+
+	meta = {'version': FORMAT_VERSION, 'length': len(columns['front_img']), 'fields': OrderedDict()}
+	for name, column in columns.items():
+		assert len(column) == meta['length'], f'field {name} has {len(column)} rows, expected {meta["length"]}'
+		file_path = os.path.join(packed_dir, name + ".npy")
+		with open(file_path + ".tmp", "wb") as f:
+			np.save(f, column)
+		os.replace(file_path + ".tmp", file_path)
+		meta['fields'][name] = {'dtype': column.dtype.str, 'shape': list(column.shape)}
+
+	with open(os.path.join(packed_dir, META_FILE + ".tmp"), "w") as f:
+		json.dump(meta, f, indent=1)
+	os.replace(os.path.join(packed_dir, META_FILE + ".tmp"), os.path.join(packed_dir, META_FILE))
+	return meta['length']
+
+
+def has_packed(folder_path):
+	return os.path.isfile(os.path.join(folder_path, PACKED_DIR, META_FILE))
+
+
+def packed_version(folder_path):
+	if not has_packed(folder_path):
+		return None
+	with open(os.path.join(folder_path, PACKED_DIR, META_FILE), "r") as f:
+		return json.load(f)['version']
+
+
+def load_packed(folder_path, mmap=True):
+	"""
+	Returns a dict of field name -> column for one packed town.
+	Columns are read-only np.memmap views when mmap is set, so forked DataLoader
+	workers share the page cache instead of copying the data. Folders packed by
+	older versions of tools/gen_data.py (pickled packed_data.npy) are converted in memory.
+	"""
+	if has_packed(folder_path):
+		packed_dir = os.path.join(folder_path, PACKED_DIR)
+		with open(os.path.join(packed_dir, META_FILE), "r") as f:
+			meta = json.load(f)
+		# an empty file can not be mapped
+		mmap_mode = 'r' if mmap and meta['length'] > 0 else None
+		columns = OrderedDict((name, np.load(os.path.join(packed_dir, name + ".npy"), mmap_mode=mmap_mode))
+							  for name in meta['fields'])
+	else:
+		data = np.load(os.path.join(folder_path, LEGACY_FILE), allow_pickle=True).item()
+		columns = to_columns(data)
+
+	# packed before the targets were stored, compute them in memory
+	if any(name not in columns for name in DERIVED_DTYPES):
+		columns.update(derive_columns(columns))
+	return columns
+
+
+def convert_legacy(folder_path):
+	"""
+	Repack a pickled packed_data.npy into the columnar format without touching the raw frames.
+	"""
+	data = np.load(os.path.join(folder_path, LEGACY_FILE), allow_pickle=True).item()
+	return save_packed(folder_path, data)
+
+
+SHARD_DIR = "image_shards"
+SHARD_SIZE = 2048 # frames per shard file
+
+def image_table_digest(front_img):
+	"""
+	Fingerprint of the image path table, used to detect shards baked from an older packing.
+	"""
+	return hashlib.md5(np.ascontiguousarray(front_img).tobytes()).hexdigest()
+
+
+def shard_path(folder_path, shard_id):
+	return os.path.join(folder_path, SHARD_DIR, f"shard_{str(shard_id).zfill(5)}.npy")
+
+
+def save_shard_meta(folder_path, front_img, image_shape, shard_size=SHARD_SIZE):
+	meta = {
+		'version': FORMAT_VERSION,
+		'length': len(front_img),
+		'shard_size': shard_size,
+		'image_shape': list(image_shape),
+		'digest': image_table_digest(front_img),
+	}
+	meta_path = os.path.join(folder_path, SHARD_DIR, META_FILE)
+	with open(meta_path + ".tmp", "w") as f:
+		json.dump(meta, f, indent=1)
+	os.replace(meta_path + ".tmp", meta_path)
+
+
+def load_image_shards(folder_path, front_img):
+	"""
+	Returns (shards, shard_size) with the memory-mapped uint8 shards [shard_size, H, W, 3] baked by
+	tools/bake_images.py, or None if the town has no shards or they do not match the packed image table.
+	Sample i lives at shards[i // shard_size][i % shard_size].
+	"""
+	meta_path = os.path.join(folder_path, SHARD_DIR, META_FILE)
+	if not os.path.isfile(meta_path):
+		return None
+	with open(meta_path, "r") as f:
+		meta = json.load(f)
+	if meta['length'] != len(front_img) or meta['digest'] != image_table_digest(front_img):
+		print(f"Ignoring stale image shards in {folder_path}, run tools/bake_images.py again")
+		return None
+	n_shards = (meta['length'] + meta['shard_size'] - 1) // meta['shard_size']
+	return [np.load(shard_path(folder_path, i), mmap_mode='r') for i in range(n_shards)], meta['shard_size']
@@ -1,5 +1,6 @@
 import argparse
 import os
+from contextlib import nullcontext
 from collections import OrderedDict
 
 import torch
@@ -10,22 +11,34 @@ from torch.distributions import Beta
 
 
 import pytorch_lightning as pl
-from pytorch_lightning.callbacks import ModelCheckpoint
+from pytorch_lightning.callbacks import ModelCheckpoint, Callback
 from pytorch_lightning.plugins import DDPPlugin
 
 from TCP.model import TCP
-from TCP.data import CARLA_Data
+from TCP.data import CARLA_Data, CARLA_Stream
+from TCP.batch_augment import BatchAugmenter
 from TCP.config import GlobalConfig
 
 
 class TCP_planner(pl.LightningModule):
-	def __init__(self, config, lr):
+	def __init__(self, config, lr, precision='32', channels_last=False):
 		super().__init__()
 		self.lr = lr
 		self.config = config
 		self.model = TCP(config)
 		self._load_weight()
 
+		# '16' runs under Lightning's native amp, 'bf16' is autocast around the model forward
+		self.train_precision = precision
+		self.channels_last = channels_last
+		if channels_last:
+			self.model = self.model.to(memory_format=torch.channels_last)
+
+		# uint8 frames from CARLA_Data(normalize_img=False) are augmented and normalized on the device
+		self.augmenter = BatchAugmenter() if config.img_aug and config.gpu_aug else None
+		self.register_buffer('img_mean', torch.tensor([0.485,0.456,0.406]).view(1,3,1,1), persistent=False)
+		self.register_buffer('img_std', torch.tensor([0.229,0.224,0.225]).view(1,3,1,1), persistent=False)
+
 	def _load_weight(self):
 		rl_state_dict = torch.load(self.config.rl_ckpt, map_location='cpu')['policy_state_dict']
 		self._load_state_dict(self.model.value_branch_traj, rl_state_dict, 'value_head')
@@ -45,8 +58,32 @@ class TCP_planner(pl.LightningModule):
 	def forward(self, batch):
 		pass
 
-	def training_step(self, batch, batch_idx):
-		front_img = batch['front_img']
+	def _prepare_img(self, front_img, augment=False):
+		if front_img.dtype != torch.uint8:
+			return front_img
+		# --precision 16 runs the step under autocast, the augmenter has to stay in fp32
+		with torch.cuda.amp.autocast(enabled=False):
+			front_img = front_img.float()
+			if augment and self.augmenter is not None:
+				# same images-seen / 32 schedule as TCP.augment.hard, but driven by the global step
+				front_img = self.augmenter(front_img, self.global_step * front_img.shape[0])
+			return (front_img / 255. - self.img_mean) / self.img_std
+
+	def _beta_kl(self, mu_sup, sigma_sup, mu_pred, sigma_pred, per_step=False):
+		""" KL between the supervision and predicted beta distributions, averaged over every leading dim but the first if per_step """
+		# lgamma/digamma of the KL are not safe in reduced precision
+		with torch.cuda.amp.autocast(enabled=False):
+			kl_div = torch.distributions.kl_divergence(Beta(mu_sup.float(), sigma_sup.float()), Beta(mu_pred.float(), sigma_pred.float()))
+		kl_div = kl_div[..., 0] *0.5 + kl_div[..., 1] *0.5
+		return kl_div.flatten(1).mean(1) if per_step else kl_div.mean()
+
+	def _compute_losses(self, batch, augment=False):
+		"""
+		Runs the model on a batch and returns (pred, losses, future_steps), shared by training and validation.
+		The future steps are stacked to [pred_len, B, ...] so each future loss is a single op,
+		future_steps holds the [pred_len] per step values of the two future losses.
+		"""
+		front_img = self._prepare_img(batch['front_img'], augment=augment)
 		speed = batch['speed'].to(dtype=torch.float32).view(-1,1) / 12.
 		target_point = batch['target_point'].to(dtype=torch.float32)
 		command = batch['target_command']
@@ -57,35 +94,42 @@ class TCP_planner(pl.LightningModule):
 
 		gt_waypoints = batch['waypoints']
 
-		pred = self.model(front_img, state, target_point)
-
-		dist_sup = Beta(batch['action_mu'], batch['action_sigma'])
-		dist_pred = Beta(pred['mu_branches'], pred['sigma_branches'])
-		kl_div = torch.distributions.kl_divergence(dist_sup, dist_pred)
-		action_loss = torch.mean(kl_div[:, 0]) *0.5 + torch.mean(kl_div[:, 1]) *0.5
-		speed_loss = F.l1_loss(pred['pred_speed'], speed) * self.config.speed_weight
-		value_loss = (F.mse_loss(pred['pred_value_traj'], value) + F.mse_loss(pred['pred_value_ctrl'], value)) * self.config.value_weight
-		feature_loss = (F.mse_loss(pred['pred_features_traj'], feature) +F.mse_loss(pred['pred_features_ctrl'], feature))* self.config.features_weight
-
-		future_feature_loss = 0
-		future_action_loss = 0
-		for i in range(self.config.pred_len):
-			dist_sup = Beta(batch['future_action_mu'][i], batch['future_action_sigma'][i])
-			dist_pred = Beta(pred['future_mu'][i], pred['future_sigma'][i])
-			kl_div = torch.distributions.kl_divergence(dist_sup, dist_pred)
-			future_action_loss += torch.mean(kl_div[:, 0]) *0.5 + torch.mean(kl_div[:, 1]) *0.5
-			future_feature_loss += F.mse_loss(pred['future_feature'][i], batch['future_feature'][i]) * self.config.features_weight
-		future_feature_loss /= self.config.pred_len
-		future_action_loss /= self.config.pred_len
-		wp_loss = F.l1_loss(pred['pred_wp'], gt_waypoints, reduction='none').mean()
-		loss = action_loss + speed_loss + value_loss + feature_loss + wp_loss+ future_feature_loss + future_action_loss
-		self.log('train_action_loss', action_loss.item())
-		self.log('train_wp_loss_loss', wp_loss.item())
-		self.log('train_speed_loss', speed_loss.item())
-		self.log('train_value_loss', value_loss.item())
-		self.log('train_feature_loss', feature_loss.item())
-		self.log('train_future_feature_loss', future_feature_loss.item())
-		self.log('train_future_action_loss', future_action_loss.item())
+		if self.channels_last:
+			front_img = front_img.contiguous(memory_format=torch.channels_last)
+
+		with torch.cuda.amp.autocast(dtype=torch.bfloat16) if self.train_precision == 'bf16' else nullcontext():
+			pred = self.model(front_img, state, target_point)
+		if self.train_precision != '32':
+			# compute the losses against the fp32 targets
+			pred = {k: [t.float() for t in v] if isinstance(v, list) else v.float() for k, v in pred.items()}
+
+		losses = OrderedDict()
+		losses['action_loss'] = self._beta_kl(batch['action_mu'], batch['action_sigma'], pred['mu_branches'], pred['sigma_branches'])
+		losses['speed_loss'] = F.l1_loss(pred['pred_speed'], speed) * self.config.speed_weight
+		losses['value_loss'] = (F.mse_loss(pred['pred_value_traj'], value) + F.mse_loss(pred['pred_value_ctrl'], value)) * self.config.value_weight
+		losses['feature_loss'] = (F.mse_loss(pred['pred_features_traj'], feature) +F.mse_loss(pred['pred_features_ctrl'], feature))* self.config.features_weight
+		losses['wp_loss'] = F.l1_loss(pred['pred_wp'], gt_waypoints, reduction='none').mean()
+
+		# the batch holds the future supervision as [B, pred_len, ...]
+		future_steps = OrderedDict()
+		future_steps['future_feature_loss'] = F.mse_loss(torch.stack(pred['future_feature']), batch['future_feature'].transpose(0, 1),
+														 reduction='none').flatten(1).mean(1) * self.config.features_weight
+		future_steps['future_action_loss'] = self._beta_kl(batch['future_action_mu'].transpose(0, 1), batch['future_action_sigma'].transpose(0, 1),
+														   torch.stack(pred['future_mu']), torch.stack(pred['future_sigma']), per_step=True)
+		for key, steps in future_steps.items():
+			losses[key] = steps.mean()
+		return pred, losses, future_steps
+
+	def training_step(self, batch, batch_idx):
+		pred, losses, _ = self._compute_losses(batch, augment=True)
+		loss = sum(losses.values())
+		self.log('train_action_loss', losses['action_loss'].item())
+		self.log('train_wp_loss_loss', losses['wp_loss'].item())
+		self.log('train_speed_loss', losses['speed_loss'].item())
+		self.log('train_value_loss', losses['value_loss'].item())
+		self.log('train_feature_loss', losses['feature_loss'].item())
+		self.log('train_future_feature_loss', losses['future_feature_loss'].item())
+		self.log('train_future_action_loss', losses['future_action_loss'].item())
 		return loss
 
 	def configure_optimizers(self):
@@ -94,62 +138,36 @@ class TCP_planner(pl.LightningModule):
 		return [optimizer], [lr_scheduler]
 
 	def validation_step(self, batch, batch_idx):
-		front_img = batch['front_img']
-		speed = batch['speed'].to(dtype=torch.float32).view(-1,1) / 12.
-		target_point = batch['target_point'].to(dtype=torch.float32)
-		command = batch['target_command']
-		state = torch.cat([speed, target_point, command], 1)
-		value = batch['value'].view(-1,1)
-		feature = batch['feature']
-		gt_waypoints = batch['waypoints']
-
-		pred = self.model(front_img, state, target_point)
-		dist_sup = Beta(batch['action_mu'], batch['action_sigma'])
-		dist_pred = Beta(pred['mu_branches'], pred['sigma_branches'])
-		kl_div = torch.distributions.kl_divergence(dist_sup, dist_pred)
-		action_loss = torch.mean(kl_div[:, 0]) *0.5 + torch.mean(kl_div[:, 1]) *0.5
-		speed_loss = F.l1_loss(pred['pred_speed'], speed) * self.config.speed_weight
-		value_loss = (F.mse_loss(pred['pred_value_traj'], value) + F.mse_loss(pred['pred_value_ctrl'], value)) * self.config.value_weight
-		feature_loss = (F.mse_loss(pred['pred_features_traj'], feature) +F.mse_loss(pred['pred_features_ctrl'], feature))* self.config.features_weight
-		wp_loss = F.l1_loss(pred['pred_wp'], gt_waypoints, reduction='none').mean()
-
-		B = batch['action_mu'].shape[0]
-		batch_steer_l1 = 0 
-		batch_brake_l1 = 0
-		batch_throttle_l1 = 0
-		for i in range(B):
-			throttle, steer, brake = self.model.get_action(pred['mu_branches'][i], pred['sigma_branches'][i])
-			batch_throttle_l1 += torch.abs(throttle-batch['action'][i][0])
-			batch_steer_l1 += torch.abs(steer-batch['action'][i][1])
-			batch_brake_l1 += torch.abs(brake-batch['action'][i][2])
-
-		batch_throttle_l1 /= B
-		batch_steer_l1 /= B
-		batch_brake_l1 /= B
-
-		future_feature_loss = 0
-		future_action_loss = 0
-		for i in range(self.config.pred_len-1):
-			dist_sup = Beta(batch['future_action_mu'][i], batch['future_action_sigma'][i])
-			dist_pred = Beta(pred['future_mu'][i], pred['future_sigma'][i])
-			kl_div = torch.distributions.kl_divergence(dist_sup, dist_pred)
-			future_action_loss += torch.mean(kl_div[:, 0]) *0.5 + torch.mean(kl_div[:, 1]) *0.5
-			future_feature_loss += F.mse_loss(pred['future_feature'][i], batch['future_feature'][i]) * self.config.features_weight
-		future_feature_loss /= self.config.pred_len
-		future_action_loss /= self.config.pred_len
-
-		val_loss = wp_loss + batch_throttle_l1+5*batch_steer_l1+batch_brake_l1
-
-		self.log("val_action_loss", action_loss.item(), sync_dist=True)
-		self.log('val_speed_loss', speed_loss.item(), sync_dist=True)
-		self.log('val_value_loss', value_loss.item(), sync_dist=True)
-		self.log('val_feature_loss', feature_loss.item(), sync_dist=True)
-		self.log('val_wp_loss_loss', wp_loss.item(), sync_dist=True)
-		self.log('val_future_feature_loss', future_feature_loss.item(), sync_dist=True)
-		self.log('val_future_action_loss', future_action_loss.item(), sync_dist=True)
+		pred, losses, future_steps = self._compute_losses(batch)
+
+		throttle, steer, brake = self.model.get_action(pred['mu_branches'], pred['sigma_branches'])
+		batch_throttle_l1 = torch.abs(throttle-batch['action'][:, 0]).mean()
+		batch_steer_l1 = torch.abs(steer-batch['action'][:, 1]).mean()
+		batch_brake_l1 = torch.abs(brake-batch['action'][:, 2]).mean()
+
+		val_loss = losses['wp_loss'] + batch_throttle_l1+5*batch_steer_l1+batch_brake_l1
+
+		self.log("val_action_loss", losses['action_loss'].item(), sync_dist=True)
+		self.log('val_speed_loss', losses['speed_loss'].item(), sync_dist=True)
+		self.log('val_value_loss', losses['value_loss'].item(), sync_dist=True)
+		self.log('val_feature_loss', losses['feature_loss'].item(), sync_dist=True)
+		self.log('val_wp_loss_loss', losses['wp_loss'].item(), sync_dist=True)
+		# the val_future_* keys keep their meaning of earlier runs: the first pred_len-1 steps summed and divided by pred_len
+		for key, steps in future_steps.items():
+			self.log('val_' + key, (steps[:-1].sum() / self.config.pred_len).item(), sync_dist=True)
+			self.log('val_' + key + '_all_steps', losses[key].item(), sync_dist=True)
 		self.log('val_loss', val_loss.item(), sync_dist=True)
 
 
+class StreamEpochCallback(Callback):
+	""" Reshuffles the route chunks of a CARLA_Stream before the workers of each epoch start """
+	def __init__(self, stream):
+		self.stream = stream
+
+	def on_train_epoch_start(self, trainer, pl_module):
+		self.stream.set_epoch(trainer.current_epoch)
+
+
 if __name__ == "__main__":
 	parser = argparse.ArgumentParser()
 
@@ -160,6 +178,8 @@ if __name__ == "__main__":
 	parser.add_argument('--batch_size', type=int, default=32, help='Batch size')
 	parser.add_argument('--logdir', type=str, default='log', help='Directory to log data to.')
 	parser.add_argument('--gpus', type=int, default=1, help='number of gpus')
+	parser.add_argument('--precision', type=str, default='32', choices=['32', '16', 'bf16'], help='Training precision, 16 uses native amp, bf16 needs Ampere or newer.')
+	parser.add_argument('--channels_last', action='store_true', help='Run the perception trunk in channels-last memory format.')
 
 	args = parser.parse_args()
 	args.logdir = os.path.join(args.logdir, args.id)
@@ -168,15 +188,24 @@ if __name__ == "__main__":
 	config = GlobalConfig()
 
 	# Data
-	train_set = CARLA_Data(root=config.root_dir_all, data_folders=config.train_data, img_aug = config.img_aug)
+	train_set = CARLA_Data(root=config.root_dir_all, data_folders=config.train_data, img_aug = config.img_aug and not config.gpu_aug,
+							img_shards = config.img_shards, normalize_img = not config.gpu_aug)
 	print(len(train_set))
-	val_set = CARLA_Data(root=config.root_dir_all, data_folders=config.val_data,)
+	val_set = CARLA_Data(root=config.root_dir_all, data_folders=config.val_data, img_shards = config.img_shards, normalize_img = not config.gpu_aug)
 	print(len(val_set))
 
-	dataloader_train = DataLoader(train_set, batch_size=args.batch_size, shuffle=True, num_workers=8)
-	dataloader_val = DataLoader(val_set, batch_size=args.batch_size, shuffle=False, num_workers=8)
+	num_workers = 8
+	callbacks = []
+	if config.stream_data:
+		train_stream = CARLA_Stream(train_set, num_workers, chunk_len=config.stream_chunk_len,
+									shuffle_buffer=config.stream_shuffle_buffer, prefetch=config.stream_prefetch)
+		dataloader_train = DataLoader(train_stream, batch_size=args.batch_size, num_workers=num_workers)
+		callbacks.append(StreamEpochCallback(train_stream))
+	else:
+		dataloader_train = DataLoader(train_set, batch_size=args.batch_size, shuffle=True, num_workers=num_workers)
+	dataloader_val = DataLoader(val_set, batch_size=args.batch_size, shuffle=False, num_workers=num_workers)
 
-	TCP_model = TCP_planner(config, args.lr)
+	TCP_model = TCP_planner(config, args.lr, args.precision, args.channels_last)
 
 	checkpoint_callback = ModelCheckpoint(save_weights_only=False, mode="min", monitor="val_loss", save_top_k=2, save_last=True,
 											dirpath=args.logdir, filename="best_{epoch:02d}-{val_loss:.3f}")
@@ -184,6 +213,7 @@ if __name__ == "__main__":
 	trainer = pl.Trainer.from_argparse_args(args,
 											default_root_dir=args.logdir,
 											gpus = args.gpus,
+											precision = 16 if args.precision == '16' else 32,
 											accelerator='ddp',
 											sync_batchnorm=True,
 											plugins=DDPPlugin(find_unused_parameters=False),
@@ -192,7 +222,7 @@ if __name__ == "__main__":
 											log_every_n_steps=1,
 											flush_logs_every_n_steps=5,
 											callbacks=[checkpoint_callback,
-														],
+														] + callbacks,
 											check_val_every_n_epoch = args.val_every,
 											max_epochs = args.epochs
 											)
@@ -0,0 +1,75 @@
+import os
+import pickle
+import random
+import numpy as np
+
+from pymoo.core.callback import Callback
+
+
+CHECKPOINT_FILE = 'search_checkpoint.pkl'
+
+
+class _Pickler(pickle.Pickler):
+    # the problem holds simulator clients, worker processes and the result store, it is rebuilt on resume
+    def __init__(self, file, problem):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.problem = problem
+
+    def persistent_id(self, obj):
+        return 'problem' if obj is self.problem else None
+
+
+class _Unpickler(pickle.Unpickler):
+    def __init__(self, file, problem):
+        super().__init__(file)
+        self.problem = problem
+
+    def persistent_load(self, pid):
+        if pid != 'problem':
+            raise pickle.UnpicklingError('unknown persistent id {}'.format(pid))
+        return self.problem
+
+
+class SearchCheckpoint(Callback):
+    """
+    Saves the search after every generation: the algorithm with its population, offspring and
+    generation counter, the numpy and python RNG states and the surrogate of an AssistedProblem.
+    The file is replaced atomically, a run killed at any point resumes from the last finished generation.
+    """
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+
+    def notify(self, algorithm):
+        problem = algorithm.problem
+        state = {
+            'algorithm': algorithm,
+            'n_gen': algorithm.n_gen,
+            'np_random': np.random.get_state(),
+            'random': random.getstate(),
+            'surrogate': getattr(problem, 'surrogate', None),
+        }
+        with open(self.path + '.tmp', 'wb') as f:
+            _Pickler(f, problem).dump(state)
+        os.replace(self.path + '.tmp', self.path)
+
+    def exists(self):
+        return os.path.isfile(self.path)
+
+    def load(self, problem):
+        """
+        The saved algorithm bound to problem, ready to continue with the next generation
+        """
+        with open(self.path, 'rb') as f:
+            state = _Unpickler(f, problem).load()
+        np.random.set_state(state['np_random'])
+        random.setstate(state['random'])
+        if state['surrogate'] is not None:
+            problem.surrogate = state['surrogate']
+
+        algorithm = state['algorithm']
+        # the checkpoint is written before the algorithm advances its generation counter
+        algorithm.n_gen = state['n_gen'] + 1
+        algorithm.callback = self
+        print('Resuming the search after generation', state['n_gen'])
+        return algorithm
@@ -5,7 +5,11 @@ import traceback
 import numpy as np
 import subprocess
 
-from SBT.problem import CustomizedProblem, SurrogateProblem
+from SBT.problem import CustomizedProblem, SurrogateProblem, ParallelProblem, AssistedProblem, case_objectives, evaluate_cases
+from SBT.parallel import WorkerPool
+from SBT.store import open_store
+from SBT.checkpoint import SearchCheckpoint, CHECKPOINT_FILE
+from SBT.surrogate import DEFAULT_KIND, OnlineSurrogate
 from utils.utils import mkdir, savepath_parser
 
 from pymoo.core.problem import ElementwiseProblem
@@ -22,10 +26,17 @@ GA = os.environ['GA']==True
 LOG = os.environ['LOG']==True
 REGION = int(os.environ.get('REGION', 7))
 SURROGATE = os.environ['SURROGATE']==True
+# prefix of the tools/models/<kind>-<target>.pkl files
+SURROGATE_MODEL = os.environ.get('SURROGATE_MODEL', '')
+# online surrogate pre-screening, only the top k offspring of a generation are simulated
+ASSISTED = os.environ.get('ASSISTED', 'False') == 'True'
+ASSISTED_TOP_K = int(os.environ.get('ASSISTED_TOP_K', 4))
+# SQLite store of simulated cases shared between runs, defaults to results.db next to the run folders
+RESULT_STORE = os.environ.get('RESULT_STORE', os.path.join(os.path.dirname(os.path.normpath(os.environ.get('SAVE_PATH', './data/'))), 'results.db'))
 save_surrogate_log = True
 
 
-def random_search(arguments, leaderboard_evaluator, route_indexer, case_number=3000, scenario_vecs=None):
+def random_search(arguments, leaderboard_evaluator, route_indexer, case_number=3000, scenario_vecs=None, worker_factories=None):
     print("begin")
     print('LOG:', arguments.log)
     arguments.log=LOG
@@ -37,12 +48,29 @@ def random_search(arguments, leaderboard_evaluator, route_indexer, case_number=3
 
     if scenario_vecs==[]:
         scenario_vecs = np.random.rand(case_number, 9+3+2)
+    store = open_store(RESULT_STORE, arguments, config)
+    if worker_factories:
+        pool = WorkerPool(worker_factories)
+        try:
+            evaluate_cases(scenario_vecs, pool.map, store)
+        finally:
+            pool.close()
+            if store is not None:
+                store.close()
+        return
     for scenario_vec in scenario_vecs:
-        leaderboard_evaluator.run_one_case(scenario_vec, config)
+        if store is not None and store.get(scenario_vec) is not None:
+            print('Skipping stored case')
+            continue
+        result = leaderboard_evaluator.run_one_case(scenario_vec, config)
+        if store is not None and result is not None:
+            store.put(scenario_vec, case_objectives(result), result)
+    if store is not None:
+        store.close()
 
 
 
-def GA_search(arguments, leaderboard_evaluator, route_indexer, pop_size = 50, n_offsprings = 10, generations = 76):
+def GA_search(arguments, leaderboard_evaluator, route_indexer, pop_size = 50, n_offsprings = 10, generations = 76, worker_factories = None):
     print("begin")
     arguments.log=LOG
     config = None
@@ -54,35 +82,70 @@ def GA_search(arguments, leaderboard_evaluator, route_indexer, pop_size = 50, n_
     print(savepath)
 
     mkdir(savepath)
+    checkpoint = SearchCheckpoint(os.path.join(os.path.dirname(arguments.fitness_path), CHECKPOINT_FILE))
+    resume = arguments.resume and checkpoint.exists()
     if save_surrogate_log:
         output_file = savepath+'/console.log'
-        sys.stdout = open(output_file, 'w')
+        sys.stdout = open(output_file, 'a' if resume else 'w')
 
     problem = None
+    pool = None
+    store = None
     if SURROGATE:
         print('surrogate')
-        problem = SurrogateProblem(config, surrogate_path='./data/'+arguments.fitness_path.split('/')[1]+'/')
+        problem = SurrogateProblem(config, surrogate_path='./data/'+arguments.fitness_path.split('/')[1]+'/',
+                                   kind=SURROGATE_MODEL if SURROGATE_MODEL not in ['', 'None'] else DEFAULT_KIND)
     else:
-        problem = CustomizedProblem(arguments.fitness_path,
-                                    arguments.fitness_path.replace('fitness.csv','criterion.csv'),
-                                    leaderboard_evaluator.run_one_case,
-                                    config)
-    algorithm = NSGA2(
-        pop_size=pop_size,
-        n_offsprings=n_offsprings,
-        sampling=FloatRandomSampling(),
-        crossover=SBX(prob=0.9, eta=15),
-        mutation=PM(eta=20),
-        eliminate_duplicates=True
-    )
+        store = open_store(RESULT_STORE, arguments, config)
+        if store is not None:
+            print('result store:', RESULT_STORE, len(store), 'cases')
+        if worker_factories:
+            print('parallel simulators:', len(worker_factories))
+            pool = WorkerPool(worker_factories)
+
+        if ASSISTED:
+            print('surrogate assisted, top k:', ASSISTED_TOP_K)
+            if pool is not None:
+                run_cases = pool.map
+            else:
+                run_cases = lambda X: [leaderboard_evaluator.run_one_case(x, config) for x in X]
+            problem = AssistedProblem(lambda X: evaluate_cases(X, run_cases, store), OnlineSurrogate(), top_k=ASSISTED_TOP_K)
+        elif pool is not None:
+            problem = ParallelProblem(pool, store)
+        else:
+            problem = CustomizedProblem(arguments.fitness_path,
+                                        arguments.fitness_path.replace('fitness.csv','criterion.csv'),
+                                        leaderboard_evaluator.run_one_case,
+                                        config,
+                                        store)
+    if resume:
+        algorithm = checkpoint.load(problem)
+    else:
+        algorithm = NSGA2(
+            pop_size=pop_size,
+            n_offsprings=n_offsprings,
+            sampling=FloatRandomSampling(),
+            crossover=SBX(prob=0.9, eta=15),
+            mutation=PM(eta=20),
+            eliminate_duplicates=True
+        )
     termination = get_termination("n_gen", generations)
 
-    res = minimize(problem,
-        algorithm,
-        termination,
-        seed=1,
-        save_history=False,
-        verbose=True)
+    try:
+        # a resumed algorithm is already set up, minimize continues it where the checkpoint left off
+        res = minimize(problem,
+            algorithm,
+            termination,
+            copy_algorithm=False,
+            seed=1,
+            save_history=False,
+            verbose=True,
+            callback=checkpoint)
+    finally:
+        if pool is not None:
+            pool.close()
+        if store is not None:
+            store.close()
 
     X = res.X
     F = res.F
@@ -98,7 +161,7 @@ def GA_search(arguments, leaderboard_evaluator, route_indexer, pop_size = 50, n_
         sys.stdout = sys.__stdout__
 
 
-def search_based_testing(arguments, leaderboard_evaluator, route_indexer):
+def search_based_testing(arguments, leaderboard_evaluator, route_indexer, worker_factories=None):
     arguments.region = REGION
     try:
         if GA: 
@@ -107,7 +170,8 @@ def search_based_testing(arguments, leaderboard_evaluator, route_indexer):
                     route_indexer, 
                     pop_size     = 50, 
                     n_offsprings = 10, 
-                    generations  = 76)
+                    generations  = 76,
+                    worker_factories = worker_factories)
         else:
             scenario_vecs = np.random.rand(5,14)
             # scenario_vecs = np.random.rand(300,14)
@@ -116,7 +180,8 @@ def search_based_testing(arguments, leaderboard_evaluator, route_indexer):
                         leaderboard_evaluator, 
                         route_indexer, 
                         case_number=3000, 
-                        scenario_vecs=scenario_vecs)
+                        scenario_vecs=scenario_vecs,
+                        worker_factories=worker_factories)
     except Exception as e:
         traceback.print_exc()
     finally:
@@ -0,0 +1,120 @@
+import time
+import traceback
+import multiprocessing
+from collections import deque
+from multiprocessing.connection import wait
+
+
+def _worker_loop(factory, conn):
+    """
+    Runs in the worker process. factory() builds the evaluator once (e.g. a TestCase bound to
+    one CARLA server), then every received (index, x) is evaluated and sent back with its index.
+    """
+    evaluate = factory()
+    while True:
+        job = conn.recv()
+        if job is None:
+            break
+        index, x = job
+        try:
+            conn.send((index, evaluate(x), None))
+        except Exception:
+            conn.send((index, None, traceback.format_exc()))
+
+
+class WorkerPool(object):
+    """
+    One process per evaluator factory, a population is spread over the idle workers and the
+    results are gathered back in order. A worker that crashes, raises or exceeds case_timeout is
+    restarted and its case is retried up to max_retries times.
+    """
+    def __init__(self, factories, max_retries=2, case_timeout=None, log=True):
+        # spawn, the workers hold their own CARLA clients and CUDA contexts
+        self._ctx = multiprocessing.get_context('spawn')
+        self.factories = factories
+        self.max_retries = max_retries
+        self.case_timeout = case_timeout
+        self.log = log
+        self._processes = [None] * len(factories)
+        self._conns = [None] * len(factories)
+        for worker in range(len(factories)):
+            self._start(worker)
+
+    def __len__(self):
+        return len(self.factories)
+
+    def _start(self, worker):
+        parent_conn, child_conn = self._ctx.Pipe()
+        process = self._ctx.Process(target=_worker_loop, args=(self.factories[worker], child_conn), daemon=True)
+        process.start()
+        child_conn.close()
+        self._processes[worker] = process
+        self._conns[worker] = parent_conn
+
+    def _restart(self, worker):
+        if self._processes[worker].is_alive():
+            self._processes[worker].terminate()
+        self._processes[worker].join()
+        self._conns[worker].close()
+        self._start(worker)
+
+    def map(self, X):
+        """
+        Evaluates every row of X, returns the results in the order of X
+        """
+        pending = deque(range(len(X)))
+        results = [None] * len(X)
+        attempts = [0] * len(X)
+        busy = {} # worker -> (case index, start time)
+
+        while pending or busy:
+            for worker in range(len(self)):
+                if pending and worker not in busy:
+                    index = pending.popleft()
+                    self._conns[worker].send((index, X[index]))
+                    busy[worker] = (index, time.time())
+
+            wait([self._conns[worker] for worker in busy] + [self._processes[worker].sentinel for worker in busy],
+                 timeout=1.0)
+
+            for worker, (index, start_time) in list(busy.items()):
+                error = None
+                if self._conns[worker].poll():
+                    try:
+                        _, result, error = self._conns[worker].recv()
+                    except EOFError:
+                        error = 'worker exited'
+                    if error is None:
+                        results[index] = result
+                        del busy[worker]
+                        continue
+                elif not self._processes[worker].is_alive():
+                    error = 'worker exited with code {}'.format(self._processes[worker].exitcode)
+                elif self.case_timeout is not None and time.time() - start_time > self.case_timeout:
+                    error = 'case timed out after {}s'.format(self.case_timeout)
+                else:
+                    continue
+
+                # the simulator state is unknown after a failure, start the worker from scratch
+                del busy[worker]
+                attempts[index] += 1
+                if self.log:
+                    print('Worker {} failed on case {} (attempt {}): {}'.format(worker, index, attempts[index], error))
+                self._restart(worker)
+                if attempts[index] > self.max_retries:
+                    raise RuntimeError('Case {} failed {} times, last error: {}'.format(index, attempts[index], error))
+                pending.appendleft(index)
+
+        return results
+
+    def close(self):
+        for worker, process in enumerate(self._processes):
+            if process.is_alive():
+                try:
+                    self._conns[worker].send(None)
+                except (BrokenPipeError, OSError):
+                    pass
+            process.join(timeout=30)
+            if process.is_alive():
+                process.terminate()
+            self._conns[worker].close()
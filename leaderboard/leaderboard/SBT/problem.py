@@ -1,8 +1,7 @@
 import sys
 import numpy as np
-import joblib
 
-from pymoo.core.problem import ElementwiseProblem
+from pymoo.core.problem import ElementwiseProblem, Problem
 from pymoo.algorithms.moo.nsga2 import NSGA2
 from pymoo.operators.crossover.sbx import SBX
 from pymoo.operators.mutation.pm import PM
@@ -10,8 +9,43 @@ from pymoo.operators.sampling.rnd import FloatRandomSampling
 from pymoo.termination import get_termination
 from pymoo.optimize import minimize
 
+from SBT.surrogate import SurrogateRegistry, MODEL_DIR, DEFAULT_KIND
+
+def case_objectives(result):
+    """
+    Objectives of a simulated case from the CaseResult returned by TestCase.run_one_case:
+    route completion, outside route lanes and collision (distance to other vehicles if none happened)
+    """
+    if result is None:
+        raise RuntimeError("The case produced no result")
+    route_completion = float(result.value("RouteCompletionTest"))/100
+    outside_route_lanes = 1-float(result.value("OutsideRouteLanesTest"))/100
+    collision = 0 if result.failed("CollisionTest") else min(result.fitness_scores[1],2)/2
+    return [
+        route_completion,
+        outside_route_lanes,
+        collision
+    ]
+
+
+def evaluate_cases(X, run_cases, store=None):
+    """
+    Objectives [len(X), 3] of the scenario vectors X. run_cases maps a list of vectors to their CaseResults,
+    vectors found in the SBT.store.ResultStore are not simulated again and new results are added to it
+    """
+    F = [None if store is None else store.get(x) for x in X]
+    missing = [i for i, objectives in enumerate(F) if objectives is None]
+    if missing:
+        results = run_cases([X[i] for i in missing])
+        for i, result in zip(missing, results):
+            F[i] = case_objectives(result)
+            if store is not None:
+                store.put(X[i], F[i], result)
+    return np.array(F, dtype=float).reshape(len(X), 3)
+
+
 class CustomizedProblem(ElementwiseProblem):
-    def __init__(self, fitness_file, cirtion_file, fitness_generator, config):
+    def __init__(self, fitness_file, cirtion_file, fitness_generator, config, store=None):
         super().__init__(n_var=14,
                          n_obj=3,
                          xl=np.zeros(14),
@@ -20,98 +54,99 @@ class CustomizedProblem(ElementwiseProblem):
         self.cirtion_file = cirtion_file
         self.fitness_generator = fitness_generator
         self.config = config
+        self.store = store
 
 
     def _evaluate(self, x, out, *args, **kwargs):
-        dict_cirtion_index = {"RouteCompletionTest": 0,   
-            "RouteCompletionTest_figure": 1,
-            "OutsideRouteLanesTest": 2, 
-            "OutsideRouteLanesTest_figure": 3,
-            "CollisionTest": 4,         
-            "CollisionTest_figure": 5,
-            "RunningRedLightTest": 6,   
-            "RunningRedLightTest_figure": 7,
-            "RunningStopTest": 8,       
-            "RunningStopTest_figure": 9,
-            "InRouteTest": 10, 
-            "InRouteTest_figure": 11,          
-            "AgentBlockedTest": 12,
-            "AgentBlockedTest_figure": 13,      
-            "Timeout": 14}
-        
         # x[6] = 0
 
-        self.fitness_generator(x, self.config)
-        result = {
-            'RouteCompletionTest':0,
-            'OutsideRouteLanesTest':0,
-            'CollisionTest':0,
-            'RunningRedLightTest':0,
-            'RunningStopTest':0,
-            'InRouteTest':0,
-            'AgentBlockedTest':0,
-            'Timeout':0
-        }
-        with open(self.cirtion_file, 'r') as file:
-            data = [float(item) for item in file.readlines()[-1].strip().split(',')]
-            result['RouteCompletionTest']   = data[dict_cirtion_index["RouteCompletionTest_figure"]]/100
-            result['OutsideRouteLanesTest'] = 1-data[dict_cirtion_index["OutsideRouteLanesTest_figure"]]/100
-            result['CollisionTest']         = data[dict_cirtion_index["CollisionTest"]]
-            result['RunningRedLightTest']   = 1-data[dict_cirtion_index["RunningRedLightTest"]]
-            result['RunningStopTest']       = 1-data[dict_cirtion_index["RunningStopTest"]]
-            result['InRouteTest']           = 1-data[dict_cirtion_index["InRouteTest"]]
-            result['AgentBlockedTest']      = 1-data[dict_cirtion_index["AgentBlockedTest"]]
-            result['Timeout']               = 1-data[dict_cirtion_index["Timeout"]]
-
-        with open(self.fitness_file, 'r') as file:
-            data = [float(item) for item in file.readlines()[-1].strip().split(',')] 
-            result['CollisionTest'] = 0 if result['CollisionTest'] == 1 else min(data[1],2)/2
-            
-        out['F'] = [
-            result['RouteCompletionTest'],
-            result['OutsideRouteLanesTest'],
-            result['CollisionTest']
-        ]
-
-
-class SurrogateProblem(ElementwiseProblem):
-    def __init__(self, config, surrogate_path):
+        out['F'] = evaluate_cases([x], lambda X: [self.fitness_generator(x, self.config) for x in X], self.store)[0]
+
+
+class ParallelProblem(Problem):
+    """
+    Vectorized CustomizedProblem, the offspring of a generation are spread over a
+    SBT.parallel.WorkerPool of simulators and the results gathered back in order
+    """
+    def __init__(self, pool, store=None):
+        super().__init__(n_var=14,
+                         n_obj=3,
+                         xl=np.zeros(14),
+                         xu=np.ones(14))
+        self.pool = pool
+        self.store = store
+
+    def _evaluate(self, x, out, *args, **kwargs):
+        out['F'] = evaluate_cases(x, self.pool.map, self.store)
+
+
+class SurrogateProblem(Problem):
+    """
+    Evaluates whole populations on the surrogate models of SurrogateRegistry, the criteria
+    and scenarios of a generation are appended to the log files in one write
+    """
+    targets = ["OutsideRouteLanesTest", "CollisionTest", "RouteCompletionTest"]
+
+    def __init__(self, config, surrogate_path, kind=DEFAULT_KIND, model_dir=MODEL_DIR):
         super().__init__(n_var=14,
                          n_obj=3,
                          xl=np.zeros(14),
                          xu=np.ones(14))
         self.config = config
         self.surrogate_path = surrogate_path
+        self.kind = kind
+        self.registry = SurrogateRegistry(model_dir)
         
 
     def _evaluate(self, x, out, *args, **kwargs):
-        # model_path = './tools/models/'
-        model_path = './tools/models/regression-Kriging'
-        surrogate_models = {"RouteCompletionTest"  : joblib.load(model_path+'-RouteCompletionTest.pkl'), 
-                            "CollisionTest"        : joblib.load(model_path+'-CollisionTest.pkl'), 
-                            "OutsideRouteLanesTest": joblib.load(model_path+'-OutsideRouteLanesTest.pkl'), 
-                            "Timeout"              : joblib.load(model_path+'-Timeout.pkl')}
-        # result = [
-        #     1-surrogate_models["OutsideRouteLanesTest"].predict([x])[0],
-        #     1-surrogate_models["CollisionTest"].predict([x])[0],
-        #     1-surrogate_models["Timeout"].predict([x])[0]
-        # ]
-        result = np.array([
-            surrogate_models["OutsideRouteLanesTest"].predict([x])[0],
-            surrogate_models["CollisionTest"].predict([x])[0],
-            surrogate_models["RouteCompletionTest"].predict([x])[0]
-        ])
-        result[result>1] = 1
-        result[result<0] = 0
-        # print(result)
-
-        file = open(self.surrogate_path+'criterion.csv', 'a')
-        file.write(','.join([str(item) for item in result])+'\n')
-        file.close()
-
-        file = open(self.surrogate_path+'scenario.csv', 'a')
-        file.write(','.join([str(item) for item in x])+'\n')
-        file.close()
+        result = self.registry.predict_all(self.kind, self.targets, x)
+
+        with open(self.surrogate_path+'criterion.csv', 'a') as file:
+            file.writelines([','.join([str(item) for item in row])+'\n' for row in result])
+
+        with open(self.surrogate_path+'scenario.csv', 'a') as file:
+            file.writelines([','.join([str(item) for item in row])+'\n' for row in x])
 
         out['F'] = result
 
+
+class AssistedProblem(Problem):
+    """
+    Surrogate pre-screening of the simulator. The first population is simulated, afterwards only the
+    top_k offspring of a generation with the most promising (lowest predicted objectives) or most
+    uncertain surrogate prediction go to the simulator, the others keep the prediction.
+    The OnlineSurrogate is updated with every batch of simulated cases.
+    - simulate maps a [n, 14] array of scenario vectors to their [n, 3] objectives
+    """
+    def __init__(self, simulate, surrogate, top_k=4):
+        super().__init__(n_var=14,
+                         n_obj=3,
+                         xl=np.zeros(14),
+                         xu=np.ones(14))
+        self.simulate = simulate
+        self.surrogate = surrogate
+        self.top_k = top_k
+        self.n_simulated = 0
+        self.n_predicted = 0
+
+    def _select(self, mean, std):
+        # half of the budget on the most promising candidates, the rest on the most uncertain ones
+        promising = list(np.argsort(mean.sum(axis=1))[:(self.top_k + 1) // 2])
+        uncertain = [i for i in np.argsort(-std.mean(axis=1)) if i not in promising]
+        return np.array(promising + uncertain[:self.top_k - len(promising)], dtype=int)
+
+    def _evaluate(self, x, out, *args, **kwargs):
+        if len(self.surrogate) == 0 or len(x) <= self.top_k:
+            chosen = np.arange(len(x))
+            F = np.zeros((len(x), 3))
+        else:
+            mean, std = self.surrogate.predict(x)
+            chosen = self._select(mean, std)
+            F = np.clip(mean, 0, 1)
+
+        F[chosen] = np.asarray(self.simulate(x[chosen]), dtype=float)
+        self.surrogate.update(x[chosen], F[chosen])
+        self.n_simulated += len(chosen)
+        self.n_predicted += len(x) - len(chosen)
+        print('simulated: {}, predicted: {}'.format(self.n_simulated, self.n_predicted))
+        out['F'] = F
@@ -0,0 +1,71 @@
+import os
+import json
+import time
+import sqlite3
+import numpy as np
+
+
+class ResultStore(object):
+    """
+    SQLite table of every simulated case, shared by all searches that use the same file.
+    A case is keyed by its scenario vector rounded to `decimals` together with the agent, the route
+    and the traffic region, so a vector that any earlier GA or random run already simulated under the
+    same setup is answered from the table. The criterion.csv and fitness.csv rows are kept as well,
+    see tools/fitness.py get_fitness_from_store to read them back.
+    """
+    def __init__(self, path, agent, route, region, decimals=6):
+        self.path = path
+        self.agent = agent
+        self.route = route
+        self.region = int(region)
+        self.decimals = decimals
+        self._conn = sqlite3.connect(path, timeout=60)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS results ('
+                           'agent TEXT, route TEXT, region INTEGER, scenario_key TEXT, '
+                           'scenario TEXT, objectives TEXT, criterion TEXT, fitness TEXT, created REAL, '
+                           'PRIMARY KEY (agent, route, region, scenario_key))')
+        self._conn.commit()
+
+    def key(self, x):
+        return ','.join(str(v) for v in np.round(np.asarray(x, dtype=float) * 10**self.decimals).astype(np.int64))
+
+    def get(self, x):
+        """
+        Objectives of a stored case, None if the vector was never simulated under this setup
+        """
+        row = self._conn.execute('SELECT objectives FROM results WHERE agent=? AND route=? AND region=? AND scenario_key=?',
+                                 (self.agent, self.route, self.region, self.key(x))).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def put(self, x, objectives, result=None):
+        """
+        Stores the objectives of a simulated case and, if given, the csv rows of its CaseResult
+        """
+        criterion = None if result is None else result.criterion_line().strip()
+        fitness = None if result is None or result.fitness_scores is None else result.fitness_line().strip()
+        self._conn.execute('INSERT OR REPLACE INTO results VALUES (?,?,?,?,?,?,?,?,?)',
+                           (self.agent, self.route, self.region, self.key(x),
+                            json.dumps([float(v) for v in x]), json.dumps([float(v) for v in objectives]),
+                            criterion, fitness, time.time()))
+        self._conn.commit()
+
+    def __len__(self):
+        return self._conn.execute('SELECT COUNT(*) FROM results WHERE agent=? AND route=? AND region=?',
+                                  (self.agent, self.route, self.region)).fetchone()[0]
+
+    def close(self):
+        self._conn.close()
+
+
+def open_store(path, arguments, config):
+    """
+    The ResultStore of a search run, None if path is empty or 'None'
+    """
+    if path in ['', 'None']:
+        return None
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    agent = '{}|{}|{}'.format(os.path.basename(arguments.agent), arguments.agent_config, arguments.agent_mode)
+    route = '{}|{}'.format(os.path.basename(arguments.routes), config.name)
+    return ResultStore(path, agent, route, arguments.region)
@@ -0,0 +1,78 @@
+import os
+import sys
+import numpy as np
+import joblib
+
+
+MODEL_DIR = './tools/models/'
+# the pickled models and OnlineSurrogate import tools/models as the models package
+TOOLS_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'tools'))
+if TOOLS_DIR not in sys.path:
+    sys.path.append(TOOLS_DIR)
+DEFAULT_KIND = 'regression-Kriging'
+
+
+class SurrogateRegistry(object):
+    """
+    Pickled surrogate models of tools/models, named <kind>-<target>.pkl (e.g. regression-Kriging-CollisionTest.pkl).
+    Every model is unpickled once per process and shared by all registries.
+    """
+    _models = {}
+
+    def __init__(self, model_dir=MODEL_DIR):
+        self.model_dir = model_dir
+
+    def get(self, kind, target):
+        path = os.path.abspath(os.path.join(self.model_dir, '{}-{}.pkl'.format(kind, target)))
+        if path not in SurrogateRegistry._models:
+            SurrogateRegistry._models[path] = joblib.load(path)
+        return SurrogateRegistry._models[path]
+
+    def predict(self, kind, target, X):
+        """
+        Predictions of one model for every row of X in a single call, shape [len(X)]
+        """
+        X = np.atleast_2d(np.asarray(X, dtype=float))
+        return np.asarray(self.get(kind, target).predict(X), dtype=float).reshape(len(X))
+
+    def predict_all(self, kind, targets, X):
+        """
+        Predictions [len(X), len(targets)] clipped to the [0, 1] range of the criteria
+        """
+        return np.clip(np.stack([self.predict(kind, target, X) for target in targets], axis=1), 0, 1)
+
+
+class OnlineSurrogate(object):
+    """
+    Sparse Kriging (tools/models/SparseKriging.py) of all objectives, fed with the simulated cases as they arrive.
+    A batch is added with SparseKriging.update in O(k m^2) for m inducing points. The kernel and the inducing
+    points are only fit again once the number of cases has doubled, so a run of n cases costs O(n m^2) overall
+    instead of an exact O(n^3) refit per generation. predict returns the posterior mean and std.
+    """
+
+    def __init__(self, n_obj=3, n_inducing=128):
+        self.n_obj = n_obj
+        self.n_inducing = n_inducing
+        self.X = None
+        self.F = None
+        self.model = None
+        self._fit_size = 0
+
+    def __len__(self):
+        return 0 if self.X is None else len(self.X)
+
+    def update(self, X, F):
+        from models.SparseKriging import SparseKriging
+
+        X = np.atleast_2d(np.asarray(X, dtype=float))
+        F = np.asarray(F, dtype=float).reshape(len(X), self.n_obj)
+        self.X = X if self.X is None else np.vstack([self.X, X])
+        self.F = F if self.F is None else np.vstack([self.F, F])
+        if self.model is None or len(self.X) >= 2 * self._fit_size:
+            self.model = SparseKriging(data=self.X, label=self.F, n_inducing=self.n_inducing)
+            self._fit_size = len(self.X)
+        else:
+            self.model.update(X, F)
+
+    def predict(self, X):
+        return self.model.predict(np.atleast_2d(np.asarray(X, dtype=float)), return_std=True)
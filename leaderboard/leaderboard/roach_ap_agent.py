@@ -363,10 +363,14 @@ class ROACHAgent(autonomous_agent.AutonomousAgent):
 		return control
 
 	def collision_detect(self):
-		actors = self._world.get_actors()
+		# the actor arrays of this tick, shared with the criteria instead of a get_actors call per step
+		state = CarlaDataProvider.get_world_state()
+		ego = state.row(self._ego_vehicle.id)
 
-		vehicle = self._is_vehicle_hazard(actors.filter('*vehicle*'))
-		walker = self._is_walker_hazard(actors.filter('*walker*'))
+		vehicle = walker = None
+		if ego is not None:
+			vehicle = self._is_vehicle_hazard(state, ego, state.filter('*vehicle*'))
+			walker = self._is_walker_hazard(state, ego, state.filter('*walker*'))
 
 
 		self.is_vehicle_present = 1 if vehicle is not None else 0
@@ -374,44 +378,41 @@ class ROACHAgent(autonomous_agent.AutonomousAgent):
 
 		return any(x is not None for x in [vehicle, walker])
 
-	def _is_walker_hazard(self, walkers_list):
-		z = self._ego_vehicle.get_location().z
-		p1 = _numpy(self._ego_vehicle.get_location())
-		v1 = 10.0 * _orientation(self._ego_vehicle.get_transform().rotation.yaw)
+	def _is_walker_hazard(self, state, ego, walker_rows):
+		p1 = np.float32(state.locations[ego, :2])
+		v1 = 10.0 * _orientation(state.rotations[ego, 1])
 
-		for walker in walkers_list:
-			v2_hat = _orientation(walker.get_transform().rotation.yaw)
-			s2 = np.linalg.norm(_numpy(walker.get_velocity()))
+		for walker in walker_rows:
+			v2_hat = _orientation(state.rotations[walker, 1])
+			s2 = np.linalg.norm(np.float32(state.velocities[walker, :2]))
 
 			if s2 < 0.05:
 				v2_hat *= s2
 
-			p2 = -3.0 * v2_hat + _numpy(walker.get_location())
+			p2 = -3.0 * v2_hat + np.float32(state.locations[walker, :2])
 			v2 = 8.0 * v2_hat
 
 			collides, collision_point = get_collision(p1, v1, p2, v2)
 
 			if collides:
-				return walker
+				return state.ids[walker]
 
 		return None
 
-	def _is_vehicle_hazard(self, vehicle_list):
-		z = self._ego_vehicle.get_location().z
-
-		o1 = _orientation(self._ego_vehicle.get_transform().rotation.yaw)
-		p1 = _numpy(self._ego_vehicle.get_location())
-		s1 = max(10, 3.0 * np.linalg.norm(_numpy(self._ego_vehicle.get_velocity()))) # increases the threshold distance
+	def _is_vehicle_hazard(self, state, ego, vehicle_rows):
+		o1 = _orientation(state.rotations[ego, 1])
+		p1 = np.float32(state.locations[ego, :2])
+		s1 = max(10, 3.0 * np.linalg.norm(np.float32(state.velocities[ego, :2]))) # increases the threshold distance
 		v1_hat = o1
 		v1 = s1 * v1_hat
 
-		for target_vehicle in vehicle_list:
-			if target_vehicle.id == self._ego_vehicle.id:
+		for target_vehicle in vehicle_rows:
+			if target_vehicle == ego:
 				continue
 
-			o2 = _orientation(target_vehicle.get_transform().rotation.yaw)
-			p2 = _numpy(target_vehicle.get_location())
-			s2 = max(5.0, 2.0 * np.linalg.norm(_numpy(target_vehicle.get_velocity())))
+			o2 = _orientation(state.rotations[target_vehicle, 1])
+			p2 = np.float32(state.locations[target_vehicle, :2])
+			s2 = max(5.0, 2.0 * np.linalg.norm(np.float32(state.velocities[target_vehicle, :2])))
 			v2_hat = o2
 			v2 = s2 * v2_hat
 
@@ -433,7 +434,7 @@ class ROACHAgent(autonomous_agent.AutonomousAgent):
 			elif distance > s1:
 				continue
 
-			return target_vehicle
+			return state.ids[target_vehicle]
 
 		return None
 
@@ -14,6 +14,8 @@ from __future__ import print_function
 
 import traceback
 import argparse
+import copy
+import functools
 from argparse import RawTextHelpFormatter
 from datetime import datetime
 from distutils.version import LooseVersion
@@ -114,6 +116,11 @@ class TestCase(object):
         """
         self.statistics_manager = statistics_manager
         self.sensors = None
+        self.world = None
+        # warm world: the town loaded for the previous case and its map, reused while it stays healthy
+        self.warm_world = bool(getattr(args, 'warm_world', 0))
+        self._world_town = None
+        self._world_map = None
         self.sensor_icons = []
         self._vehicle_lights = carla.VehicleLightState.Position | carla.VehicleLightState.LowBeam
 
@@ -248,6 +255,8 @@ class TestCase(object):
     def _load_and_wait_for_world(self, args, town, weather):
         """
         Load a new CARLA world and provide data to CarlaDataProvider
+        In warm world mode the world of the previous case is reset and reused instead,
+        it is only reloaded when the town changes or the server stops answering
         """
         self.traffic_manager.set_synchronous_mode(False)
         # if hasattr(self, 'world'):
@@ -256,10 +265,15 @@ class TestCase(object):
         #     self.world.apply_settings(settings)
         if self.args.log:
             print(town)
-        try: 
-            self.world = self.client.load_world(town)
-        except Exception as e:
-            print(e)
+        if self._is_world_reusable(town):
+            self._reset_world()
+        else:
+            self._world_town = None
+            self._world_map = None
+            try: 
+                self.world = self.client.load_world(town)
+            except Exception as e:
+                print(e)
         settings = self.world.get_settings()
         settings.fixed_delta_seconds = 1.0 / self.frame_rate
         settings.synchronous_mode = True
@@ -269,7 +283,7 @@ class TestCase(object):
 
         # print(weather)
         CarlaDataProvider.set_client(self.client)
-        CarlaDataProvider.set_world(self.world)
+        CarlaDataProvider.set_world(self.world, self._world_map)
         CarlaDataProvider.set_traffic_manager_port(int(args.trafficManagerPort))
         CarlaDataProvider.set_weather(weather)
 
@@ -286,6 +300,35 @@ class TestCase(object):
             raise Exception("The CARLA server uses the wrong map!"
                             "This scenario requires to use map {}".format(town))
 
+        if self.warm_world:
+            self._world_town = town
+            self._world_map = CarlaDataProvider.get_map()
+
+    def _is_world_reusable(self, town):
+        """
+        Health check of the warm world, it must run the requested town and still be the server's world
+        """
+        if not self.warm_world or self.world is None or self._world_town != town:
+            return False
+        try:
+            return self.client.get_world().id == self.world.id
+        except RuntimeError as e:
+            print(e)
+            return False
+
+    def _reset_world(self):
+        """
+        Destroy what the previous case left in the warm world. The scenario actors are
+        already removed by _cleanup, this catches actors leaked by crashed behaviours
+        """
+        leftover_actors = []
+        for pattern in ['vehicle.*', 'walker.*', 'controller.*', 'sensor.*']:
+            leftover_actors += [actor.id for actor in self.world.get_actors().filter(pattern)]
+        if leftover_actors:
+            if self.args.log:
+                print('# of leftover actors:', len(leftover_actors))
+            self.client.apply_batch_sync([carla.command.DestroyActor(actor_id) for actor_id in leftover_actors])
+
     def _register_statistics(self, config, checkpoint, entry_status, crash_message=""):
         """
         Computes and saved the simulation statistics
@@ -463,8 +506,10 @@ class TestCase(object):
 
         Depending on what code fails, the simulation will either stop the route and
         continue from the next one, or report a crash and stop.
+        Returns the CaseResult of the scenario, None if it could not be analyzed.
         """
         crash_message = ""
+        result = None
         entry_status = "Started"
         config.timeout = args.timeout
         if self.args.log:
@@ -706,6 +751,7 @@ class TestCase(object):
             if self.args.log:
                 print("\033[1m> Stopping the route\033[0m")
             self.manager.stop_scenario()
+            result = self.manager.result
             self._register_statistics(config, args.checkpoint, entry_status, crash_message)
 
             if args.record:
@@ -727,6 +773,8 @@ class TestCase(object):
             print('***Simulation crashed***')
             sys.exit(-1)
 
+        return result
+
     def _get_road(self, current_waypoint, gap = 3):
         '''
         Provide a waypoint, return all waypoints on this straight road (section bewteen 2 junctions)
@@ -913,6 +961,7 @@ class TestCase(object):
     def run_one_case(self, scenario_vec, config):
         """
         Run the challenge mode
+        Returns the CaseResult of the case, None if the agent could not be set up
         """
         # print('run_one_case')
 
@@ -938,7 +987,7 @@ class TestCase(object):
             # print(config.vehicle_infront, config.vehicle_opposite, config.vehicle_side)
 
         # run
-        self._load_and_run_scenario(self.args, config)
+        result = self._load_and_run_scenario(self.args, config)
 
         vec_writer = open(self.args.fitness_path.replace('fitness.csv','scenario.csv'),'a')
         vec_writer.write(','.join([str(vec) for vec in scenario_vec])+'\n')
@@ -946,8 +995,38 @@ class TestCase(object):
         # end_time = time.time()
         # elapsed_time = end_time - start_time 
         # print(f"Processing Time: {elapsed_time:.2f} seconds")
+        return result
+
 
 
+def make_case_evaluator(args, host, port, traffic_manager_port, worker_index):
+    """
+    Builds the TestCase of one parallel simulator worker, called inside the worker process.
+    Each worker writes its csv files and statistics to worker_<index>/ next to the fitness file.
+    The evaluator returns the CaseResult of a case, the objectives are taken in the parent process.
+    """
+    args = copy.copy(args)
+    args.host, args.port, args.trafficManagerPort = host, port, traffic_manager_port
+    worker_path = os.path.join(os.path.dirname(args.fitness_path), 'worker_{}'.format(worker_index))
+    mkdir(worker_path)
+    args.fitness_path = os.path.join(worker_path, 'fitness.csv')
+    args.checkpoint = os.path.join(worker_path, os.path.basename(args.checkpoint))
+
+    route_indexer = RouteIndexer(args.routes, args.scenarios, args.repetitions)
+    config = None
+    while route_indexer.peek():
+        config = route_indexer.next()
+    config.original_trajectory = [config.trajectory[0], config.trajectory[1]]
+
+    test_case = TestCase(args, StatisticsManager())
+
+    def evaluate(scenario_vec):
+        result = test_case.run_one_case(scenario_vec, config)
+        if result is None:
+            raise RuntimeError("The case produced no result")
+        return result
+    return evaluate
+
 
 def mkdir(path):
     # print(path)
@@ -971,6 +1050,7 @@ def log_experiment_configs(json_path):
     SAVE_IMG = os.environ['SAVE_IMG']==True
     LOG = os.environ['LOG']==True
     SAVE_PATH = os.environ.get('SAVE_PATH', '')
+    RESULT_STORE = os.environ.get('RESULT_STORE', '')
 
     ## Route File
     ROUTE_FILE = os.environ.get('ROUTE_FILE', '')
@@ -986,6 +1066,7 @@ def log_experiment_configs(json_path):
         'SAVE_IMG' : SAVE_IMG,
         'LOG' : LOG,
         'SAVE_PATH' : SAVE_PATH,
+        'RESULT_STORE' : RESULT_STORE,
         'ROUTE_FILE' : ROUTE_FILE
     }
 
@@ -1036,7 +1117,9 @@ def main():
     parser.add_argument("--agent-config", type=str, help="Path to Agent's configuration file", default="")
 
     parser.add_argument("--track", type=str, default='SENSORS', help="Participation track: SENSORS, MAP")
-    parser.add_argument('--resume', type=bool, default=False, help='Resume execution from last checkpoint?')
+    parser.add_argument('--resume', type=bool, default=False,
+                        help='Resume execution from last checkpoint? The GA search continues from the\n'
+                             'search_checkpoint.pkl of the run folder if there is one')
     parser.add_argument("--checkpoint", type=str,
                         default='./simulation_results.json',
                         help="Path to checkpoint used for saving statistics and resuming")
@@ -1044,21 +1127,33 @@ def main():
                         default='./fitness.csv',
                         help="Path for fitness.csv")
     parser.add_argument('--agent_mode', type=int, help='Run with debug output', default=1)
+    parser.add_argument('--warm_world', type=int, default=1,
+                        help='Reuse the loaded town between cases instead of reloading it for every case (default: 1)')
+    parser.add_argument('--simulators', type=str, default='',
+                        help='Comma separated host:port:trafficManagerPort of CARLA servers, the GA search\n'
+                             'evaluates each generation on one worker process per server')
 
     arguments = parser.parse_args()
     print("init statistics_manager")
     
     surrogate = os.environ['SURROGATE']==True
     arguments.log = os.environ['LOG']==True
-    pathlib.Path(os.environ['SAVE_PATH']).mkdir()
+    # a resumed search continues in its existing run folder
+    pathlib.Path(os.environ['SAVE_PATH']).mkdir(exist_ok=arguments.resume)
 
     log_experiment_configs(os.environ['SAVE_PATH']+'experiment_config.json')
 
     statistics_manager = StatisticsManager()
     route_indexer = RouteIndexer(arguments.routes, arguments.scenarios, arguments.repetitions)
-    leaderboard_evaluator = TestCase(arguments, statistics_manager) if not surrogate else None
-
-    search_based_testing(arguments, leaderboard_evaluator, route_indexer)
+    worker_factories = None
+    if arguments.simulators and not surrogate:
+        worker_factories = []
+        for i, simulator in enumerate(arguments.simulators.split(',')):
+            host, port, traffic_manager_port = simulator.split(':')
+            worker_factories.append(functools.partial(make_case_evaluator, arguments, host, port, traffic_manager_port, i))
+    leaderboard_evaluator = TestCase(arguments, statistics_manager) if not surrogate and not worker_factories else None
+
+    search_based_testing(arguments, leaderboard_evaluator, route_indexer, worker_factories)
 
 if __name__ == '__main__':
     main()
@@ -76,6 +76,8 @@ class ScenarioManager(object):
         self.start_system_time = None
         self.end_system_time = None
         self.end_game_time = None
+        # CaseResult of the last analyzed scenario
+        self.result = None
 
         # Register the scenario tick as callback for the CARLA world
         # Use the callback_id inside the signal handler to allow external interrupts
@@ -97,6 +99,7 @@ class ScenarioManager(object):
         self.start_system_time = None
         self.end_system_time = None
         self.end_game_time = None
+        self.result = None
 
     def load_scenario(self, scenario, agent, rep_number):
         """
@@ -104,6 +107,7 @@ class ScenarioManager(object):
         """
 
         GameTime.restart()
+        self.result = None
         self._agent = AgentWrapper(agent)
         self.scenario_class = scenario
         self.scenario = scenario.scenario
@@ -231,4 +235,6 @@ class ScenarioManager(object):
         if self.scenario.timeout_node.timeout:
             global_result = '\033[91m'+'FAILURE'+'\033[0m'
 
-        ResultOutputProvider(self, global_result, log = self._log)
+        self.result = ResultOutputProvider(self, global_result, log = self._log).result
+        if self.fitness_path:
+            self.result.append_csv(self.fitness_path)
@@ -14,6 +14,8 @@ from __future__ import print_function
 
 import math
 import re
+import fnmatch
+import numpy as np
 import numpy.random as random
 from six import iteritems
 
@@ -29,6 +31,50 @@ def calculate_velocity(actor):
     return math.sqrt(velocity_squared)
 
 
+class WorldState(object):
+
+    """
+    All actors of the world at one tick, read from a single world.get_snapshot().
+    Row i of every array describes the actor ids[i]:
+    - type_ids: blueprint ids, e.g. vehicle.tesla.model3
+    - locations, rotations (pitch, yaw, roll in degrees), velocities, accelerations: [N, 3]
+    - extents, box_locations: [N, 3] half size and center of the bounding box in the actor frame
+    """
+
+    def __init__(self, frame, ids, type_ids, locations, rotations, velocities, accelerations, extents, box_locations):
+        self.frame = frame
+        self.ids = ids
+        self.type_ids = type_ids
+        self.locations = locations
+        self.rotations = rotations
+        self.velocities = velocities
+        self.accelerations = accelerations
+        self.extents = extents
+        self.box_locations = box_locations
+        self._rows = None
+        self._filters = dict()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def row(self, actor_id):
+        """
+        Row of the actor, None if it is not in the snapshot
+        """
+        if self._rows is None:
+            self._rows = {actor_id: i for i, actor_id in enumerate(self.ids.tolist())}
+        return self._rows.get(actor_id)
+
+    def filter(self, pattern):
+        """
+        Rows of the actors whose type_id matches the wildcard pattern, as carla.ActorList.filter
+        """
+        if pattern not in self._filters:
+            self._filters[pattern] = np.array([i for i, type_id in enumerate(self.type_ids)
+                                               if fnmatch.fnmatchcase(type_id, pattern)], dtype=np.int64)
+        return self._filters[pattern]
+
+
 class CarlaDataProvider(object):  # pylint: disable=too-many-public-methods
 
     """
@@ -46,6 +92,7 @@ class CarlaDataProvider(object):  # pylint: disable=too-many-public-methods
     In addition it provides access to the map and the transform of all traffic lights
     """
 
+    # registered actors, keyed by actor id
     _actor_velocity_map = dict()
     _actor_location_map = dict()
     _actor_transform_map = dict()
@@ -64,29 +111,22 @@ class CarlaDataProvider(object):  # pylint: disable=too-many-public-methods
     _ego_vehicle = None
     _rng = random.RandomState(2000)
 
+    _world_state = None
+    _actor_info = dict()  # actor id -> (type_id, extent, box location), fixed for the life of an actor
+
     @staticmethod
     def register_actor(actor):
         """
         Add new actor to dictionaries
         If actor already exists, throw an exception
         """
-        if actor in CarlaDataProvider._actor_velocity_map:
-            raise KeyError(
-                "Vehicle '{}' already registered. Cannot register twice!".format(actor.id))
-        else:
-            CarlaDataProvider._actor_velocity_map[actor] = 0.0
-
-        if actor in CarlaDataProvider._actor_location_map:
+        if actor.id in CarlaDataProvider._actor_velocity_map:
             raise KeyError(
                 "Vehicle '{}' already registered. Cannot register twice!".format(actor.id))
-        else:
-            CarlaDataProvider._actor_location_map[actor] = None
 
-        if actor in CarlaDataProvider._actor_transform_map:
-            raise KeyError(
-                "Vehicle '{}' already registered. Cannot register twice!".format(actor.id))
-        else:
-            CarlaDataProvider._actor_transform_map[actor] = None
+        CarlaDataProvider._actor_velocity_map[actor.id] = 0.0
+        CarlaDataProvider._actor_location_map[actor.id] = None
+        CarlaDataProvider._actor_transform_map[actor.id] = None
 
     @staticmethod
     def register_actors(actors):
@@ -96,35 +136,90 @@ class CarlaDataProvider(object):  # pylint: disable=too-many-public-methods
         for actor in actors:
             CarlaDataProvider.register_actor(actor)
 
+    @staticmethod
+    def read_world_state(snapshot=None):
+        """
+        Reads the WorldState of the current tick from one world snapshot. Type ids and bounding boxes
+        are not part of the snapshot, they are fetched in one call when new actors show up.
+        """
+        world = CarlaDataProvider._world
+        if snapshot is None:
+            snapshot = world.get_snapshot()
+        actor_snapshots = list(snapshot)
+        ids = [actor_snapshot.id for actor_snapshot in actor_snapshots]
+
+        actor_info = CarlaDataProvider._actor_info
+        new_ids = [actor_id for actor_id in ids if actor_id not in actor_info]
+        if new_ids:
+            for actor in world.get_actors(new_ids):
+                box = getattr(actor, 'bounding_box', None)
+                if box is None:
+                    actor_info[actor.id] = (actor.type_id, (0., 0., 0.), (0., 0., 0.))
+                else:
+                    actor_info[actor.id] = (actor.type_id, (box.extent.x, box.extent.y, box.extent.z),
+                                            (box.location.x, box.location.y, box.location.z))
+        if len(actor_info) > len(ids):
+            CarlaDataProvider._actor_info = actor_info = {actor_id: actor_info[actor_id] for actor_id in ids
+                                                          if actor_id in actor_info}
+        # destroyed between the snapshot and the query
+        unknown = ('', (0., 0., 0.), (0., 0., 0.))
+        info = [actor_info.get(actor_id, unknown) for actor_id in ids]
+
+        transforms = [actor_snapshot.get_transform() for actor_snapshot in actor_snapshots]
+        velocities = [actor_snapshot.get_velocity() for actor_snapshot in actor_snapshots]
+        accelerations = [actor_snapshot.get_acceleration() for actor_snapshot in actor_snapshots]
+        return WorldState(
+            snapshot.frame,
+            np.array(ids, dtype=np.int64),
+            [type_id for type_id, _, _ in info],
+            np.array([[t.location.x, t.location.y, t.location.z] for t in transforms], dtype=np.float64).reshape(-1, 3),
+            np.array([[t.rotation.pitch, t.rotation.yaw, t.rotation.roll] for t in transforms], dtype=np.float64).reshape(-1, 3),
+            np.array([[v.x, v.y, v.z] for v in velocities], dtype=np.float64).reshape(-1, 3),
+            np.array([[a.x, a.y, a.z] for a in accelerations], dtype=np.float64).reshape(-1, 3),
+            np.array([extent for _, extent, _ in info], dtype=np.float64).reshape(-1, 3),
+            np.array([box_location for _, _, box_location in info], dtype=np.float64).reshape(-1, 3))
+
+    @staticmethod
+    def get_world_state():
+        """
+        WorldState of the last tick, shared by the criteria and agents instead of querying the server
+        """
+        if CarlaDataProvider._world_state is None and CarlaDataProvider._world is not None:
+            CarlaDataProvider._world_state = CarlaDataProvider.read_world_state()
+        return CarlaDataProvider._world_state
+
     @staticmethod
     def on_carla_tick():
         """
         Callback from CARLA
         """
-        for actor in CarlaDataProvider._actor_velocity_map:
-            if actor is not None and actor.is_alive:
-                CarlaDataProvider._actor_velocity_map[actor] = calculate_velocity(actor)
-
-        for actor in CarlaDataProvider._actor_location_map:
-            if actor is not None and actor.is_alive:
-                CarlaDataProvider._actor_location_map[actor] = actor.get_location()
-
-        for actor in CarlaDataProvider._actor_transform_map:
-            if actor is not None and actor.is_alive:
-                CarlaDataProvider._actor_transform_map[actor] = actor.get_transform()
-
         world = CarlaDataProvider._world
         if world is None:
             print("WARNING: CarlaDataProvider couldn't find the world")
+            return
+
+        # the snapshot of the last tick is kept by the client, reading it needs no call to the server
+        snapshot = world.get_snapshot()
+        CarlaDataProvider._world_state = CarlaDataProvider.read_world_state(snapshot)
+
+        for actor_id in CarlaDataProvider._actor_transform_map:
+            actor_snapshot = snapshot.find(actor_id)
+            if actor_snapshot is None:
+                # destroyed actors keep their last values
+                continue
+            transform = actor_snapshot.get_transform()
+            velocity = actor_snapshot.get_velocity()
+            CarlaDataProvider._actor_velocity_map[actor_id] = math.sqrt(velocity.x**2 + velocity.y**2)
+            CarlaDataProvider._actor_location_map[actor_id] = transform.location
+            CarlaDataProvider._actor_transform_map[actor_id] = transform
 
     @staticmethod
     def get_velocity(actor):
         """
         returns the absolute velocity for the given actor
         """
-        for key in CarlaDataProvider._actor_velocity_map:
-            if key.id == actor.id:
-                return CarlaDataProvider._actor_velocity_map[key]
+        if actor.id in CarlaDataProvider._actor_velocity_map:
+            return CarlaDataProvider._actor_velocity_map[actor.id]
 
         # We are intentionally not throwing here
         # This may cause exception loops in py_trees
@@ -136,9 +231,8 @@ class CarlaDataProvider(object):  # pylint: disable=too-many-public-methods
         """
         returns the location for the given actor
         """
-        for key in CarlaDataProvider._actor_location_map:
-            if key.id == actor.id:
-                return CarlaDataProvider._actor_location_map[key]
+        if actor.id in CarlaDataProvider._actor_location_map:
+            return CarlaDataProvider._actor_location_map[actor.id]
 
         # We are intentionally not throwing here
         # This may cause exception loops in py_trees
@@ -150,9 +244,8 @@ class CarlaDataProvider(object):  # pylint: disable=too-many-public-methods
         """
         returns the transform for the given actor
         """
-        for key in CarlaDataProvider._actor_transform_map:
-            if key.id == actor.id:
-                return CarlaDataProvider._actor_transform_map[key]
+        if actor.id in CarlaDataProvider._actor_transform_map:
+            return CarlaDataProvider._actor_transform_map[actor.id]
 
         # We are intentionally not throwing here
         # This may cause exception loops in py_trees
@@ -188,13 +281,14 @@ class CarlaDataProvider(object):  # pylint: disable=too-many-public-methods
         return CarlaDataProvider._ego_vehicle
 
     @staticmethod
-    def set_world(world):
+    def set_world(world, world_map=None):
         """
         Set the world and world settings
+        world_map can be passed when reusing a world, to skip downloading the map again
         """
         CarlaDataProvider._world = world
         CarlaDataProvider._sync_flag = world.get_settings().synchronous_mode
-        CarlaDataProvider._map = world.get_map()
+        CarlaDataProvider._map = world.get_map() if world_map is None else world_map
         CarlaDataProvider._blueprint_library = world.get_blueprint_library()
         CarlaDataProvider.generate_spawn_points()
         CarlaDataProvider.prepare_map()
@@ -814,3 +908,5 @@ class CarlaDataProvider(object):  # pylint: disable=too-many-public-methods
         CarlaDataProvider._spawn_index = 0
         CarlaDataProvider._ego_vehicle = None
         CarlaDataProvider._rng = random.RandomState(2000)
+        CarlaDataProvider._world_state = None
+        CarlaDataProvider._actor_info = dict()
@@ -24,6 +24,8 @@ import shapely
 import carla
 
 from srunner.scenariomanager.carla_data_provider import CarlaDataProvider
+from srunner.scenariomanager.scenarioatomics.fitness_utils import RouteIndex, bearings, footprints, obb_distances
+from srunner.scenariomanager.scenarioatomics.telemetry import TelemetryRecorder
 from srunner.scenariomanager.timer import GameTime
 from srunner.scenariomanager.traffic_events import TrafficEvent, TrafficEventType
 
@@ -1490,17 +1492,11 @@ class InRouteTest(Criterion):
         self._out_route_distance = 0
         self._in_safe_route = True
 
-        self._accum_meters = []
-        prev_wp = self._waypoints[0]
-        for i, wp in enumerate(self._waypoints):
-            d = wp.distance(prev_wp)
-            if i > 0:
-                accum = self._accum_meters[i - 1]
-            else:
-                accum = 0
-
-            self._accum_meters.append(d + accum)
-            prev_wp = wp
+        # closest route points of the lane and completion fitness, searched from the last ones
+        self._route_index = RouteIndex(self._waypoints)
+        self._accum_meters = self._route_index.accum_meters
+        self._lane_index = 0
+        self._completion_index = 0
 
         # Blackboard variable
         blackv = py_trees.blackboard.Blackboard()
@@ -1524,10 +1520,8 @@ class InRouteTest(Criterion):
         # Get distance from destination
         self._fitness_scores = [0,(1000,0),1000,1000,1000]
 
-        self._acc = []
-        self._v = []
-        self._control = []
-        self._passed_waypoints = []
+        # time, location, speed, acceleration, control and fitness of every tick, see utils/result_writer.py
+        self._telemetry = TelemetryRecorder(self._route_index.points)
         # if self._debug == 1:
         self._last_fitness_score = [0,(1000,0),0,0,0]
 
@@ -1619,23 +1613,18 @@ class InRouteTest(Criterion):
         # Get distance from destination
         current_fitness_score = [0,(1000,0),1000,1000,1000]
         # current_fitness_score[0] = self.follow_the_center_of_the_lane(shortest_distance)
-        current_fitness_score[0] = self.get_min_distance_from_lane(self._actor, self._waypoints)
-        current_fitness_score[1] = self.get_min_distance_from_other_vehicle(self._actor,self._world)
-        current_fitness_score[2] = self.get_min_distance_from_pedestrians(self._actor,self._world)
-        current_fitness_score[3] = self.get_min_distance_from_static_mesh(self._actor,self._world)
-        current_fitness_score[4] = self.destney_completeness(self._actor,self._world)
-
-        acc = self.get_fast_accl(self._actor)
-        self._acc.append(acc)
-        self._v.append(self.get_velo(self._actor))
-
-        # control = self._actor.get_control()
-        # self._control.append([control.throttle, control.steer, control.brake, control.hand_brake, control.reverse, control.manual_gear_shift, control.gear])
-        self._control.append(self._actor.get_control())
-
-        # location = self._actor.get_location()
-        # self._passed_waypoints.append([location.x, location.y, location.z])
-        self._passed_waypoints.append(self._actor.get_location())
+        # every actor query of this tick is answered by the snapshot of CarlaDataProvider
+        state = CarlaDataProvider.get_world_state()
+        ego = state.row(self._actor.id)
+        current_fitness_score[0] = self.get_min_distance_from_lane(location)
+        current_fitness_score[1] = self.get_min_distance_from_other_vehicle(state, ego)
+        current_fitness_score[2] = self.get_min_distance_from_pedestrians(state, ego)
+        current_fitness_score[3] = self.get_min_distance_from_static_mesh(state, ego)
+        current_fitness_score[4] = self.destney_completeness(location)
+
+        acc = self.get_fast_accl(state, ego)
+        self._telemetry.record(GameTime.get_time(), location, self.get_velo(state, ego), acc,
+                               self._actor.get_control(), current_fitness_score)
         # print(acc)
 
         if self._debug==1:
@@ -1670,27 +1659,15 @@ class InRouteTest(Criterion):
             print("Follow the Center of the Lane: " + color[0] + str(shortest_distance) + color[1])
         return shortest_distance
 
-    def bounding_box_distance(self, actor1, actor2):
-        bbox_1 = actor1.bounding_box.get_world_vertices(actor1.get_transform())
-        bbox_2 = actor2.bounding_box.get_world_vertices(actor2.get_transform())
-
-        distances = []
-        for location_1 in bbox_1:
-            location_1.z = 0
-            for location_2 in bbox_2:
-                location_2.z = 0
-                distance = location_1.distance(location_2)
-                distances.append(distance)
-        return min(distances)
-
-    def get_min_distance_from_lane(self, ego_vehicle, route):
-        distances = [1000]
-        ego_vehicle_location = ego_vehicle.get_location()
-        for waypoint in route:
-            distance = math.sqrt(((ego_vehicle_location.x - waypoint.x) ** 2) + ((ego_vehicle_location.y - waypoint.y) ** 2))
-            distances.append(distance)
+    def bounding_box_distances(self, state, ego, rows):
+        """
+        Minimum xy distance between the bounding box of the ego and of every actor in rows, 0 if they overlap
+        """
+        return obb_distances(footprints(state, [ego])[0], footprints(state, rows))
 
-        shortest_distance = (min(distances))
+    def get_min_distance_from_lane(self, ego_vehicle_location):
+        distance, self._lane_index = self._route_index.nearest(ego_vehicle_location, self._lane_index, dims=2)
+        shortest_distance = min(distance, 1000)
 
         # color = ['↔️  ','']
         # if shortest_distance > self._last_fitness_score[0]:
@@ -1701,27 +1678,14 @@ class InRouteTest(Criterion):
         
         return shortest_distance 
 
-    def get_min_distance_from_other_vehicle(self,ego_vehicle, world): # include bicycle
+    def get_min_distance_from_other_vehicle(self, state, ego): # include bicycle
         distances = [(1000,0)]
-        ego_vehicle_location = ego_vehicle.get_location()
-        
-        # for target_vehicle in world.get_actors().filter('vehicle.*'):
-        #     if target_vehicle.id == ego_vehicle.id:
-        #         continue
-        #     distance = ego_vehicle_location.distance(target_vehicle.get_location())
-        #     distances.append(distance)
 
-        for target_vehicle in world.get_actors().filter('vehicle.*'):
-            if target_vehicle.id == ego_vehicle.id:
-                continue
-            distance = self.bounding_box_distance(ego_vehicle, target_vehicle) 
-            forward = ego_vehicle.get_transform().get_forward_vector()
-            direction = self.rotation_angle_and_direction_2D(
-                np.array([forward.x, forward.y]),
-                np.array([ego_vehicle.get_location().x - target_vehicle.get_location().x, 
-                          ego_vehicle.get_location().y - target_vehicle.get_location().y])
-            )
-            distances.append((distance, direction))
+        rows = state.filter('vehicle.*')
+        rows = rows[state.ids[rows] != self._actor.id]
+        if ego is not None and len(rows) > 0:
+            directions = bearings(state, ego, rows)
+            distances += list(zip(self.bounding_box_distances(state, ego, rows).tolist(), directions.tolist()))
 
         # shortest_distance = (min(distances)) - 3.32
         shortest_distance = (min(distances))
@@ -1734,13 +1698,12 @@ class InRouteTest(Criterion):
             print("Minimum Distance from other Vehicle: " + color[0] + str(shortest_distance) + color[1])
         return shortest_distance # substracting distances from center of vehicle
 
-    def get_min_distance_from_pedestrians(self, ego_vehicle, world):
+    def get_min_distance_from_pedestrians(self, state, ego):
         distances = [1000]
-        ego_vehicle_location = ego_vehicle.get_location()
 
-        for target_vehicle in world.get_actors().filter('walker.*'):
-            distance = ego_vehicle_location.distance(target_vehicle.get_location())
-            distances.append(distance)
+        rows = state.filter('walker.*')
+        if ego is not None and len(rows) > 0:
+            distances += np.linalg.norm(state.locations[rows] - state.locations[ego], axis=1).tolist()
 
         # shortest_distance = (min(distances)) - 1.2
         shortest_distance = (min(distances))
@@ -1753,19 +1716,16 @@ class InRouteTest(Criterion):
             print("Minimum Distance from Pedestrians: " + color[0] + str(shortest_distance) + color[1])
         return shortest_distance  # substracting distances from center of vehicle
 
-    def get_min_distance_from_static_mesh(self, ego_vehicle, world):
+    def get_min_distance_from_static_mesh(self, state, ego):
         distances = [1000]
-        ego_vehicle_location = ego_vehicle.get_location()
 
         # for target_vehicle in world.get_actors().filter('static.*'):
         #     distance = ego_vehicle_location.distance(target_vehicle.get_location())
         #     distances.append(distance)
-        for target_vehicle in world.get_actors().filter('traffic.*.*'):
-            distance = ego_vehicle_location.distance(target_vehicle.get_location())
-            distances.append(distance)
-        for target_vehicle in world.get_actors().filter('traffic.*'):
-            distance = ego_vehicle_location.distance(target_vehicle.get_location())
-            distances.append(distance)
+        # traffic.* also matches every traffic.*.* actor
+        rows = state.filter('traffic.*')
+        if ego is not None and len(rows) > 0:
+            distances += np.linalg.norm(state.locations[rows] - state.locations[ego], axis=1).tolist()
 
         shortest_distance = min(distances)
         if self._debug == 1:
@@ -1777,16 +1737,10 @@ class InRouteTest(Criterion):
             print("Minimum Distance from static Mesh: " + color[0] + str(shortest_distance) + color[1])
         return (shortest_distance)  # substracting distances from center of vehicle
 
-    def destney_completeness(self, ego_vehicle, world):
-        ego_vehicle_location = ego_vehicle.get_location()
+    def destney_completeness(self, ego_vehicle_location):
+        _, self._completion_index = self._route_index.nearest(ego_vehicle_location, self._completion_index)
 
-        closest_i, cloest_dist = 0, ego_vehicle_location.distance(self._waypoints[0])
-        for i, waypoint in enumerate(self._waypoints):
-            dist = ego_vehicle_location.distance(waypoint)
-            if dist < cloest_dist:
-                closest_i, cloest_dist = i, dist
-
-        shortest_distance = (closest_i+1)/len(self._waypoints)
+        shortest_distance = (self._completion_index+1)/len(self._waypoints)
         if self._debug == 1:
             color = ['↔️  ','']
             if shortest_distance > self._last_fitness_score[4]:
@@ -1796,16 +1750,20 @@ class InRouteTest(Criterion):
             print("Destney Completeness: " + color[0] + str(shortest_distance) + color[1])
         return 1 - shortest_distance
     
-    def get_fast_accl(self, ego_vehicle):
-        acc_vector = ego_vehicle.get_acceleration()
-        vel_vector = ego_vehicle.get_velocity()
+    def get_fast_accl(self, state, ego):
+        if ego is None:
+            return 0.
+        acc_vector = state.accelerations[ego]
+        vel_vector = state.velocities[ego]
 
-        acc = (acc_vector.x**2 + acc_vector.y**2)**0.5 * self.angle_between_vectors([acc_vector.x, acc_vector.y], [vel_vector.x, vel_vector.y])
+        acc = (acc_vector[0]**2 + acc_vector[1]**2)**0.5 * self.angle_between_vectors(acc_vector[:2], vel_vector[:2])
         return acc
     
-    def get_velo(self, ego_vehicle):
-        vector = ego_vehicle.get_velocity()
-        velo = (vector.x**2 + vector.y**2)**0.5
+    def get_velo(self, state, ego):
+        if ego is None:
+            return 0.
+        vector = state.velocities[ego]
+        velo = (vector[0]**2 + vector[1]**2)**0.5
         return velo
     
     def angle_between_vectors(self, vector1, vector2):
@@ -1956,6 +1914,9 @@ class RunningRedLightTest(Criterion):
             if 'traffic_light' in _actor.type_id:
                 center, waypoints = self.get_traffic_light_waypoints(_actor)
                 self._list_traffic_lights.append((_actor, center, waypoints))
+        # light centers as one array, only the lights within DISTANCE_LIGHT are checked on each tick
+        self._light_centers = np.array([[center.x, center.y, center.z] for _, center, _ in self._list_traffic_lights],
+                                       dtype=np.float64).reshape(-1, 3)
 
     # pylint: disable=no-self-use
     def is_vehicle_crossing_line(self, seg1, seg2):
@@ -1987,7 +1948,13 @@ class RunningRedLightTest(Criterion):
         tail_far_pt = self.rotate_point(carla.Vector3D(-veh_extent - 1, 0.0, location.z), transform.rotation.yaw)
         tail_far_pt = location + carla.Location(tail_far_pt)
 
-        for traffic_light, center, waypoints in self._list_traffic_lights:
+        if self.debug:
+            traffic_lights = self._list_traffic_lights
+        else:
+            distances = np.linalg.norm(self._light_centers - [location.x, location.y, location.z], axis=1)
+            traffic_lights = [self._list_traffic_lights[i] for i in np.flatnonzero(distances <= self.DISTANCE_LIGHT)]
+
+        for traffic_light, center, waypoints in traffic_lights:
 
             if self.debug:
                 z = 2.1
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+"""
+This module provides the NumPy helpers behind the fitness scores of InRouteTest.
+"""
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+class RouteIndex(object):
+
+    """
+    The dense route of a scenario as a NumPy array, with KD-trees over its points.
+
+    Nearest point queries start from a window around the index returned for the previous
+    tick. The closest window point bounds the KD-tree search, which is then only needed
+    to confirm there is no closer point elsewhere on the route, so the per-tick cost does
+    not grow with the route length.
+    """
+
+    WINDOW_SIZE = 10  # route points checked before and after the previous closest index
+
+    def __init__(self, waypoints):
+        self.points = np.array([[waypoint.x, waypoint.y, waypoint.z] for waypoint in waypoints], dtype=np.float64)
+        self.accum_meters = np.concatenate([[0.], np.cumsum(np.linalg.norm(np.diff(self.points, axis=0), axis=1))])
+        self._trees = {2: cKDTree(self.points[:, :2]), 3: cKDTree(self.points)}
+
+    def __len__(self):
+        return len(self.points)
+
+    def nearest(self, location, hint=0, dims=3):
+        """
+        Returns (distance, index) of the route point closest to location, in the xy plane if dims is 2
+        """
+        point = np.array([location.x, location.y, location.z][:dims])
+        start = max(hint - self.WINDOW_SIZE, 0)
+        window = self.points[start:hint + self.WINDOW_SIZE + 1, :dims]
+        distances = np.sqrt(((window - point) ** 2).sum(axis=1))
+        index = int(np.argmin(distances))
+        distance, index = distances[index], start + index
+
+        tree_distance, tree_index = self._trees[dims].query(point, distance_upper_bound=distance)
+        if tree_index < len(self.points) and tree_distance < distance:
+            return tree_distance, int(tree_index)
+        return distance, index
+
+
+_CORNERS = np.array([[-1, -1], [1, -1], [1, 1], [-1, 1]], dtype=np.float64)  # counter clockwise
+
+
+def footprints(state, rows):
+    """
+    The 4 corners [len(rows), 4, 2] of the xy footprint of the bounding boxes of a WorldState,
+    in counter clockwise order. Pitch and roll are ignored.
+    """
+    yaw = np.radians(state.rotations[rows, 1])
+    cos, sin = np.cos(yaw)[:, None], np.sin(yaw)[:, None]
+    local = state.box_locations[rows, None, :2] + state.extents[rows, None, :2] * _CORNERS
+    return np.stack([cos * local[..., 0] - sin * local[..., 1],
+                     sin * local[..., 0] + cos * local[..., 1]], axis=-1) + state.locations[rows, None, :2]
+
+
+def _point_segment_distances(points, starts, ends):
+    # distances [..., P, S] from every point to every segment
+    edge = ends - starts
+    offset = points[..., :, None, :] - starts[..., None, :, :]
+    t = np.clip((offset * edge[..., None, :, :]).sum(-1) / np.maximum((edge ** 2).sum(-1), 1e-12)[..., None, :], 0., 1.)
+    return np.linalg.norm(offset - t[..., None] * edge[..., None, :, :], axis=-1)
+
+
+def obb_distances(box, boxes):
+    """
+    Minimum distance between the oriented box (corners [4, 2]) and each of the boxes (corners [N, 4, 2]),
+    0 where they overlap. For convex polygons that do not overlap, the minimum is reached between a
+    corner of one box and an edge of the other; overlaps are found with the separating axis test.
+    """
+    box = np.broadcast_to(box, boxes.shape)
+    distances = np.minimum(
+        _point_segment_distances(box, boxes, np.roll(boxes, -1, axis=-2)).min(axis=(-2, -1)),
+        _point_segment_distances(boxes, box, np.roll(box, -1, axis=-2)).min(axis=(-2, -1)))
+
+    # the two edge directions of each rectangle, the normals of its other edges, are the candidate separating axes
+    axes = np.concatenate([box[:, 1:3] - box[:, 0:2], boxes[:, 1:3] - boxes[:, 0:2]], axis=1)
+    projection = np.einsum('nac,npc->nap', axes, box)
+    projections = np.einsum('nac,npc->nap', axes, boxes)
+    separated = (projection.max(-1) < projections.min(-1)) | (projections.max(-1) < projection.min(-1))
+    distances[~separated.any(axis=1)] = 0.
+    return distances
+
+
+def bearings(state, ego, rows):
+    """
+    Angle in degrees from the forward vector of the ego to the vector from each actor to the ego,
+    as InRouteTest.rotation_angle_and_direction_2D
+    """
+    offsets = state.locations[ego, :2] - state.locations[rows, :2]
+    yaw = np.radians(state.rotations[ego, 1])
+    return np.degrees(np.arctan2(offsets[:, 1], offsets[:, 0]) - np.arctan2(np.sin(yaw), np.cos(yaw)))
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+"""
+This module provides the per-tick telemetry of the ego vehicle recorded by InRouteTest.
+"""
+
+import os
+import argparse
+import numpy as np
+import pandas as pd
+
+
+CONTROL_FIELDS = ['throttle', 'steer', 'brake', 'hand_brake', 'reverse', 'manual_gear_shift', 'gear']
+FITNESS_FIELDS = ['DOL', 'DVE', 'DVE_direction', 'DPD', 'DSM', 'DFD']
+
+TELEMETRY_DTYPE = np.dtype(
+    [('time', np.float64), ('x', np.float64), ('y', np.float64), ('z', np.float64),
+     ('speed', np.float32), ('acc', np.float32)] +
+    [(field, np.float32) for field in CONTROL_FIELDS[:3]] +
+    [(field, np.bool_) for field in CONTROL_FIELDS[3:6]] + [('gear', np.int8)] +
+    [(field, np.float32) for field in FITNESS_FIELDS])
+
+
+class TelemetryRecorder(object):
+
+    """
+    One row of TELEMETRY_DTYPE per tick in a preallocated structured array, doubled when full.
+    The rows and the reference route are written once per case to a compressed .npz,
+    write_csv turns such a file into the control.csv, real_route.csv and ori_route.csv tables.
+    """
+
+    def __init__(self, route, capacity=1024):
+        self.route = np.asarray(route, dtype=np.float64).reshape(-1, 3)
+        self._rows = np.zeros(capacity, dtype=TELEMETRY_DTYPE)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def rows(self):
+        return self._rows[:self._size]
+
+    def record(self, time, location, speed, acc, control, fitness_score):
+        """
+        Adds the row of one tick, fitness_score is the current InRouteTest score
+        [DOL, (DVE, direction), DPD, DSM, DFD]
+        """
+        if self._size == len(self._rows):
+            self._rows = np.concatenate([self._rows, np.zeros(len(self._rows), dtype=TELEMETRY_DTYPE)])
+        self._rows[self._size] = (
+            time, location.x, location.y, location.z, speed, acc,
+            control.throttle, control.steer, control.brake, control.hand_brake, control.reverse,
+            control.manual_gear_shift, control.gear,
+            fitness_score[0], fitness_score[1][0], fitness_score[1][1],
+            fitness_score[2], fitness_score[3], fitness_score[4])
+        self._size += 1
+
+    def save(self, path):
+        np.savez_compressed(path, telemetry=self.rows, route=self.route)
+
+
+def load(path):
+    """
+    The telemetry rows and the route of a file written by TelemetryRecorder.save
+    """
+    with np.load(path) as data:
+        return data['telemetry'], data['route']
+
+
+def write_csv(path, directory=None):
+    """
+    Writes the control.csv, real_route.csv and ori_route.csv tables of a telemetry file,
+    next to it unless directory is given
+    """
+    telemetry, route = load(path)
+    directory = directory or os.path.dirname(path)
+    pd.DataFrame({field: telemetry[field] for field in CONTROL_FIELDS},
+                 columns=CONTROL_FIELDS).to_csv(os.path.join(directory, 'control.csv'), index=False)
+    pd.DataFrame({field: telemetry[field] for field in ['x', 'y', 'z']},
+                 columns=['x', 'y', 'z']).to_csv(os.path.join(directory, 'real_route.csv'), index=False)
+    pd.DataFrame(route, columns=['x', 'y', 'z']).to_csv(os.path.join(directory, 'ori_route.csv'), index=False)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Writes the csv tables of telemetry.npz files')
+    parser.add_argument('paths', nargs='+', help='telemetry.npz files')
+    parser.add_argument('--output', type=str, default=None, help='output directory of a single file, the directory of each file by default')
+    args = parser.parse_args()
+    for telemetry_path in args.paths:
+        write_csv(telemetry_path, args.output)
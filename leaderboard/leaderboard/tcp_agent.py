@@ -13,17 +13,18 @@ import torch
 import carla
 import numpy as np
 from PIL import Image
-from torchvision import transforms as T
 
 from leaderboard.autoagents import autonomous_agent
 
 from TCP.model import TCP
+from TCP.engine import TCPEngine
 from TCP.config import GlobalConfig
 from planner import RoutePlanner
 
 
 SAVE_PATH = os.environ.get('SAVE_PATH', None)
 SAVE_IMG = os.environ.get('SAVE_IMG', None) 
+TCP_ENGINE = os.environ.get('TCP_ENGINE', 'script') # 'eager' skips tracing
 
 def get_entry_point():
 	return 'TCPAgent'
@@ -57,13 +58,14 @@ class TCPAgent(autonomous_agent.AutonomousAgent):
 		self.net.load_state_dict(new_state_dict, strict = False)
 		self.net.cuda()
 		self.net.eval()
+		self.engine = TCPEngine(self.net, script=TCP_ENGINE != 'eager')
+		self.engine.warmup()
 
 		self.takeover = False
 		self.stop_time = 0
 		self.takeover_time = 0
 
 		self.save_path = None
-		self._im_transform = T.Compose([T.ToTensor(), T.Normalize(mean=[0.485,0.456,0.406], std=[0.229,0.224,0.225])])
 
 		self.last_steers = deque()
 		if SAVE_PATH is not None:
@@ -174,8 +176,6 @@ class TCPAgent(autonomous_agent.AutonomousAgent):
 			self._init()
 		tick_data = self.tick(input_data)
 		if self.step < self.config.seq_len:
-			rgb = self._im_transform(tick_data['rgb']).unsqueeze(0)
-
 			control = carla.VehicleControl()
 			control.steer = 0.0
 			control.throttle = 0.0
@@ -183,25 +183,17 @@ class TCPAgent(autonomous_agent.AutonomousAgent):
 			
 			return control
 
-		gt_velocity = torch.FloatTensor([tick_data['speed']]).to('cuda', dtype=torch.float32)
 		command = tick_data['next_command']
 		if command < 0:
 			command = 4
 		command -= 1
 		assert command in [0, 1, 2, 3, 4, 5]
-		cmd_one_hot = [0] * 6
-		cmd_one_hot[command] = 1
-		cmd_one_hot = torch.tensor(cmd_one_hot).view(1, 6).to('cuda', dtype=torch.float32)
-		speed = torch.FloatTensor([float(tick_data['speed'])]).view(1,1).to('cuda', dtype=torch.float32)
-		speed = speed / 12
-		rgb = self._im_transform(tick_data['rgb']).unsqueeze(0).to('cuda', dtype=torch.float32)
 
-		tick_data['target_point'] = [torch.FloatTensor([tick_data['target_point'][0]]),
-										torch.FloatTensor([tick_data['target_point'][1]])]
-		target_point = torch.stack(tick_data['target_point'], dim=1).to('cuda', dtype=torch.float32)
-		state = torch.cat([speed, target_point, cmd_one_hot], 1)
+		pred = self.engine(tick_data['rgb'], float(tick_data['speed']), tick_data['target_point'], command)
 
-		pred= self.net(rgb, state, target_point)
+		# only read back on the host by process_action and control_pid, control_pid copies them before its in-place flips
+		gt_velocity = torch.FloatTensor([tick_data['speed']])
+		target_point = torch.FloatTensor([tick_data['target_point']])
 
 		steer_ctrl, throttle_ctrl, brake_ctrl, metadata = self.net.process_action(pred, tick_data['next_command'], gt_velocity, target_point)
 
@@ -272,5 +264,6 @@ class TCPAgent(autonomous_agent.AutonomousAgent):
 		outfile.close()
 
 	def destroy(self):
+		del self.engine
 		del self.net
 		torch.cuda.empty_cache()
\ No newline at end of file
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# the scripts run with leaderboard/ and leaderboard/leaderboard/ on PYTHONPATH, for srunner, SBT and leaderboard.*
+LEADERBOARD_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in [LEADERBOARD_ROOT, os.path.dirname(LEADERBOARD_ROOT)]:
+    if path not in sys.path:
+        sys.path.insert(0, path)
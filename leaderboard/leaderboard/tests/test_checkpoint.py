@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('pymoo')
+
+from pymoo.core.problem import ElementwiseProblem
+from pymoo.algorithms.moo.nsga2 import NSGA2
+from pymoo.operators.crossover.sbx import SBX
+from pymoo.operators.mutation.pm import PM
+from pymoo.operators.sampling.rnd import FloatRandomSampling
+from pymoo.termination import get_termination
+from pymoo.optimize import minimize
+
+from SBT.checkpoint import SearchCheckpoint, CHECKPOINT_FILE
+
+
+GENERATIONS = 4
+
+
+class StubProblem(ElementwiseProblem):
+    """
+    Two cheap objectives over the 14 scenario parameters, counts its evaluations
+    """
+    def __init__(self):
+        super().__init__(n_var=14, n_obj=2, xl=np.zeros(14), xu=np.ones(14))
+        self.evaluations = 0
+
+    def _evaluate(self, x, out, *args, **kwargs):
+        self.evaluations += 1
+        out['F'] = [x[0], 1 + x[1:].sum() - np.sqrt(x[0])]
+
+
+class Interrupted(Exception):
+    pass
+
+
+class InterruptingCheckpoint(SearchCheckpoint):
+    # saves like SearchCheckpoint, then stops the run as if it was killed after the generation
+    def __init__(self, path, stop):
+        super().__init__(path)
+        self.stop = stop
+
+    def notify(self, algorithm):
+        super().notify(algorithm)
+        if algorithm.n_gen == self.stop:
+            raise Interrupted()
+
+
+def algorithm():
+    # GA_search settings with a smaller population
+    return NSGA2(pop_size=10, n_offsprings=4, sampling=FloatRandomSampling(),
+                 crossover=SBX(prob=0.9, eta=15), mutation=PM(eta=20), eliminate_duplicates=True)
+
+
+def run(problem, algorithm, callback=None):
+    # minimize passes callback=None on to the algorithm, which then has nothing to call
+    kwargs = {} if callback is None else {'callback': callback}
+    return minimize(problem, algorithm, get_termination('n_gen', 2 * GENERATIONS),
+                    copy_algorithm=False, seed=1, **kwargs)
+
+
+def test_resumed_search_matches_uninterrupted_run(tmp_path):
+    reference = run(StubProblem(), algorithm())
+
+    path = str(tmp_path / CHECKPOINT_FILE)
+    with pytest.raises(Interrupted):
+        run(StubProblem(), algorithm(), InterruptingCheckpoint(path, GENERATIONS))
+    # unrelated draws between the crash and the resume must not matter
+    np.random.rand(100)
+
+    problem = StubProblem()
+    checkpoint = SearchCheckpoint(path)
+    assert checkpoint.exists()
+    resumed = checkpoint.load(problem)
+    assert resumed.problem is problem
+    assert resumed.n_gen == GENERATIONS + 1
+    result = run(problem, resumed, checkpoint)
+
+    assert result.algorithm.n_gen == reference.algorithm.n_gen
+    # only the offspring of the remaining generations are evaluated, on the rebound problem
+    assert problem.evaluations == GENERATIONS * 4
+    np.testing.assert_array_equal(result.pop.get('X'), reference.pop.get('X'))
+    np.testing.assert_array_equal(result.pop.get('F'), reference.pop.get('F'))
+    np.testing.assert_array_equal(result.F, reference.F)
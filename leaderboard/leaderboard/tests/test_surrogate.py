@@ -0,0 +1,32 @@
+import numpy as np
+
+from SBT.surrogate import OnlineSurrogate
+
+
+def objectives(X):
+    return np.stack([X[:, 0], 1 - X[:, 1], X[:, :2].mean(1)], axis=1)
+
+
+def test_online_surrogate_updates_between_refits():
+    rng = np.random.RandomState(0)
+    surrogate = OnlineSurrogate(n_inducing=32)
+    X = rng.rand(20, 14)
+    surrogate.update(X, objectives(X))
+    model = surrogate.model
+
+    # new batches go through SparseKriging.update until the case count doubles
+    for _ in range(4):
+        X = rng.rand(4, 14)
+        surrogate.update(X, objectives(X))
+        assert surrogate.model is model
+    assert len(surrogate) == model.n == 36
+    X = rng.rand(4, 14)
+    surrogate.update(X, objectives(X))
+    assert surrogate.model is not model
+    assert surrogate.model.n == len(surrogate) == 40
+
+    X_test = rng.rand(50, 14)
+    mean, std = surrogate.predict(X_test)
+    assert mean.shape == std.shape == (50, 3)
+    assert (std > 0).all()
+    assert np.abs(mean - objectives(X_test)).mean() < 0.15
@@ -0,0 +1,203 @@
+import os
+import argparse
+import fnmatch
+import itertools
+
+import pytest
+
+pytest.importorskip('carla')
+pytest.importorskip('py_trees')
+pytest.importorskip('pymoo')
+
+# read when SBT.framework is imported, the run scripts export them
+for name in ['GA', 'LOG', 'SURROGATE']:
+    os.environ.setdefault(name, 'False')
+
+import run_one_case
+
+
+_world_ids = itertools.count(1)
+
+
+class FakeMap(object):
+    def __init__(self, name):
+        self.name = name
+
+
+class FakeActor(object):
+    def __init__(self, actor_id, type_id):
+        self.id = actor_id
+        self.type_id = type_id
+
+
+class FakeActorList(list):
+    def filter(self, pattern):
+        return FakeActorList(actor for actor in self if fnmatch.fnmatchcase(actor.type_id, pattern))
+
+
+class FakeWorld(object):
+    def __init__(self, town):
+        self.id = next(_world_ids)
+        self.town = town
+        self.actors = FakeActorList()
+        self.settings = argparse.Namespace(synchronous_mode=False, fixed_delta_seconds=None)
+        self.map_downloads = 0
+
+    def get_actors(self):
+        return self.actors
+
+    def get_settings(self):
+        return argparse.Namespace(**vars(self.settings))
+
+    def apply_settings(self, settings):
+        self.settings = settings
+
+    def get_map(self):
+        self.map_downloads += 1
+        return FakeMap(self.town)
+
+    def reset_all_traffic_lights(self):
+        pass
+
+    def tick(self):
+        pass
+
+    def wait_for_tick(self):
+        pass
+
+
+class FakeClient(object):
+    """
+    Server side world of a CARLA client. dead makes get_world fail like a server that stopped answering.
+    """
+    def __init__(self):
+        self.world = None
+        self.loads = []
+        self.destroyed = []
+        self.dead = False
+
+    def load_world(self, town):
+        self.loads.append(town)
+        self.world = FakeWorld(town)
+        return self.world
+
+    def get_world(self):
+        if self.dead:
+            raise RuntimeError('time-out of 10000ms while waiting for the simulator')
+        return self.world
+
+    def apply_batch_sync(self, commands):
+        self.destroyed += [command.actor_id for command in commands]
+
+
+class FakeTrafficManager(object):
+    def set_synchronous_mode(self, mode):
+        pass
+
+    def set_random_device_seed(self, seed):
+        pass
+
+
+class WarmTestCase(run_one_case.TestCase):
+    """
+    TestCase with only the state used by _load_and_wait_for_world, bound to a fake client
+    """
+    def __init__(self, client, warm_world):
+        self.args = argparse.Namespace(log=False, trafficManagerPort=8000, trafficManagerSeed=0, warm_world=warm_world)
+        self.warm_world = bool(warm_world)
+        self.world = None
+        self._world_town = None
+        self._world_map = None
+        self.client = client
+        self.traffic_manager = FakeTrafficManager()
+
+    def __del__(self):
+        pass
+
+    def load(self, town):
+        self._load_and_wait_for_world(self.args, town, None)
+
+
+@pytest.fixture
+def provider(monkeypatch):
+    """
+    Replaces the CarlaDataProvider calls of _load_and_wait_for_world, records the world and map it receives
+    """
+    state = {}
+    CarlaDataProvider = run_one_case.CarlaDataProvider
+
+    def set_world(world, world_map=None):
+        state['world'] = world
+        state['map'] = world.get_map() if world_map is None else world_map
+
+    monkeypatch.setattr(CarlaDataProvider, 'set_client', staticmethod(lambda client: None))
+    monkeypatch.setattr(CarlaDataProvider, 'set_world', staticmethod(set_world))
+    monkeypatch.setattr(CarlaDataProvider, 'set_traffic_manager_port', staticmethod(lambda port: None))
+    monkeypatch.setattr(CarlaDataProvider, 'set_weather', staticmethod(lambda weather: None))
+    monkeypatch.setattr(CarlaDataProvider, 'is_sync_mode', staticmethod(lambda: True))
+    monkeypatch.setattr(CarlaDataProvider, 'get_map', staticmethod(lambda: state['map']))
+    return state
+
+
+def test_same_town_reuses_world(provider):
+    client = FakeClient()
+    case = WarmTestCase(client, warm_world=1)
+    case.load('Town01')
+    world = case.world
+    world.actors.extend([FakeActor(5, 'vehicle.tesla.model3'), FakeActor(6, 'walker.pedestrian.0001'),
+                         FakeActor(7, 'sensor.camera.rgb'), FakeActor(8, 'traffic.traffic_light')])
+
+    case.load('Town01')
+    assert client.loads == ['Town01']
+    assert case.world is world
+    assert sorted(client.destroyed) == [5, 6, 7]
+    # the cached map is handed to CarlaDataProvider instead of downloading it again
+    assert world.map_downloads == 1
+    assert provider['world'] is world
+    assert world.settings.synchronous_mode
+
+
+def test_town_change_reloads(provider):
+    client = FakeClient()
+    case = WarmTestCase(client, warm_world=1)
+    case.load('Town01')
+    case.load('Town02')
+    assert client.loads == ['Town01', 'Town02']
+    assert case.world.town == 'Town02'
+    assert case._world_town == 'Town02'
+
+
+def test_dead_server_reloads(provider):
+    client = FakeClient()
+    case = WarmTestCase(client, warm_world=1)
+    case.load('Town01')
+    world = case.world
+    # the health check RPC fails, the world is loaded from scratch
+    client.dead = True
+    assert not case._is_world_reusable('Town01')
+    case.load('Town01')
+    assert client.loads == ['Town01', 'Town01']
+    assert case.world is not world
+
+
+def test_foreign_world_reloads(provider):
+    client = FakeClient()
+    case = WarmTestCase(client, warm_world=1)
+    case.load('Town01')
+    world = case.world
+    # another client loaded the same town, the kept world is stale
+    client.world = FakeWorld('Town01')
+    case.load('Town01')
+    assert client.loads == ['Town01', 'Town01']
+    assert case.world is not world
+    assert case.world is client.world
+
+
+def test_warm_world_disabled_always_loads(provider):
+    client = FakeClient()
+    case = WarmTestCase(client, warm_world=0)
+    case.load('Town01')
+    case.load('Town01')
+    assert client.loads == ['Town01', 'Town01']
+    assert case._world_town is None
+    assert not client.destroyed
@@ -0,0 +1,87 @@
+import os
+import time
+
+import pytest
+
+from SBT.parallel import WorkerPool
+
+
+class Square(object):
+    """
+    Stub evaluator factory, the later cases of a population finish first
+    """
+    def __call__(self):
+        def evaluate(x):
+            time.sleep(0.05 * (3 - x % 4))
+            return x * x
+        return evaluate
+
+
+class FailOnce(object):
+    """
+    Stub evaluator factory that crashes the worker (or hangs it) the first time it sees case `bad`,
+    the marker file tells the restarted worker the case was already tried
+    """
+    def __init__(self, marker, bad, hang=False):
+        self.marker = marker
+        self.bad = bad
+        self.hang = hang
+
+    def __call__(self):
+        def evaluate(x):
+            if x == self.bad and not os.path.exists(self.marker):
+                open(self.marker, 'w').close()
+                if self.hang:
+                    time.sleep(600)
+                os._exit(1)
+            return x * x
+        return evaluate
+
+
+class AlwaysRaise(object):
+    """
+    Stub evaluator factory that logs every attempt to a file and raises
+    """
+    def __init__(self, log):
+        self.log = log
+
+    def __call__(self):
+        def evaluate(x):
+            with open(self.log, 'a') as f:
+                f.write('{}\n'.format(x))
+            raise ValueError('stub failure')
+        return evaluate
+
+
+def test_results_follow_input_order():
+    pool = WorkerPool([Square(), Square(), Square()], log=False)
+    try:
+        X = list(range(12))
+        assert pool.map(X) == [x * x for x in X]
+    finally:
+        pool.close()
+
+
+@pytest.mark.parametrize('hang', [False, True])
+def test_crashed_or_hung_worker_is_replaced(tmp_path, hang):
+    pool = WorkerPool([FailOnce(str(tmp_path / 'marker'), bad=2, hang=hang)], case_timeout=3 if hang else None, log=False)
+    try:
+        pid = pool._processes[0].pid
+        assert pool.map([1, 2, 3]) == [1, 4, 9]
+        assert os.path.exists(str(tmp_path / 'marker'))
+        assert pool._processes[0].pid != pid
+        assert pool._processes[0].is_alive()
+    finally:
+        pool.close()
+
+
+def test_case_fails_after_retry_limit(tmp_path):
+    log = str(tmp_path / 'attempts')
+    pool = WorkerPool([AlwaysRaise(log)], max_retries=2, log=False)
+    try:
+        with pytest.raises(RuntimeError, match='Case 0 failed 3 times'):
+            pool.map([7])
+        with open(log) as f:
+            assert f.read().split() == ['7', '7', '7']
+    finally:
+        pool.close()
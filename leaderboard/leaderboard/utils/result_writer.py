@@ -13,12 +13,75 @@ It shall be used from the ScenarioManager only.
 from __future__ import print_function
 
 import time
+from collections import OrderedDict
 from tabulate import tabulate
 import numpy as np
-import pandas as pd
 import matplotlib.pyplot as plt
 import os
 
+from srunner.scenariomanager.scenarioatomics.telemetry import write_csv
+
+
+FITNESS_NAMES = [
+    'Distance out of the Lane',
+    'Minimum Distance from other Vehicle',
+    'Minimum Distance from Pedestrians',
+    'Minimum Distance from static Mesh',
+    'Distance away from Final Destination',
+]
+
+
+class CaseResult(object):
+
+    """
+    Outcome of one simulated case, returned to the caller of TestCase.run_one_case.
+    - criteria maps the criterion name to (test_status, actual_value) in evaluation order,
+      the last entry is Timeout with the game duration as value
+    - fitness_scores are the five InRouteTest scores, in FITNESS_NAMES order
+    """
+
+    def __init__(self, name, global_result, criteria, fitness_scores, duration_system, duration_game):
+        self.name = name
+        self.global_result = global_result
+        self.criteria = criteria
+        self.fitness_scores = fitness_scores
+        self.duration_system = duration_system
+        self.duration_game = duration_game
+
+    def status(self, name):
+        return self.criteria[name][0]
+
+    def value(self, name):
+        return self.criteria[name][1]
+
+    def failed(self, name):
+        return self.status(name) == "FAILURE"
+
+    def criterion_line(self):
+        """
+        Row of criterion.csv: status (0 success, 1 failure) and value of every criterion, then the Timeout status
+        """
+        results = []
+        for name, (status, actual_value) in self.criteria.items():
+            results.append(status)
+            if name != "Timeout":
+                results.append(str(actual_value))
+        line = ','.join(results)+'\n'
+        return line.replace('SUCCESS','0').replace('FAILURE','1')
+
+    def fitness_line(self):
+        return ','.join([str(result) for result in self.fitness_scores])+'\n'
+
+    def append_csv(self, fitness_path):
+        """
+        Append-only persistence of the result, the caller gets the object itself
+        """
+        with open(fitness_path.replace('fitness','criterion'), 'a') as criterion_file:
+            criterion_file.write(self.criterion_line())
+        if self.fitness_scores is not None:
+            with open(fitness_path, 'a') as fitness_file:
+                fitness_file.write(self.fitness_line())
+
 
 class ResultOutputProvider(object):
 
@@ -40,6 +103,7 @@ class ResultOutputProvider(object):
         self._end_time = time.strftime('%Y-%m-%d %H:%M:%S',
                                        time.localtime(self._data.end_system_time))
 
+        self.result = self.create_result()
         output_text = self.create_output_text()
         fitness_score_text = self.create_fitness_score_text()
         if log:
@@ -48,6 +112,25 @@ class ResultOutputProvider(object):
         
 
 
+    def create_result(self):
+        """
+        Collects the criteria and fitness scores of the scenario into a CaseResult
+        """
+        criteria = OrderedDict()
+        fitness_scores = None
+        for criterion in self._data.scenario.get_criteria():
+            criteria[criterion.name] = (criterion.test_status, criterion.actual_value)
+            if criterion.name == "InRouteTest":
+                fitness_scores = list(criterion._fitness_scores)
+
+        if self._data.scenario_duration_game < self._data.scenario.timeout:
+            criteria["Timeout"] = ("SUCCESS", self._data.scenario_duration_game)
+        else:
+            criteria["Timeout"] = ("FAILURE", self._data.scenario_duration_game)
+
+        return CaseResult(self._data.scenario_tree.name, self._global_result, criteria, fitness_scores,
+                          self._data.scenario_duration_system, self._data.scenario_duration_game)
+
     def create_fitness_score_text(self):
         # print("\033[1mFitness Scores:\033[0m")
         for criterion in self._data.scenario.get_criteria():
@@ -56,48 +139,25 @@ class ResultOutputProvider(object):
 
                 header = ['\033[1mFitness Score\033[0m', '\033[1mResult\033[0m']
                 list_statistics = [header]
-                fitness_names = [
-                    'Distance out of the Lane',
-                    'Minimum Distance from other Vehicle',
-                    'Minimum Distance from Pedestrians',
-                    'Minimum Distance from static Mesh',
-                    'Distance away from Final Destination',
-                ]
-                logline = ""
                 for i, result in enumerate(criterion._fitness_scores):
-                    list_statistics.extend([[fitness_names[i], result]])
-                    logline += str(result)
-                    logline += ","
-                logline = logline[:-1]+'\n'
-                
-                fitness_file = open(self._data.fitness_path, 'a')
-                # print(self._data.fitness_path)
-                fitness_file.write(logline)
-                fitness_file.close()
+                    list_statistics.extend([[FITNESS_NAMES[i], result]])
 
                 TEST_CASE_PATH = os.environ.get("TEST_CASE_PATH", self._data.fitness_path[:-11])
                 # print(TEST_CASE_PATH)
 
+                telemetry = criterion._telemetry.rows
                 fig, ax = plt.subplots()
-                ax.plot(np.arange(len(criterion._acc)), criterion._acc, label='Acceleration')
-                ax.plot(np.arange(len(criterion._v)), criterion._v, label='Velocity')
+                ax.plot(np.arange(len(telemetry)), telemetry['acc'], label='Acceleration')
+                ax.plot(np.arange(len(telemetry)), telemetry['speed'], label='Velocity')
                 ax.legend()
                 fig.savefig(TEST_CASE_PATH+'/acc-v.png')
-                
-                np.save(TEST_CASE_PATH+'/acc', criterion._acc)
-                np.save(TEST_CASE_PATH+'/v', criterion._v)
-
-                controls = pd.DataFrame([[control.throttle, control.steer, control.brake, control.hand_brake, control.reverse, control.manual_gear_shift, control.gear] for control in criterion._control],
-                                        columns = ['throttle', 'steer', 'brake', 'hand_brake', 'reverse', 'manual_gear_shift', 'gear'])
-                controls.to_csv(TEST_CASE_PATH+'/control.csv', index=False)
+                plt.close(fig)
 
-                passed_waypoints = pd.DataFrame([[location.x, location.y, location.z] for location in criterion._passed_waypoints],
-                                                columns = ['x', 'y', 'z'])
-                passed_waypoints.to_csv(TEST_CASE_PATH+'/real_route.csv', index=False)
-
-                routes = pd.DataFrame([[waypoint.x, waypoint.y, waypoint.z] for waypoint in criterion._waypoints],
-                                        columns = ['x', 'y', 'z'])
-                routes.to_csv(TEST_CASE_PATH+'/ori_route.csv', index=False)
+                # one file per case, control.csv, real_route.csv and ori_route.csv are written on demand
+                # by python -m srunner.scenariomanager.scenarioatomics.telemetry TEST_CASE_PATH/telemetry.npz
+                criterion._telemetry.save(TEST_CASE_PATH+'/telemetry.npz')
+                if os.environ.get('TELEMETRY_CSV', 'False') == 'True':
+                    write_csv(TEST_CASE_PATH+'/telemetry.npz')
 
                 return tabulate(list_statistics, tablefmt='fancy_grid')+'\n'
         
@@ -130,7 +190,6 @@ class ResultOutputProvider(object):
         # Criteria part
         header = ['Criterion', 'Result', 'Value']
         list_statistics = [header]
-        results = []
 
         for criterion in self._data.scenario.get_criteria():
 
@@ -139,8 +198,6 @@ class ResultOutputProvider(object):
             name = criterion.name
 
             result = criterion.test_status
-            results.append(result)
-            results.append(str(actual_value))
             
             if result == "SUCCESS":
                 result = '\033[92m'+'SUCCESS'+'\033[0m'
@@ -172,20 +229,12 @@ class ResultOutputProvider(object):
 
         if self._data.scenario_duration_game < self._data.scenario.timeout:
             result = '\033[92m'+'SUCCESS'+'\033[0m'
-            results.append('SUCCESS')
         else:
             result = '\033[91m'+'FAILURE'+'\033[0m'
-            results.append('FAILURE')
 
         list_statistics.extend([[name, result, '']])
 
         output += tabulate(list_statistics, tablefmt='fancy_grid')
         output += "\n"
 
-        criterion_file = open(self._data.fitness_path.replace('fitness','criterion'), 'a')
-        line = ','.join(results)+'\n'
-        line = line.replace('SUCCESS','0').replace('FAILURE','1')
-        criterion_file.write(line)
-        criterion_file.close()
-
         return output
@@ -0,0 +1,62 @@
+import os
+import numpy as np
+import tqdm
+from PIL import Image
+
+from multiprocessing import Pool
+
+from TCP.packed import load_packed, load_image_shards, save_shard_meta, shard_path, SHARD_DIR, SHARD_SIZE
+
+
+def bake_shard(job):
+	"""
+	Decode the front camera frames of one shard into a fixed-shape uint8 array [n, H, W, 3].
+	"""
+	folder_path, root, paths, shard_id = job
+	out_path = shard_path(folder_path, shard_id)
+	shard = None
+	for i, path in enumerate(paths):
+		image = np.array(Image.open(root + path.decode()))
+		if shard is None:
+			shard = np.lib.format.open_memmap(out_path + ".tmp", mode='w+', dtype=np.uint8, shape=(len(paths),) + image.shape)
+		assert image.shape == shard.shape[1:], f'{path.decode()} has shape {image.shape}, expected {shard.shape[1:]}'
+		shard[i] = image
+	shard.flush()
+	image_shape = shard.shape[1:]
+	del shard
+	os.replace(out_path + ".tmp", out_path)
+	return image_shape
+
+
+def bake_town(folder_path, root, pool, shard_size=SHARD_SIZE):
+	front_img = load_packed(folder_path)['front_img']
+	if len(front_img) == 0 or load_image_shards(folder_path, front_img) is not None:
+		return 0
+	os.makedirs(os.path.join(folder_path, SHARD_DIR), exist_ok=True)
+
+	# only the current frame is used for training
+	paths = np.array(front_img[:, 0])
+	jobs = [(folder_path, root, paths[start:start+shard_size], shard_id)
+			for shard_id, start in enumerate(range(0, len(paths), shard_size))]
+	shapes = set(tqdm.tqdm(pool.imap_unordered(bake_shard, jobs), total=len(jobs), leave=False))
+	assert len(shapes) == 1, f'mixed image shapes {shapes} in {folder_path}'
+
+	save_shard_meta(folder_path, front_img, shapes.pop(), shard_size)
+	return len(paths)
+
+
+if __name__ == '__main__':
+	import argparse
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--data_path', type=str, default='tcp_carla_data', help='Root folder of the packed towns.')
+	parser.add_argument('--workers', type=int, default=16, help='Number of decoding processes.')
+	parser.add_argument('--shard_size', type=int, default=SHARD_SIZE, help='Frames per shard file.')
+	args = parser.parse_args()
+
+	towns = ["town01","town01_val","town01_addition","town02","town02_val","town03","town03_val","town03_addition", "town04","town04_val", "town04_addition", "town05", "town05_val", "town05_addition" ,"town06","town06_val", "town06_addition","town07", "town07_val", "town10", "town10_addition","town10_val"]
+	total = 0
+	with Pool(args.workers) as pool:
+		for town in tqdm.tqdm(towns):
+			total += bake_town(os.path.join(args.data_path, town), args.data_path, pool, args.shard_size)
+
+	print(total)
@@ -0,0 +1,90 @@
+import os
+import sys
+import math
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'leaderboard', 'leaderboard'))
+from srunner.scenariomanager.scenarioatomics.fitness_utils import bearings, footprints, obb_distances
+
+
+class Traffic(object):
+    """
+    Ego (row 0) and n vehicles around it, with the WorldState arrays used by the fitness kernels
+    """
+    def __init__(self, n, radius, rng):
+        self.locations = np.concatenate([np.zeros((1, 3)), rng.uniform(-radius, radius, (n, 3)) * [1, 1, 0]])
+        self.rotations = np.stack([rng.uniform(-1, 1, n + 1), rng.uniform(-180, 180, n + 1), rng.uniform(-1, 1, n + 1)], axis=1)
+        self.extents = np.stack([rng.uniform(1.8, 2.6, n + 1), rng.uniform(0.8, 1.1, n + 1), rng.uniform(0.7, 1.0, n + 1)], axis=1)
+        self.box_locations = np.stack([rng.uniform(-0.1, 0.1, n + 1), np.zeros(n + 1), self.extents[:, 2]], axis=1)
+
+
+class Location(object):
+    # the part of carla.Location used by InRouteTest.bounding_box_distance
+    def __init__(self, x, y, z):
+        self.x, self.y, self.z = x, y, z
+
+    def distance(self, other):
+        return math.sqrt((self.x - other.x)**2 + (self.y - other.y)**2 + (self.z - other.z)**2)
+
+
+def world_vertices(traffic, row):
+    # carla.BoundingBox.get_world_vertices
+    pitch, yaw, roll = np.radians(traffic.rotations[row])
+    cp, sp, cy, sy, cr, sr = math.cos(pitch), math.sin(pitch), math.cos(yaw), math.sin(yaw), math.cos(roll), math.sin(roll)
+    vertices = []
+    for dx in (-1, 1):
+        for dy in (-1, 1):
+            for dz in (-1, 1):
+                x, y, z = traffic.box_locations[row] + traffic.extents[row] * [dx, dy, dz]
+                vertices.append(Location(
+                    traffic.locations[row, 0] + x * cp * cy + y * (cy * sp * sr - sy * cr) + z * (-cy * sp * cr - sy * sr),
+                    traffic.locations[row, 1] + x * cp * sy + y * (sy * sp * sr + cy * cr) + z * (-sy * sp * cr + cy * sr),
+                    traffic.locations[row, 2] + x * sp - y * cp * sr + z * cp * cr))
+    return vertices
+
+
+def vertex_loop(traffic):
+    # the previous InRouteTest.bounding_box_distance, called once per vehicle
+    distances = []
+    for row in range(1, len(traffic.locations)):
+        bbox_1, bbox_2 = world_vertices(traffic, 0), world_vertices(traffic, row)
+        pairs = []
+        for location_1 in bbox_1:
+            location_1.z = 0
+            for location_2 in bbox_2:
+                location_2.z = 0
+                pairs.append(location_1.distance(location_2))
+        distances.append(min(pairs))
+    return np.array(distances)
+
+
+def obb_kernel(traffic):
+    rows = np.arange(1, len(traffic.locations))
+    return obb_distances(footprints(traffic, [0])[0], footprints(traffic, rows)), bearings(traffic, 0, rows)
+
+
+def timed(fn, traffic, repeat):
+    start = time.time()
+    for _ in range(repeat):
+        result = fn(traffic)
+    return (time.time() - start) / repeat, result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--vehicles', type=int, nargs='*', default=[10, 50, 100, 200])
+    parser.add_argument('--radius', type=float, default=30., help='vehicles are spawned in a square of this half size around the ego')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    # on flat ground the vertex distance is an upper bound of the box distance, pitch and roll move the vertices a little
+    print("vehicles | vertex loop ms/tick | obb kernel ms/tick | speedup | overlaps | mean(vertex - obb) m")
+    for n in args.vehicles:
+        traffic = Traffic(n, args.radius, np.random.RandomState(args.seed))
+        loop_time, loop = timed(vertex_loop, traffic, args.repeat)
+        kernel_time, (obb, _) = timed(obb_kernel, traffic, args.repeat)
+        print("{:8d} | {:19.3f} | {:18.3f} | {:7.1f} | {:8d} | {:.3f}".format(
+            n, loop_time * 1e3, kernel_time * 1e3, loop_time / kernel_time, int((obb == 0).sum()), (loop - obb).mean()))
@@ -0,0 +1,90 @@
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from sklearn.metrics import explained_variance_score
+from sklearn.model_selection import train_test_split
+
+from models.Kriging import Kriging
+from models.SparseKriging import SparseKriging
+
+
+SCENARIO_HEADER = ["cloudiness", "precipitation", "precipitation_deposits", "wind_intensity",
+                   "sun_azimuth_angle", "sun_altitude_angle", "fog_density", "wetness", "fog_falloff",
+                   "vehicle_infront", "vehicle_opposite", "vehicle_side", "start_offset", "end_offset"]
+TARGETS = ["RouteCompletionTest", "CollisionTest", "OutsideRouteLanesTest", "Timeout"]
+
+
+def criterion_targets(criterion):
+    """
+    Targets of the criterion table in [0, 1], as in fitness.get_fitness without the DVE refinement of CollisionTest
+    """
+    result = pd.DataFrame()
+    result['RouteCompletionTest'] = criterion["RouteCompletionTest_figure"]/100
+    result['CollisionTest'] = 1-criterion["CollisionTest"]
+    result['OutsideRouteLanesTest'] = 1-criterion["OutsideRouteLanesTest_figure"]/100
+    result['Timeout'] = 1-criterion["Timeout"]
+    return result[TARGETS].to_numpy(dtype=float)
+
+
+def evaluate(name, fit, X_train, y_train, X_test, y_test):
+    start = time.time()
+    predict = fit(X_train, y_train)
+    fit_time = time.time() - start
+    start = time.time()
+    y_pred = np.clip(predict(X_test), 0, 1)
+    predict_time = time.time() - start
+    scores = [explained_variance_score(y_test[:, i], y_pred[:, i]) for i in range(len(TARGETS))]
+    print("{:14s} | n={:6d} | fit {:8.2f}s | predict {:6.3f}s | EVS {}".format(
+        name, len(X_train), fit_time, predict_time, " ".join("{:6.3f}".format(s) for s in scores)))
+
+
+def fit_exact(X, y):
+    # one exact GP per target, like the pickled regression-Kriging-* models
+    models = [Kriging(data=X, label=y[:, i]) for i in range(y.shape[1])]
+    return lambda X_test: np.stack([model.predict(X_test) for model in models], axis=1)
+
+
+def fit_sparse(n_inducing):
+    def fit(X, y):
+        return SparseKriging(data=X, label=y, n_inducing=n_inducing).predict
+    return fit
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--criterion', type=str, default='full_data.csv', help='criterion table, one row per scenario')
+    parser.add_argument('--scenario', type=str, required=True, help='scenario.csv with the 14 scenario parameters of the same rows')
+    parser.add_argument('--n_inducing', type=int, default=256)
+    parser.add_argument('--sizes', type=int, nargs='*', default=[],
+                        help='additional training sizes for the timing, the training rows are resampled with jitter')
+    parser.add_argument('--exact_limit', type=int, default=4000, help='skip the exact GP above this many rows')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    criterion = pd.read_csv(args.criterion, index_col=0)
+    scenarios = pd.read_csv(args.scenario, names=SCENARIO_HEADER)
+    assert len(criterion) == len(scenarios), 'criterion and scenario tables have {} and {} rows'.format(len(criterion), len(scenarios))
+    X = scenarios.to_numpy(dtype=float)
+    y = criterion_targets(criterion)
+
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.33, random_state=args.seed)
+    print("EVS per target: " + " ".join(TARGETS))
+    for size in [len(X_train)] + args.sizes:
+        rng = np.random.RandomState(args.seed)
+        index = rng.choice(len(X_train), size, replace=size > len(X_train)) if size != len(X_train) else np.arange(size)
+        X_size = np.clip(X_train[index] + (size > len(X_train)) * rng.normal(0, 0.01, (size, X.shape[1])), 0, 1)
+        y_size = y_train[index]
+        if size <= args.exact_limit:
+            evaluate('exact', fit_exact, X_size, y_size, X_test, y_test)
+        evaluate('sparse m={}'.format(args.n_inducing), fit_sparse(args.n_inducing), X_size, y_size, X_test, y_test)
+
+    # incremental updates against a refit on the grown data
+    half = len(X_train) // 2
+    model = SparseKriging(data=X_train[:half], label=y_train[:half], n_inducing=args.n_inducing)
+    start = time.time()
+    model.update(X_train[half:], y_train[half:])
+    print("update of {} rows: {:.3f}s".format(len(X_train) - half, time.time() - start))
+    mean, std = model.predict(X_test, return_std=True)
+    coverage = (np.abs(np.clip(mean, 0, 1) - y_test) <= 2 * std).mean(axis=0)
+    print("2-std coverage per target: " + " ".join("{:.3f}".format(c) for c in coverage))
@@ -1,29 +1,51 @@
+import json
+import sqlite3
 import numpy as np
 import pandas as pd
 
-def get_fitness(dir):
-    criterion_header = ["RouteCompletionTest",   
-                    "RouteCompletionTest_figure",
-                    "OutsideRouteLanesTest", 
-                    "OutsideRouteLanesTest_figure",
-                    "CollisionTest",         
-                    "CollisionTest_figure",
-                    "RunningRedLightTest",   
-                    "RunningRedLightTest_figure",
-                    "RunningStopTest",       
-                    "RunningStopTest_figure",
-                    "InRouteTest", 
-                    "InRouteTest_figure",          
-                    "AgentBlockedTest",
-                    "AgentBlockedTest_figure",      
-                    "Timeout"]
-
-    fitness_header = ["DOL","DVE","DPD","DSM","DFD"]
+criterion_header = ["RouteCompletionTest",
+                "RouteCompletionTest_figure",
+                "OutsideRouteLanesTest",
+                "OutsideRouteLanesTest_figure",
+                "CollisionTest",
+                "CollisionTest_figure",
+                "RunningRedLightTest",
+                "RunningRedLightTest_figure",
+                "RunningStopTest",
+                "RunningStopTest_figure",
+                "InRouteTest",
+                "InRouteTest_figure",
+                "AgentBlockedTest",
+                "AgentBlockedTest_figure",
+                "Timeout"]
+
+fitness_header = ["DOL","DVE","DPD","DSM","DFD"]
+
+scenario_header = ["cloudiness",
+                   "precipitation",
+                   "precipitation_deposits",
+                   "wind_intensity",
+                   "sun_azimuth_angle",
+                   "sun_altitude_angle",
+                   "fog_density",
+                   "wetness",
+                   "fog_falloff",
+                   "vehicle_infront",
+                   "vehicle_opposite",
+                   "vehicle_side",
+                   "start_offset",
+                   "end_offset"]
+
 
+def get_fitness(dir):
     criterion = pd.read_csv(dir+'criterion.csv',names=criterion_header)
     fitness = pd.read_csv(dir+'fitness.csv',names=fitness_header)
+    return fitness_table(criterion, fitness)
+
+
+def fitness_table(criterion, fitness):
     result = pd.DataFrame()
-    
+
     result['RouteCompletionTest']   =   criterion["RouteCompletionTest_figure"]/100
     result['OutsideRouteLanesTest'] = 1-criterion["OutsideRouteLanesTest_figure"]/100
     result['CollisionTest']         =   criterion["CollisionTest"]
@@ -32,7 +54,7 @@ def get_fitness(dir):
     result['InRouteTest']           = 1-criterion["InRouteTest"]
     result['AgentBlockedTest']      = 1-criterion["AgentBlockedTest"]
     result['Timeout']               = 1-criterion["Timeout"]
-    
+
     DVE = fitness['DVE'].copy()/2
     DVE[fitness['DVE'] >= 2] = 1
 
@@ -41,5 +63,36 @@ def get_fitness(dir):
     collisionTest[result['CollisionTest']==1] = 0
 
     result.loc[:,'CollisionTest'] = collisionTest
-    
-    return result
\ No newline at end of file
+
+    return result
+
+
+def load_store(db_path, agent=None, route=None, region=None):
+    """
+    Reads the cases of the result store written by leaderboard/SBT/store.py, optionally filtered by
+    agent, route and region. Returns the scenario, criterion and fitness tables with the csv headers,
+    cases without InRouteTest scores are left out.
+    """
+    query = 'SELECT agent, route, region, scenario, criterion, fitness FROM results WHERE fitness IS NOT NULL'
+    params = []
+    for column, value in [('agent', agent), ('route', route), ('region', region)]:
+        if value is not None:
+            query += ' AND {}=?'.format(column)
+            params.append(value)
+    with sqlite3.connect(db_path) as conn:
+        rows = conn.execute(query + ' ORDER BY created', params).fetchall()
+
+    scenarios = pd.DataFrame([json.loads(row[3]) for row in rows], columns=scenario_header)
+    for i, column in enumerate(['agent', 'route', 'region']):
+        scenarios[column] = [row[i] for row in rows]
+    criterion = pd.DataFrame([[float(v) for v in row[4].split(',')] for row in rows], columns=criterion_header)
+    fitness = pd.DataFrame([[float(v) for v in row[5].split(',')] for row in rows], columns=fitness_header)
+    return scenarios, criterion, fitness
+
+
+def get_fitness_from_store(db_path, agent=None, route=None, region=None):
+    """
+    Scenario vectors and get_fitness table of the stored cases
+    """
+    scenarios, criterion, fitness = load_store(db_path, agent, route, region)
+    return scenarios, fitness_table(criterion, fitness)
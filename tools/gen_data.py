@@ -1,218 +1,201 @@
-from distutils.log import error
 import os
 import json
-from typing import DefaultDict
 import numpy as np
 import tqdm
 
 from multiprocessing import Pool
 
+from TCP.packed import save_packed, convert_legacy, to_columns, packed_version, load_packed, FIELD_DTYPES, FORMAT_VERSION
+
 
 INPUT_FRAMES = 1
 FUTURE_FRAMES = 4
 
+ROUTE_CACHE_DIR = "packed_routes"
+MANIFEST_FILE = "manifest.json"
+ROUTE_CACHE_VERSION = 1 # bump when the raw columns read from a route change
 
-def gen_single_route(route_folder):
-
-	length = len(os.listdir(os.path.join(route_folder, 'measurements')))
-	if length < INPUT_FRAMES + FUTURE_FRAMES:
-		return
-
-	seq_future_x = []
-	seq_future_y = []
-	seq_future_theta = []
-	seq_future_feature = []
-	seq_future_action = []
-	seq_future_action_mu = []
-	seq_future_action_sigma = []
-	seq_future_only_ap_brake = []
-
-
-	seq_input_x = []
-	seq_input_y = []
-	seq_input_theta = []
-
-	seq_front_img = []
-	seq_feature = []
-	seq_value = []
-	seq_speed = []
-
-	seq_action = []
-	seq_action_mu = []
-	seq_action_sigma = []
-
-	seq_x_target = []
-	seq_y_target = []
-	seq_target_command = []
-
-	seq_only_ap_brake = []
-
-	full_seq_x = []
-	full_seq_y = []
-	full_seq_theta = []
-
-	full_seq_feature = []
-	full_seq_action = []
-	full_seq_action_mu = []
-	full_seq_action_sigma = []
-	full_seq_only_ap_brake = []
 
+def read_route(route_folder, length):
+	"""
+	Reads every measurement and roach supervision file of a route exactly once.
+	"""
+	measurements = []
+	supervision = []
 	for i in range(length):
 		with open(os.path.join(route_folder, "measurements", f"{str(i).zfill(4)}.json"), "r") as read_file:
-			measurement = json.load(read_file)
-			full_seq_x.append(measurement['y'])
-			full_seq_y.append(measurement['x'])
-			full_seq_theta.append(measurement['theta'])
+			measurements.append(json.load(read_file))
+		supervision.append(np.load(os.path.join(route_folder, "supervision", f"{str(i).zfill(4)}.npy"), allow_pickle=True).item())
+	return measurements, supervision
 
 
-		roach_supervision_data = np.load(os.path.join(route_folder, "supervision", f"{str(i).zfill(4)}.npy"), allow_pickle=True).item()
-		full_seq_feature.append(roach_supervision_data['features'])
-		full_seq_action.append(roach_supervision_data['action'])
-		full_seq_action_mu.append(roach_supervision_data['action_mu'])
-		full_seq_action_sigma.append(roach_supervision_data['action_sigma'])
-		full_seq_only_ap_brake.append(roach_supervision_data['only_ap_brake'])
+def gen_single_route(route_folder, data_path):
 
-	for i in range(INPUT_FRAMES-1, length-FUTURE_FRAMES):
-
-		with open(os.path.join(route_folder, "measurements", f"{str(i).zfill(4)}.json"), "r") as read_file:
-			measurement = json.load(read_file)
-
-		seq_input_x.append(full_seq_x[i-(INPUT_FRAMES-1):i+1])
-		seq_input_y.append(full_seq_y[i-(INPUT_FRAMES-1):i+1])
-		seq_input_theta.append(full_seq_theta[i-(INPUT_FRAMES-1):i+1])
-
-		seq_future_x.append(full_seq_x[i+1:i+FUTURE_FRAMES+1])
-		seq_future_y.append(full_seq_y[i+1:i+FUTURE_FRAMES+1])
-		seq_future_theta.append(full_seq_theta[i+1:i+FUTURE_FRAMES+1])
-
-		seq_future_feature.append(full_seq_feature[i+1:i+FUTURE_FRAMES+1])
-		seq_future_action.append(full_seq_action[i+1:i+FUTURE_FRAMES+1])
-		seq_future_action_mu.append(full_seq_action_mu[i+1:i+FUTURE_FRAMES+1])
-		seq_future_action_sigma.append(full_seq_action_sigma[i+1:i+FUTURE_FRAMES+1])
-		seq_future_only_ap_brake.append(full_seq_only_ap_brake[i+1:i+FUTURE_FRAMES+1])
-
-		roach_supervision_data = np.load(os.path.join(route_folder, "supervision", f"{str(i).zfill(4)}.npy"), allow_pickle=True).item()
-		seq_feature.append(roach_supervision_data["features"])
-		seq_value.append(roach_supervision_data["value"])
-		
-		front_img_list = [route_folder.replace(data_path,'')+"/rgb/"f"{str(i-_).zfill(4)}.png" for _ in range(INPUT_FRAMES-1, -1, -1)]
-		seq_front_img.append(front_img_list)
-
-		seq_speed.append(measurement["speed"])
-
-		seq_action.append(roach_supervision_data["action"])
-		seq_action_mu.append(roach_supervision_data["action_mu"])
-		seq_action_sigma.append(roach_supervision_data["action_sigma"])
-
-		seq_x_target.append(measurement["y_target"])
-		seq_y_target.append(measurement["x_target"])
-		seq_target_command.append(measurement["target_command"])
+	length = len(os.listdir(os.path.join(route_folder, 'measurements')))
+	if length < INPUT_FRAMES + FUTURE_FRAMES:
+		return
 
-		seq_only_ap_brake.append(roach_supervision_data["only_ap_brake"])
+	measurements, supervision = read_route(route_folder, length)
 
-	return seq_future_x, seq_future_y, seq_future_theta, seq_future_feature, seq_future_action, seq_future_action_mu, seq_future_action_sigma, seq_future_only_ap_brake, seq_input_x, seq_input_y, seq_input_theta, seq_front_img, seq_feature, seq_value, seq_speed, seq_action, seq_action_mu, seq_action_sigma, seq_x_target, seq_y_target, seq_target_command, seq_only_ap_brake
+	full_seq_x = [measurement['y'] for measurement in measurements]
+	full_seq_y = [measurement['x'] for measurement in measurements]
+	full_seq_theta = [measurement['theta'] for measurement in measurements]
 
-def gen_sub_folder(folder_path):
-	route_list = [folder for folder in os.listdir(folder_path) if os.path.isdir(os.path.join(folder_path, folder))]
-	route_list = sorted(route_list)
+	full_seq_feature = [roach_supervision_data['features'] for roach_supervision_data in supervision]
+	full_seq_action = [roach_supervision_data['action'] for roach_supervision_data in supervision]
+	full_seq_action_mu = [roach_supervision_data['action_mu'] for roach_supervision_data in supervision]
+	full_seq_action_sigma = [roach_supervision_data['action_sigma'] for roach_supervision_data in supervision]
+	full_seq_only_ap_brake = [roach_supervision_data['only_ap_brake'] for roach_supervision_data in supervision]
 
-	total_future_x = []
-	total_future_y = []
-	total_future_theta = []
+	seq = {name: [] for name in FIELD_DTYPES}
+	for i in range(INPUT_FRAMES-1, length-FUTURE_FRAMES):
+		measurement = measurements[i]
+		roach_supervision_data = supervision[i]
 
-	total_future_feature = []
-	total_future_action = []
-	total_future_action_mu = []
-	total_future_action_sigma = []
-	total_future_only_ap_brake = []
+		seq['input_x'].append(full_seq_x[i-(INPUT_FRAMES-1):i+1])
+		seq['input_y'].append(full_seq_y[i-(INPUT_FRAMES-1):i+1])
+		seq['input_theta'].append(full_seq_theta[i-(INPUT_FRAMES-1):i+1])
 
-	total_input_x = []
-	total_input_y = []
-	total_input_theta = []
+		seq['future_x'].append(full_seq_x[i+1:i+FUTURE_FRAMES+1])
+		seq['future_y'].append(full_seq_y[i+1:i+FUTURE_FRAMES+1])
+		seq['future_theta'].append(full_seq_theta[i+1:i+FUTURE_FRAMES+1])
 
-	total_front_img = []
-	total_feature = []
-	total_value = []
-	total_speed = []
+		seq['future_feature'].append(full_seq_feature[i+1:i+FUTURE_FRAMES+1])
+		seq['future_action'].append(full_seq_action[i+1:i+FUTURE_FRAMES+1])
+		seq['future_action_mu'].append(full_seq_action_mu[i+1:i+FUTURE_FRAMES+1])
+		seq['future_action_sigma'].append(full_seq_action_sigma[i+1:i+FUTURE_FRAMES+1])
+		seq['future_only_ap_brake'].append(full_seq_only_ap_brake[i+1:i+FUTURE_FRAMES+1])
 
-	total_action = []
-	total_action_mu = []
-	total_action_sigma = []
+		seq['feature'].append(roach_supervision_data["features"])
+		seq['value'].append(roach_supervision_data["value"])
 
-	total_x_target = []
-	total_y_target = []
-	total_target_command = []
+		front_img_list = [route_folder.replace(data_path,'')+"/rgb/"f"{str(i-_).zfill(4)}.png" for _ in range(INPUT_FRAMES-1, -1, -1)]
+		seq['front_img'].append(front_img_list)
+
+		seq['speed'].append(measurement["speed"])
+
+		seq['action'].append(roach_supervision_data["action"])
+		seq['action_mu'].append(roach_supervision_data["action_mu"])
+		seq['action_sigma'].append(roach_supervision_data["action_sigma"])
+
+		seq['x_target'].append(measurement["y_target"])
+		seq['y_target'].append(measurement["x_target"])
+		seq['target_command'].append(measurement["target_command"])
+
+		seq['only_ap_brake'].append(roach_supervision_data["only_ap_brake"])
+
+	return seq
+
+
+def route_signature(route_folder):
+	"""
+	Frame count and latest modification time of a route, used to detect routes that need repacking.
+	Adding or removing frames (data collection, tools/filter_data.py) updates the folder mtimes.
+	"""
+	mtime = 0.
+	for sub_folder in ["measurements", "supervision", "rgb"]:
+		if os.path.isdir(os.path.join(route_folder, sub_folder)):
+			mtime = max(mtime, os.path.getmtime(os.path.join(route_folder, sub_folder)))
+	return {'frames': len(os.listdir(os.path.join(route_folder, 'measurements'))), 'mtime': mtime}
+
+
+def pack_route(job):
+	"""
+	Packs one route into its cache file, runs in a worker process.
+	"""
+	route, route_folder, cache_path, data_path = job
+	signature = route_signature(route_folder)
+	seq = gen_single_route(route_folder, data_path)
+	signature['samples'] = 0 if seq is None else len(seq['front_img'])
+	if seq is not None:
+		with open(cache_path + ".tmp", "wb") as f:
+			np.savez(f, **to_columns(seq))
+		os.replace(cache_path + ".tmp", cache_path)
+	return route, signature
+
+
+def load_manifest(folder_path):
+	manifest_path = os.path.join(folder_path, ROUTE_CACHE_DIR, MANIFEST_FILE)
+	if os.path.isfile(manifest_path):
+		with open(manifest_path, "r") as f:
+			manifest = json.load(f)
+		if manifest.get('version') == ROUTE_CACHE_VERSION:
+			return manifest
+	return {'version': ROUTE_CACHE_VERSION, 'routes': {}}
+
+
+def save_manifest(folder_path, manifest):
+	manifest_path = os.path.join(folder_path, ROUTE_CACHE_DIR, MANIFEST_FILE)
+	with open(manifest_path + ".tmp", "w") as f:
+		json.dump(manifest, f, indent=1)
+	os.replace(manifest_path + ".tmp", manifest_path)
+
+
+def gen_sub_folder(folder_path, data_path, pool, force=False):
+	"""
+	Packs the routes of a town that changed since the last run in parallel, then merges the
+	per-route caches into the town's packed data.
+	"""
+	# packed_data/, image_shards/ and the route cache live next to the routes
+	route_list = [folder for folder in os.listdir(folder_path) if os.path.isdir(os.path.join(folder_path, folder, 'measurements'))]
+	route_list = sorted(route_list)
 
-	total_only_ap_brake = []
+	cache_dir = os.path.join(folder_path, ROUTE_CACHE_DIR)
+	os.makedirs(cache_dir, exist_ok=True)
+	manifest = load_manifest(folder_path)
+	cache_path = lambda route: os.path.join(cache_dir, route + ".npz")
 
+	stale = []
 	for route in route_list:
-		seq_data = gen_single_route(os.path.join(folder_path, route))
-		if not seq_data:
-			continue
-		seq_future_x, seq_future_y, seq_future_theta, seq_future_feature, seq_future_action, seq_future_action_mu, seq_future_action_sigma, seq_future_only_ap_brake, seq_input_x, seq_input_y, seq_input_theta, seq_front_img, seq_feature, seq_value, seq_speed, seq_action, seq_action_mu, seq_action_sigma, seq_x_target, seq_y_target, seq_target_command, seq_only_ap_brake = seq_data
-		total_future_x.extend(seq_future_x)
-		total_future_y.extend(seq_future_y)
-		total_future_theta.extend(seq_future_theta)
-		total_future_feature.extend(seq_future_feature)
-		total_future_action.extend(seq_future_action)
-		total_future_action_mu.extend(seq_future_action_mu)
-		total_future_action_sigma.extend(seq_future_action_sigma)
-		total_future_only_ap_brake.extend(seq_future_only_ap_brake)
-		total_input_x.extend(seq_input_x)
-		total_input_y.extend(seq_input_y)
-		total_input_theta.extend(seq_input_theta)
-		total_front_img.extend(seq_front_img)
-		total_feature.extend(seq_feature)
-		total_value.extend(seq_value)
-		total_speed.extend(seq_speed)
-		total_action.extend(seq_action)
-		total_action_mu.extend(seq_action_mu)
-		total_action_sigma.extend(seq_action_sigma)
-		total_x_target.extend(seq_x_target)
-		total_y_target.extend(seq_y_target)
-		total_target_command.extend(seq_target_command)
-		total_only_ap_brake.extend(seq_only_ap_brake)
-
-	data_dict = {}
-	data_dict['future_x'] = total_future_x
-	data_dict['future_y'] = total_future_y
-	data_dict['future_theta'] = total_future_theta
-	data_dict['future_feature'] = total_future_feature
-	data_dict['future_action'] = total_future_action
-	data_dict['future_action_mu'] = total_future_action_mu
-	data_dict['future_action_sigma'] = total_future_action_sigma
-	data_dict['future_only_ap_brake'] = total_future_only_ap_brake
-	data_dict['input_x'] = total_input_x
-	data_dict['input_y'] = total_input_y
-	data_dict['input_theta'] = total_input_theta
-	data_dict['front_img'] = total_front_img
-	data_dict['feature'] = total_feature
-	data_dict['value'] = total_value
-	data_dict['speed'] = total_speed
-	data_dict['action'] = total_action
-	data_dict['action_mu'] = total_action_mu
-	data_dict['action_sigma'] = total_action_sigma
-	data_dict['x_target'] = total_x_target
-	data_dict['y_target'] = total_y_target
-	data_dict['target_command'] = total_target_command
-	data_dict['only_ap_brake'] = total_only_ap_brake
-
-	file_path = os.path.join(folder_path, "packed_data")
-	np.save(file_path, data_dict)
-	return len(total_future_x)
+		entry = manifest['routes'].get(route)
+		signature = route_signature(os.path.join(folder_path, route))
+		if force or entry is None or entry['frames'] != signature['frames'] or entry['mtime'] != signature['mtime'] \
+				or (entry['samples'] > 0 and not os.path.isfile(cache_path(route))):
+			stale.append(route)
+
+	removed = set(manifest['routes']) - set(route_list)
+	# an outdated packed_data/ is rebuilt from the route caches without reading the frames again
+	if not stale and not removed and packed_version(folder_path) == FORMAT_VERSION:
+		return len(load_packed(folder_path)['front_img'])
+
+	jobs = [(route, os.path.join(folder_path, route), cache_path(route), data_path) for route in stale]
+	for route, signature in tqdm.tqdm(pool.imap_unordered(pack_route, jobs), total=len(jobs), leave=False):
+		manifest['routes'][route] = signature
+	for route in removed:
+		del manifest['routes'][route]
+		if os.path.isfile(cache_path(route)):
+			os.remove(cache_path(route))
+
+	parts = [np.load(cache_path(route)) for route in route_list if manifest['routes'][route]['samples'] > 0]
+	if parts:
+		data_dict = {name: np.concatenate([part[name] for part in parts]) for name in FIELD_DTYPES}
+	else:
+		data_dict = {name: [] for name in FIELD_DTYPES}
+	number = save_packed(folder_path, data_dict)
+	# only recorded once the merged data is written, an interrupted run repacks the same routes
+	save_manifest(folder_path, manifest)
+	return number
 
 
 if __name__ == '__main__':
-	global data_path
-	data_path = "tcp_carla_data"
+	import argparse
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--data_path', type=str, default='tcp_carla_data', help='Root folder of the collected towns.')
+	parser.add_argument('--workers', type=int, default=16, help='Number of processes packing routes.')
+	parser.add_argument('--force', action='store_true', help='Repack every route instead of only the changed ones.')
+	parser.add_argument('--convert_legacy', action='store_true', help='Only convert existing packed_data.npy files to the columnar format.')
+	args = parser.parse_args()
+
+	data_path = args.data_path
 	towns = ["town01","town01_val","town01_addition","town02","town02_val","town03","town03_val","town03_addition", "town04","town04_val", "town04_addition", "town05", "town05_val", "town05_addition" ,"town06","town06_val", "town06_addition","town07", "town07_val", "town10", "town10_addition","town10_val"]
 	pattern = "{}" # town type
-	import tqdm
 	total = 0
-	for town in tqdm.tqdm(towns):
-		number = gen_sub_folder(os.path.join(data_path, pattern.format(town)))
-		total += number
+	with Pool(args.workers) as pool:
+		for town in tqdm.tqdm(towns):
+			if args.convert_legacy:
+				number = convert_legacy(os.path.join(data_path, pattern.format(town)))
+			else:
+				number = gen_sub_folder(os.path.join(data_path, pattern.format(town)), data_path, pool, args.force)
+			total += number
 
 	print(total)
-
-	
\ No newline at end of file
@@ -2,40 +2,123 @@
 """
 """
 
+from itertools import combinations_with_replacement
+
 import numpy
 import numpy as np
-import pandas as pd
+from scipy import linalg
 from sklearn import preprocessing
 
 
-class Polynomial_Regression:
+def monomials(n_features, degree):
+    """
+    Exponent index tuples of every monomial up to degree, ordered by degree so the terms of a lower
+    degree are a prefix of the list. () is the intercept.
+    """
+    terms = []
+    for d in range(degree + 1):
+        terms.extend(combinations_with_replacement(range(n_features), d))
+    return terms
+
+
+def design_matrix(X, terms):
+    """
+    Polynomial design matrix, every term is the product of an earlier column and one feature
+    """
+    index = {}
+    H = np.empty((len(X), len(terms)))
+    for i, term in enumerate(terms):
+        index[term] = i
+        H[:, i] = 1. if not term else H[:, index[term[:-1]]] * X[:, term[-1]]
+    return H
+
+
+ALPHAS = (1e-6, 1e-4, 1e-2, 1e-1, 1., 10.)
+
 
-    def __init__(self, degree=-1, data=None, label=None):
-        self.create_model_from_cluster(data, label, degree)
+class Polynomial_Regression:
+    """
+    Ridge polynomial regression for one or several targets. With degree=-1 the degree is picked from
+    degrees and the ridge strength from alphas for each target by k-fold cross-validation. The folds
+    only keep their Gram matrices, so every (degree, alpha, target) is scored without refitting on rows.
+    A fixed degree is an ordinary least-squares fit unless alpha or alphas is given.
+    """
 
-    def create_model_from_cluster(self, data, label, deg):
-        # X = data
-        # y = label
+    def __init__(self, degree=-1, data=None, label=None, degrees=(1, 2, 3), alphas=None, alpha=None,
+                 folds=5, chunk_size=8192, random_state=0):
+        self.degrees = tuple(degrees) if degree < 0 else (degree,)
+        if alpha is not None:
+            alphas = (alpha,)
+        elif alphas is None:
+            alphas = ALPHAS if degree < 0 else (0.,)
+        self.alphas = tuple(alphas)
+        self.folds = folds
+        self.chunk_size = chunk_size
+        self.random_state = random_state
+        self.create_model_from_cluster(data, label)
 
+    def create_model_from_cluster(self, data, label):
         self.scaler = preprocessing.StandardScaler()
 
-        X = np.array(data) # features from 0 to 15th index
-        y = np.array(label) # value at 16th index
-        y[y < 0] = 0
-        y[y > 1] = 1
+        X = np.array(data, dtype=float)
+        y = np.array(label, dtype=float)
+        self.single_target = y.ndim == 1
+        y = np.clip(y.reshape(len(y), -1), 0, 1)
 
         X = self.scaler.fit_transform(X)
-        from sklearn.linear_model import LinearRegression
-        from sklearn.preprocessing import PolynomialFeatures
-        self.poly_reg = PolynomialFeatures(degree=deg)
-        X_poly = self.poly_reg.fit_transform(X)
-        self.pol_reg = LinearRegression()
-        self.pol_reg.fit(X_poly, y)
+        self.terms = monomials(X.shape[1], max(self.degrees))
+        sizes = [len(monomials(X.shape[1], degree)) for degree in self.degrees]
 
-    def predict(self, value):
-        value = numpy.array(value)
-        B = self.scaler.transform(value)
-        y_pred = self.pol_reg.predict(self.poly_reg.fit_transform(B))
-        return y_pred
+        # per fold statistics H^T H, H^T y and y^T y of the largest design matrix, built in chunks
+        folds = np.random.RandomState(self.random_state).randint(self.folds, size=len(X))
+        G = np.zeros((self.folds, len(self.terms), len(self.terms)))
+        b = np.zeros((self.folds, len(self.terms), y.shape[1]))
+        yy = np.zeros((self.folds, y.shape[1]))
+        for start in range(0, len(X), self.chunk_size):
+            H = design_matrix(X[start:start + self.chunk_size], self.terms)
+            Y, fold = y[start:start + self.chunk_size], folds[start:start + self.chunk_size]
+            for k in range(self.folds):
+                Hk, Yk = H[fold == k], Y[fold == k]
+                G[k] += Hk.T.dot(Hk)
+                b[k] += Hk.T.dot(Yk)
+                yy[k] += (Yk**2).sum(0)
+
+        # cross-validated squared error of every (degree, alpha) for all targets at once
+        errors = np.zeros((len(self.degrees), len(self.alphas), y.shape[1]))
+        G_total, b_total = G.sum(0), b.sum(0)
+        for i, size in enumerate(sizes):
+            for j, alpha in enumerate(self.alphas):
+                for k in range(self.folds):
+                    G_train = G_total[:size, :size] - G[k, :size, :size]
+                    b_train = b_total[:size] - b[k, :size]
+                    w = self._solve(G_train, b_train, alpha)
+                    errors[i, j] += yy[k] - 2 * (w * b[k, :size]).sum(0) + (w * G[k, :size, :size].dot(w)).sum(0)
 
+        self.degree, self.alpha, self.coef = [], [], []
+        for t in range(y.shape[1]):
+            i, j = np.unravel_index(np.argmin(errors[:, :, t]), errors.shape[:2])
+            self.degree.append(self.degrees[i])
+            self.alpha.append(self.alphas[j])
+            self.coef.append(self._solve(G_total[:sizes[i], :sizes[i]], b_total[:sizes[i], t], self.alphas[j]))
+        self.cv_mse = errors / len(X)
 
+    def _solve(self, G, b, alpha):
+        if alpha == 0:
+            # least squares, the minimum norm solution if the design matrix is rank deficient
+            return linalg.lstsq(G, b)[0]
+        # the intercept is not penalized
+        penalty = np.full(len(G), alpha * np.trace(G) / len(G))
+        penalty[0] = 0.
+        return linalg.solve(G + np.diag(penalty) + 1e-10 * np.eye(len(G)), b, assume_a='pos')
+
+    def predict(self, value):
+        value = numpy.array(value, dtype=float)
+        B = self.scaler.transform(np.atleast_2d(value))
+        if 'terms' not in self.__dict__:
+            # models pickled before the rewrite keep their sklearn PolynomialFeatures + LinearRegression pair
+            return self.pol_reg.predict(self.poly_reg.transform(B))
+        H = design_matrix(B, self.terms[:max(len(coef) for coef in self.coef)])
+        y_pred = np.stack([H[:, :len(coef)].dot(coef) for coef in self.coef], axis=1)
+        if self.single_target:
+            return y_pred[:, 0]
+        return y_pred
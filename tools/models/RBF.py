@@ -4,143 +4,60 @@ MIT Licence
 """
 
 import numpy as np
-from keras import backend as K
-from keras.engine.topology import Layer
-from keras.initializers import RandomUniform, Initializer, Constant
-from keras.layers import Activation
-from keras.layers.core import Dense
-from keras.models import Sequential
+from sklearn.cluster import KMeans
 from sklearn.preprocessing import StandardScaler
 
 
-class InitCentersRandom(Initializer):
-    """ Initializer for initialization of centers of RBF network
-        as random samples from the given data set.
-    # Arguments
-        X: matrix, dataset to choose the centers from (random rows
-          are taken as centers)
-    """
-
-    def __init__(self, X):
-        self.X = X
-
-    def __call__(self, shape, dtype=None):
-        assert shape[1] == self.X.shape[1]
-        idx = np.random.randint(self.X.shape[0], size=shape[0])
-        return self.X[idx, :]
+def rbf_features(X, centers, betas):
+    """ Gaussian RBF units exp(-beta * |x - c|^2) for every row of X, shape [len(X), len(centers)] """
+    sq = (X**2).sum(1)[:, None] + (centers**2).sum(1)[None, :] - 2 * X.dot(centers.T)
+    return np.exp(-betas * np.maximum(sq, 0))
 
 
-class RBFLayer(Layer):
-    """ Layer of Gaussian RBF units.
-    # Example
-    ```python
-        model = Sequential()
-        model.add(RBFLayer(10,
-                           initializer=InitCentersRandom(X),
-                           betas=1.0,
-                           input_shape=(1,)))
-        model.add(Dense(1))
-    ```
-    # Arguments
-        output_dim: number of hidden units (i.e. number of outputs of the
-                    layer)
-        initializer: instance of initiliazer to initialize centers
-        betas: float, initial value for betas
+class Model:
+    """
+    RBF network surrogate, the centers are k-means centers of the standardized scenarios and the
+    linear output layer is solved in closed form. cluster holds the scenario parameters in all but
+    the last column and the fitness in the last column.
     """
 
-    def __init__(self, output_dim, initializer=None, betas=1.0, **kwargs):
-        self.output_dim = output_dim
-        self.init_betas = betas
-        if not initializer:
-            self.initializer = RandomUniform(0.0, 1.0)
-        else:
-            self.initializer = initializer
-        super(RBFLayer, self).__init__(**kwargs)
-
-
-
-    def build(self, input_shape):
-
-        self.centers = self.add_weight(name='centers',
-                                       shape=(self.output_dim, input_shape[1]),
-                                       initializer=self.initializer,
-                                       trainable=True)
-        self.betas = self.add_weight(name='betas',
-                                     shape=(self.output_dim,),
-                                     initializer=Constant(
-                                         value=self.init_betas),
-                                     # initializer='ones',
-                                     trainable=True)
-
-        super(RBFLayer, self).build(input_shape)
-
-    def call(self, x):
-        C = K.expand_dims(self.centers)
-        H = K.transpose(C-K.transpose(x))
-        return K.exp(-self.betas * K.sum(H**2, axis=1))
-
-    def gaussian(self, x, mu, sigma):
-        return exp(- metrics(mu, x) ** 2 / (2 * sigma ** 2))
-
-    def compute_output_shape(self, input_shape):
-        return (input_shape[0], self.output_dim)
-
-    def get_config(self):
-        # have to define get_config to be able to use model_from_json
-        config = {
-            'output_dim': self.output_dim
-        }
-        base_config = super(RBFLayer, self).get_config()
-        return dict(list(base_config.items()) + list(config.items()))
+    def __init__(self, no_of_neurons, cluster, ridge=1e-6, random_state=0):
+        self.ridge = ridge
+        self.random_state = random_state
+        self.train(no_of_neurons, np.array(cluster, dtype=float))
 
-class Model:
-    ss = StandardScaler()
-
-    def __init__(self,no_of_neurons,cluster):
-        
-        self.train(no_of_neurons,np.array(cluster))
-    def train(self,no_of_neurons,cluster):
-        # dataset = pd.read_csv(clean_file_name,header=None)
-        # for x in cluster:
-        #     print(x)
-        X = cluster[:, 0:16]
-        y = cluster[:, 16:17]
-        y[y < 0] = 0
-        y[y > 1] = 1
+    def train(self, no_of_neurons, cluster):
+        X = cluster[:, :-1]
+        y = np.clip(cluster[:, -1], 0, 1)
 
+        self.ss = StandardScaler()
         X = self.ss.fit_transform(X)
-        self.model = Sequential()
-        rbflayer = RBFLayer(no_of_neurons,
-                                initializer=InitCentersRandom(X),
-                                betas=3.0,
-                                input_shape=(16,))
-        self.model.add(rbflayer)
-        self.model.add(Dense(1))
-        self.model.add(Activation('linear'))
-        self.model.compile(loss='mean_absolute_error',
-                          optimizer = 'adam')
-        history = self.model.fit(X, y, epochs=1000, batch_size=8,verbose=0)
-
-    def test(self, cluster):
-        mae = 0
-        for i in range(len(cluster)):
-            y_act = cluster[i][16]
-            Y_pred = self.predict(cluster[i][:16])
-            if y_act > 1:
-                y_act =1
-            if y_act < 0:
-                y_act =0
-            mae = mae + abs(y_act - Y_pred)
-        self.mae = mae / len(cluster)
+        no_of_neurons = min(no_of_neurons, len(X))
+        self.centers = KMeans(n_clusters=no_of_neurons, n_init=1, random_state=self.random_state).fit(X).cluster_centers_
 
-    def predict(self,val):
-        value = np.array([val])
-        B = self.ss.transform(value)
-        y_pred = self.model.predict([B])
+        # width of each unit from the distance to its nearest other center
+        sq = (self.centers**2).sum(1)[:, None] + (self.centers**2).sum(1)[None, :] - 2 * self.centers.dot(self.centers.T)
+        np.fill_diagonal(sq, np.inf)
+        nearest = np.maximum(sq.min(1), 1e-12) if no_of_neurons > 1 else np.ones(1)
+        self.betas = 1. / (2 * nearest)
 
-        if y_pred[0][0] > 1:
-            return 1
-        if y_pred[0][0] < 0:
-            return 0
-        return y_pred[0][0]
+        H = np.hstack([rbf_features(X, self.centers, self.betas), np.ones((len(X), 1))])
+        A = H.T.dot(H) + self.ridge * len(X) * np.eye(H.shape[1])
+        self.weights = np.linalg.solve(A, H.T.dot(y))
 
+    def test(self, cluster):
+        cluster = np.array(cluster, dtype=float)
+        y_act = np.clip(cluster[:, -1], 0, 1)
+        self.mae = np.abs(y_act - self.predict(cluster[:, :-1])).mean()
+
+    def predict(self, val):
+        """
+        Fitness in [0, 1] of one scenario, or an array for a batch of scenarios
+        """
+        value = np.array(val, dtype=float)
+        B = self.ss.transform(np.atleast_2d(value))
+        H = rbf_features(B, self.centers, self.betas)
+        y_pred = np.clip(H.dot(self.weights[:-1]) + self.weights[-1], 0, 1)
+        if value.ndim == 1:
+            return y_pred[0]
+        return y_pred
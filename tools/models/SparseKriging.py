@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from scipy.linalg import cho_factor, cho_solve
+from sklearn import preprocessing
+from sklearn.cluster import KMeans
+from sklearn.gaussian_process import GaussianProcessRegressor
+from sklearn.gaussian_process.kernels import ConstantKernel, RBF, WhiteKernel
+
+
+class SparseKriging:
+    """
+    Inducing-point (DTC) Kriging for all fitness targets at once.
+    The inputs are standardized once and one ARD RBF kernel is shared by every target, its
+    hyperparameters are fit on a subset of at most n_hyper rows. Training costs O(n m^2) for m
+    inducing points, new cases are added with update() without touching the old rows.
+    """
+
+    def __init__(self, data=None, label=None, n_inducing=256, n_hyper=512, jitter=1e-6, random_state=0):
+        self.n_inducing = n_inducing
+        self.n_hyper = n_hyper
+        self.jitter = jitter
+        self.random_state = random_state
+        self.create_model_from_cluster(data, label)
+
+    def create_model_from_cluster(self, data, label):
+        X = np.array(data, dtype=float)
+        y = np.array(label, dtype=float)
+        self.single_target = y.ndim == 1
+        y = np.clip(y.reshape(len(y), -1), 0, 1)
+
+        self.scaler = preprocessing.StandardScaler()
+        X = self.scaler.fit_transform(X)
+        self.y_mean = y.mean(axis=0)
+        self.y_std = y.std(axis=0)
+        varying = self.y_std > 0
+        self.y_std[~varying] = 1.
+
+        # sklearn sums the marginal likelihood over the target columns, so the kernel is shared.
+        # Constant targets are left out, they would drive the noise level to its lower bound
+        kernel = ConstantKernel(1.0) * RBF(np.ones(X.shape[1])) + WhiteKernel(1e-1, noise_level_bounds=(1e-3, 1e1))
+        if varying.any():
+            rng = np.random.RandomState(self.random_state)
+            subset = rng.choice(len(X), min(len(X), self.n_hyper), replace=False)
+            gp = GaussianProcessRegressor(kernel=kernel, random_state=self.random_state)
+            kernel = gp.fit(X[subset], ((y[subset] - self.y_mean) / self.y_std)[:, varying]).kernel_
+        self.signal = kernel.k1.k1.constant_value
+        self.length_scale = np.asarray(kernel.k1.k2.length_scale, dtype=float)
+        self.noise = kernel.k2.noise_level
+
+        m = min(len(X), self.n_inducing)
+        self.inducing = KMeans(n_clusters=m, n_init=1, random_state=self.random_state).fit(X).cluster_centers_
+        self.Kmm = self._kernel(self.inducing, self.inducing) + self.jitter * self.signal * np.eye(m)
+        self.Kmm_factor = cho_factor(self.Kmm, lower=True)
+        self.A = np.zeros((m, m))
+        self.b = np.zeros((m, y.shape[1]))
+        self.n = 0
+        self._add(X, y)
+
+    def _kernel(self, X1, X2):
+        X1, X2 = X1 / self.length_scale, X2 / self.length_scale
+        sq = (X1**2).sum(1)[:, None] + (X2**2).sum(1)[None, :] - 2 * X1.dot(X2.T)
+        return self.signal * np.exp(-0.5 * np.maximum(sq, 0))
+
+    def _add(self, X, y):
+        Knm = self._kernel(X, self.inducing)
+        self.A += Knm.T.dot(Knm)
+        self.b += Knm.T.dot((y - self.y_mean) / self.y_std)
+        self.n += len(X)
+        self.factor = cho_factor(self.noise * self.Kmm + self.A, lower=True)
+        self.alpha = cho_solve(self.factor, self.b)
+
+    def update(self, data, label):
+        """
+        Adds newly simulated cases, the scaler, kernel and inducing points stay fixed
+        """
+        X = self.scaler.transform(np.atleast_2d(np.array(data, dtype=float)))
+        y = np.clip(np.array(label, dtype=float).reshape(len(X), -1), 0, 1)
+        self._add(X, y)
+
+    def predict(self, value, return_std=False):
+        """
+        Posterior mean [n] (or [n, targets]), with return_std also the predictive std of the same shape.
+        The variance is the same for every target up to their scale, since they share the kernel.
+        """
+        B = self.scaler.transform(np.atleast_2d(np.array(value, dtype=float)))
+        Kxm = self._kernel(B, self.inducing)
+        y_pred = Kxm.dot(self.alpha) * self.y_std + self.y_mean
+        if self.single_target:
+            y_pred = y_pred[:, 0]
+        if not return_std:
+            return y_pred
+
+        # DTC: k(x,x) - Q(x,x) + noise * Kxm (noise Kmm + A)^-1 Kmx, plus the observation noise
+        Kmx = Kxm.T
+        var = self.signal - (Kmx * cho_solve(self.Kmm_factor, Kmx)).sum(0) \
+              + self.noise * (Kmx * cho_solve(self.factor, Kmx)).sum(0) + self.noise
+        std = np.sqrt(np.maximum(var, 0))[:, None] * self.y_std
+        if self.single_target:
+            std = std[:, 0]
+        return y_pred, std
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# the notebooks and the pickles import the models as models.<name> from tools/
+TOOLS_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if TOOLS_ROOT not in sys.path:
+    sys.path.insert(0, TOOLS_ROOT)
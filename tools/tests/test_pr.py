@@ -0,0 +1,36 @@
+import os
+
+import joblib
+import numpy as np
+import pytest
+
+from models.PR import Polynomial_Regression
+
+
+MODEL_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'models')
+TARGETS = ['RouteCompletionTest', 'CollisionTest', 'OutsideRouteLanesTest', 'Timeout']
+
+
+@pytest.mark.filterwarnings('ignore')
+@pytest.mark.parametrize('target', TARGETS)
+def test_shipped_pickle_predicts(target):
+    model = joblib.load(os.path.join(MODEL_DIR, 'regression-PR-{}.pkl'.format(target)))
+    X = np.random.RandomState(0).rand(5, 14)
+    expected = model.pol_reg.predict(model.poly_reg.transform(model.scaler.transform(X)))
+    prediction = model.predict(X)
+    assert prediction.shape == (5,)
+    np.testing.assert_allclose(prediction, expected)
+
+
+def test_fixed_degree_is_least_squares():
+    from sklearn.linear_model import LinearRegression
+    from sklearn.preprocessing import PolynomialFeatures, StandardScaler
+
+    rng = np.random.RandomState(0)
+    X, y = rng.rand(500, 4), rng.rand(500)
+    model = Polynomial_Regression(degree=2, data=X, label=y)
+    scaler, poly = StandardScaler().fit(X), PolynomialFeatures(degree=2)
+    reference = LinearRegression().fit(poly.fit_transform(scaler.transform(X)), y)
+    X_test = rng.rand(10, 4)
+    np.testing.assert_allclose(model.predict(X_test), reference.predict(poly.transform(scaler.transform(X_test))), atol=1e-10)
+    assert model.alpha == [0.]